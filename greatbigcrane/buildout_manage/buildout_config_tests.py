@@ -16,9 +16,12 @@ limitations under the License.
 
 from django.test import TestCase
 
+import os
+import shutil
 import tempfile
 
 from buildout_manage.parser import buildout_parse, BuildoutConfig, buildout_write
+from buildout_manage.parser import buildout_extends
 
 """
 Notes:
@@ -34,6 +37,23 @@ Notes:
 class BuildoutParse(TestCase):
     """Tests for buildout_parse module"""
 
+    def test_extends_chain(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name, cfg in (("buildout.cfg", "[buildout]\nextends = base.cfg"
+                    " http://crane.example/versions.cfg\nparts =\n"),
+                    ("base.cfg", "[buildout]\nextends = buildout.cfg "
+                        "shared/versions.cfg\n")):
+                with open(os.path.join(directory, name), "w") as fp:
+                    fp.write(cfg)
+            files, urls = buildout_extends(os.path.join(directory,
+                "buildout.cfg"))
+            assert files == [os.path.join(directory, name) for name in
+                    ("buildout.cfg", "base.cfg", "shared/versions.cfg")]
+            assert urls == ["http://crane.example/versions.cfg"]
+        finally:
+            shutil.rmtree(directory)
+
     def test_parse_simplest_buildout(self):
         fp = mktmpcfg(simple_buildout_cfg)
         buildout_object = buildout_parse(fp.name)
@@ -0,0 +1,142 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import errno
+import shutil
+
+from django.conf import settings
+
+from buildout_manage.parser import BuildoutConfig, buildout_parse
+from buildout_manage.parser import buildout_write, buildout_extends
+
+# The buildout options the shared cache sets, and the directory of the cache
+# each one points at
+CACHE_OPTIONS = (("eggs-directory", "eggs"), ("download-cache", "downloads"))
+
+def cache_directory():
+    return os.path.abspath(settings.BUILDOUT_CACHE_DIRECTORY)
+
+def eggs_directory():
+    return os.path.join(cache_directory(),
+            dict(CACHE_OPTIONS)["eggs-directory"])
+
+def staging_directory(project):
+    '''Where a project's buildout installs eggs. It holds a link to every
+    egg in the cache, so buildout finds those, and whatever it adds is only
+    moved into the cache once it is complete (see publish_eggs).'''
+    return os.path.join(cache_directory(), "staging", str(project.id))
+
+def defaults_filename():
+    return os.path.join(cache_directory(), "defaults.cfg")
+
+def write_defaults():
+    '''Create the shared cache and the defaults.cfg that points a buildout
+    extending it at the cache, if they don't exist yet. Returns the name of
+    defaults.cfg.'''
+    directory = cache_directory()
+    for option, name in CACHE_OPTIONS:
+        try:
+            os.makedirs(os.path.join(directory, name))
+        except OSError, e:
+            # Another job got there first
+            if e.errno != errno.EEXIST:
+                raise
+    filename = defaults_filename()
+    if not os.path.exists(filename):
+        config = BuildoutConfig()
+        for option, name in CACHE_OPTIONS:
+            config['buildout'][option] = os.path.join(directory, name)
+        temp_filename = "%s.%d" % (filename, os.getpid())
+        buildout_write(temp_filename, config)
+        os.rename(temp_filename, filename)
+    return filename
+
+def extend_defaults(filename):
+    '''Make a new buildout config extend defaults.cfg, so the project uses
+    the shared cache unless it is told otherwise.'''
+    config = buildout_parse(filename)
+    config['buildout']['extends'] = write_defaults()
+    buildout_write(filename, config)
+
+def buildout_cache(project):
+    '''How to point a project's buildout at the shared cache. Returns the
+    command line assignments for the options its own config leaves unset
+    and whether it uses the cache at all.'''
+    defaults = write_defaults()
+    files, urls = buildout_extends(project.buildout_filename())
+    configured = set()
+    for filename in files:
+        if os.path.isfile(filename):
+            configured.update(option for option, name in CACHE_OPTIONS
+                    if option in buildout_parse(filename)['buildout'])
+    options = ["buildout:%s=%s" % (option, os.path.join(cache_directory(),
+        name)) for option, name in CACHE_OPTIONS if option not in configured]
+    return options, bool(options) or defaults in files
+
+def shares_eggs(project):
+    '''Whether a project's buildout installs its eggs in the cache, because
+    its config leaves eggs-directory unset or sets it to the cache.'''
+    write_defaults()
+    files, urls = buildout_extends(project.buildout_filename())
+    for filename in files:
+        if os.path.isfile(filename):
+            value = buildout_parse(filename)['buildout'].get('eggs-directory')
+            if value is not None and value != eggs_directory():
+                return False
+    return True
+
+def stage_eggs(project):
+    '''Link every egg in the cache into the project's staging directory,
+    and return the directory.'''
+    staging = staging_directory(project)
+    if not os.path.isdir(staging):
+        os.makedirs(staging)
+    for name in os.listdir(eggs_directory()):
+        link = os.path.join(staging, name)
+        if name.endswith(".egg") and not os.path.lexists(link):
+            os.symlink(os.path.join(eggs_directory(), name), link)
+    return staging
+
+def publish_eggs(project, complete=True):
+    '''Move the eggs a buildout added to the project's staging directory
+    into the cache, leaving links behind. Buildout unpacks and builds eggs
+    right where they will be used, so buildouts running side by side must
+    never install into the cache itself: one could find another's half
+    unpacked egg. Each egg is renamed into place whole instead, and if
+    another buildout got the same egg there first, its copy is kept.
+
+    If the buildout didn't complete, what it added may be half done, so it
+    is thrown away instead.'''
+    staging = staging_directory(project)
+    for name in os.listdir(staging):
+        path = os.path.join(staging, name)
+        if os.path.islink(path) or not name.endswith(".egg"):
+            continue
+        target = os.path.join(eggs_directory(), name)
+        if complete and not os.path.lexists(target):
+            try:
+                # Fails for a directory if another buildout just published
+                # the same egg
+                os.rename(path, target)
+            except OSError:
+                pass
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+        if os.path.lexists(target):
+            os.symlink(target, path)
@@ -18,6 +18,7 @@ from ConfigParser import RawConfigParser
 from django.utils.datastructures import SortedDict
 
 import re
+import os.path
 
 whitespace = re.compile(r'\s+')
 
@@ -104,6 +105,33 @@ def buildout_parse(filename):
 
     return config
 
+def buildout_extends(filename):
+    """
+    Follow the extends option of a buildout config, returning the local
+    files of the whole chain (starting with filename) and any URLs it
+    extends, which can't be followed.
+    """
+    files = []
+    urls = []
+    pending = [os.path.abspath(filename)]
+    while pending:
+        filename = pending.pop(0)
+        if filename in files:
+            continue
+        files.append(filename)
+        if not os.path.isfile(filename):
+            continue
+        extends = buildout_parse(filename)['buildout'].get('extends', [])
+        if not isinstance(extends, list):
+            extends = [extends]
+        for extended in [e for value in extends for e in whitespace.split(value) if e]:
+            if '://' in extended:
+                urls.append(extended)
+            else:
+                pending.append(os.path.join(os.path.dirname(filename),
+                    extended))
+    return files, urls
+
 def buildout_write(fp, config):
     """
     Given a filename and a BuildoutConfig, write the contents of the BuildoutConfig to the file
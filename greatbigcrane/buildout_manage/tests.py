@@ -15,11 +15,16 @@ limitations under the License.
 """
 
 from django.test import TestCase
+from django.conf import settings
 
+import os
+import shutil
 import tempfile
 
 from buildout_manage import recipes
 from buildout_manage.parser import BuildoutConfig, buildout_parse, buildout_write
+from buildout_manage.cache import buildout_cache, shares_eggs
+from project.models import Project
 
 from buildout_config_tests import *
 
@@ -200,3 +205,42 @@ repository = http://github.com/zeromq/pyzmq.git
 as_egg = True
 
 """
+
+class BuildoutCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old_cache = settings.BUILDOUT_CACHE_DIRECTORY
+        settings.BUILDOUT_CACHE_DIRECTORY = os.path.join(self.directory,
+                'cache')
+        self.project = Project(name="crane", project_type="buildout",
+                base_directory=os.path.join(self.directory, 'crane'))
+
+    def tearDown(self):
+        settings.BUILDOUT_CACHE_DIRECTORY = self.old_cache
+        shutil.rmtree(self.directory)
+
+    def test_new_project_extends_defaults(self):
+        self.project.prep_project()
+        config = buildout_parse(self.project.buildout_filename())
+        defaults = config['buildout']['extends']
+        assert buildout_parse(defaults)['buildout']['eggs-directory'] == \
+                os.path.join(self.directory, 'cache', 'eggs')
+        assert buildout_cache(self.project) == ([], True)
+
+    def test_existing_project_gets_unset_options(self):
+        os.makedirs(self.project.base_directory)
+        with open(self.project.buildout_filename(), 'w') as cfg:
+            cfg.write("[buildout]\nparts =\neggs-directory = eggs\n")
+        assert buildout_cache(self.project) == (
+                ["buildout:download-cache=%s" % os.path.join(self.directory,
+                    'cache', 'downloads')], True)
+        with open(self.project.buildout_filename(), 'a') as cfg:
+            cfg.write("download-cache = downloads\n")
+        assert buildout_cache(self.project) == ([], False)
+
+    def test_only_eggs_in_the_cache_are_shared(self):
+        self.project.prep_project()
+        assert shares_eggs(self.project)
+        with open(self.project.buildout_filename(), 'a') as cfg:
+            cfg.write("eggs-directory = eggs\n")
+        assert not shares_eggs(self.project)
@@ -0,0 +1,195 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import uuid
+import Queue
+import threading
+
+import zmq
+
+class JobServerUnavailable(Exception):
+    pass
+
+class JobRejected(Exception):
+    '''The job server couldn't make sense of a request.'''
+    pass
+
+def check_reply(reply):
+    if reply and reply[0] == "ERROR":
+        raise JobRejected(reply[1] if len(reply) > 1 else "")
+    assert reply == ["ACK"]
+
+class JobClient(object):
+    '''Sends requests to the job server from any thread of the web app.
+
+    Every thread lazily gets its own REQ socket, since 0MQ sockets can't be
+    shared between threads. A request that isn't answered within timeout
+    seconds raises JobServerUnavailable, and its socket is thrown away (a
+    REQ socket that never got its reply can't send again).
+
+    Jobs (and batches of jobs) that can't be delivered are written to the
+    spool directory and forwarded, oldest first, the next time the server
+    answers. Once anything is spooled, a background thread also tries to
+    forward the spool every retry_interval seconds.'''
+
+    # Seconds between attempts to forward spooled jobs while idle
+    retry_interval = 30
+
+    def __init__(self, address, timeout=2, spool_directory=None):
+        self.address = address
+        self.timeout = timeout
+        self.spool_directory = spool_directory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.context = None
+        self.outbox = None
+
+    def socket(self):
+        socket = getattr(self.local, 'socket', None)
+        if socket is None:
+            self.lock.acquire()
+            try:
+                if self.context is None:
+                    self.context = zmq.Context()
+            finally:
+                self.lock.release()
+            socket = self.context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(self.address)
+            self.local.socket = socket
+        return socket
+
+    def request(self, *frames):
+        '''Send a request to the job server and return its reply frames.'''
+        socket = self.socket()
+        socket.send_multipart(list(frames))
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        if not poller.poll(self.timeout * 1000):
+            socket.close()
+            self.local.socket = None
+            raise JobServerUnavailable("No reply from the job server at %s"
+                    % self.address)
+        return socket.recv_multipart()
+
+    def send_job(self, job, wait=True):
+        '''Queue a serialized job. Returns True once the server has it and
+        False if it was spooled to be sent later.
+
+        With wait=False the job is handed to a background thread and the
+        call returns None straight away.'''
+        return self.send([job], wait)
+
+    def send_batch(self, batch_id, jobs, wait=True):
+        '''Queue a list of serialized jobs in a single request.'''
+        return self.send(["BATCH", batch_id, json.dumps(jobs)], wait)
+
+    def stats(self):
+        '''Ask the job server what is queued and running. Raises
+        JobServerUnavailable if it doesn't answer.'''
+        return json.loads(self.request("STATS")[0])
+
+    def send(self, frames, wait=True):
+        if not wait:
+            self.start_sender()
+            self.outbox.put(frames)
+            return None
+        try:
+            reply = self.request(*frames)
+        except JobServerUnavailable:
+            self.spool(frames)
+            return False
+        check_reply(reply)
+        self.forward_spool()
+        return True
+
+    def start_sender(self):
+        self.lock.acquire()
+        try:
+            if self.outbox is None:
+                self.outbox = Queue.Queue()
+                thread = threading.Thread(target=self.send_outbox)
+                thread.setDaemon(True)
+                thread.start()
+        finally:
+            self.lock.release()
+
+    def send_outbox(self):
+        while True:
+            try:
+                try:
+                    frames = self.outbox.get(timeout=self.retry_interval)
+                except Queue.Empty:
+                    self.forward_spool()
+                    continue
+                self.send(frames)
+            except Exception, e:
+                # Keep the thread alive to try again later
+                print "Couldn't send to the job server: %r" % e
+                time.sleep(self.retry_interval)
+
+    def spool(self, frames):
+        if not self.spool_directory:
+            raise JobServerUnavailable("No reply from the job server at %s"
+                    % self.address)
+        if not os.path.isdir(self.spool_directory):
+            os.makedirs(self.spool_directory)
+        # Name by time so jobs are forwarded in the order they were sent;
+        # write and rename so a half written job is never forwarded
+        name = "%.6f-%s.job" % (time.time(), uuid.uuid4().hex)
+        temp_filename = os.path.join(self.spool_directory, name + ".tmp")
+        with open(temp_filename, "w") as spool_file:
+            spool_file.write(json.dumps(frames))
+        os.rename(temp_filename, os.path.join(self.spool_directory, name))
+        # Forward it even if nothing else is sent
+        self.start_sender()
+
+    def spooled(self):
+        if not self.spool_directory or not os.path.isdir(self.spool_directory):
+            return []
+        return sorted(name for name in os.listdir(self.spool_directory)
+                if name.endswith(".job"))
+
+    def forward_spool(self):
+        '''Send spooled jobs to the server until it stops answering. Jobs it
+        rejects are dropped, since sending them again won't help, and
+        don't stop the rest from being forwarded.'''
+        for name in self.spooled():
+            filename = os.path.join(self.spool_directory, name)
+            # Claim the job, in case another thread or process is
+            # forwarding the spool too
+            claimed = "%s.%s-%s" % (filename, os.getpid(),
+                    threading.currentThread().getName())
+            try:
+                os.rename(filename, claimed)
+            except OSError:
+                continue
+            with open(claimed) as spool_file:
+                frames = [frame.encode('utf-8')
+                        for frame in json.load(spool_file)]
+            try:
+                reply = self.request(*frames)
+            except JobServerUnavailable:
+                os.rename(claimed, filename)
+                return
+            os.remove(claimed)
+            try:
+                check_reply(reply)
+            except JobRejected, e:
+                print "Dropping spooled job %s: %s" % (name, e)
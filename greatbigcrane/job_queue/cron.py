@@ -0,0 +1,108 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+
+# The fields of a rule in order, with the values each can take
+FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31),
+        ("month", 1, 12), ("day of week", 0, 7))
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@nightly": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+def parse_field(field, name, low, high):
+    '''Return the set of values a field of a rule matches.'''
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("Bad step in %s field" % name)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = [int(value) for value in part.split('-', 1)]
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end:
+            raise ValueError("%s field must be between %d and %d" % (
+                name.capitalize(), low, high))
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronRule(object):
+    '''A crontab style rule: minute, hour, day of month, month and day of
+    week (0 or 7 is Sunday), or one of the ALIASES.
+
+    As in cron, when both the day of month and the day of week are
+    restricted, a day matching either one will do.'''
+    def __init__(self, rule):
+        self.rule = rule
+        fields = ALIASES.get(rule.strip(), rule).split()
+        if len(fields) != 5:
+            raise ValueError("A rule needs five fields: minute, hour, "
+                    "day of month, month and day of week")
+        try:
+            (self.minutes, self.hours, self.days, self.months,
+                    self.weekdays) = [parse_field(field, *spec)
+                            for field, spec in zip(fields, FIELDS)]
+        except ValueError, e:
+            if str(e).startswith("invalid literal"):
+                raise ValueError("Rule fields must be numbers, ranges, "
+                        "steps or *")
+            raise
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, date):
+        day = date.day in self.days
+        weekday = (date.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def next_after(self, when):
+        '''Return the first time after when that the rule matches.'''
+        when = when.replace(second=0, microsecond=0) + datetime.timedelta(
+                minutes=1)
+        # Rules like "0 0 30 2 *" never match; give up after a few years
+        limit = when + datetime.timedelta(days=366 * 5)
+        while when < limit:
+            if when.month not in self.months:
+                month = when.month % 12 + 1
+                when = when.replace(year=when.year + (month == 1),
+                        month=month, day=1, hour=0, minute=0)
+            elif not self.day_matches(when):
+                when = when.replace(hour=0, minute=0) + datetime.timedelta(
+                        days=1)
+            elif when.hour not in self.hours:
+                when = when.replace(minute=0) + datetime.timedelta(hours=1)
+            elif when.minute not in self.minutes:
+                when += datetime.timedelta(minutes=1)
+            else:
+                return when
+        raise ValueError("Rule %s never matches" % self.rule)
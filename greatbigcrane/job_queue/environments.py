@@ -0,0 +1,282 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import errno
+import fcntl
+import pipes
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from job_queue.executor import run_command
+
+# Files in a template that record the interpreter it was made with and the
+# requirements installed in it
+TEMPLATE_PYTHON = ".python"
+TEMPLATE_REQUIREMENTS = ".requirements"
+
+# Times to look for another template when the one chosen is pruned before
+# it can be copied
+TEMPLATE_ATTEMPTS = 3
+
+def template_directory():
+    return os.path.abspath(settings.VIRTUALENV_TEMPLATE_DIRECTORY)
+
+def virtualenv_command(path, python=None):
+    command = "virtualenv --no-site-packages"
+    if python:
+        command += " --python=%s" % pipes.quote(python)
+    return "%s %s" % (command, pipes.quote(path))
+
+def template_key(python, requirements):
+    key = hashlib.sha1(python or "")
+    key.update("\0" + "\n".join(sorted(requirements)))
+    return key.hexdigest()
+
+def read_template(path):
+    '''The interpreter and set of requirements a template was made with, or
+    None if it isn't a finished template.'''
+    try:
+        with open(os.path.join(path, TEMPLATE_PYTHON)) as python_file:
+            python = python_file.read()
+        with open(os.path.join(path, TEMPLATE_REQUIREMENTS)) as req_file:
+            requirements = set(req_file.read().splitlines())
+    except IOError:
+        return None
+    return python, requirements
+
+def templates(python):
+    '''Each finished template made with the interpreter, and the
+    requirements installed in it.'''
+    directory = template_directory()
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        # Templates still being made or being thrown away start with a dot
+        if name.startswith("."):
+            continue
+        path = os.path.join(directory, name)
+        template = read_template(path)
+        if template and template[0] == (python or ""):
+            found.append((path, template[1]))
+    return found
+
+def best_template(python, requirements):
+    '''The template with the most of requirements installed and nothing
+    else, or None if there isn't even a bare one.'''
+    requirements = set(requirements)
+    candidates = [(len(installed), path) for path, installed
+            in templates(python) if installed <= requirements]
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+def moved(path, old, new):
+    '''Where path is once what was at old is at new.'''
+    if path == old or path.startswith(old + os.sep):
+        return new + path[len(old):]
+    return path
+
+def fix_paths(directory, old, new):
+    '''Point the scripts, path files and links of an environment that was
+    made at old at new instead. Files are replaced rather than changed, so
+    the template a linked copy came from is left alone.'''
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            filename = os.path.join(root, name)
+            if os.path.islink(filename):
+                target = os.readlink(filename)
+                if moved(target, old, new) != target:
+                    os.remove(filename)
+                    os.symlink(moved(target, old, new), filename)
+                continue
+            if name in dirs or not (os.path.basename(root) == "bin" or
+                    name.endswith((".pth", ".egg-link"))):
+                continue
+            with open(filename, "rb") as script:
+                content = script.read()
+            if old not in content or "\0" in content:
+                continue
+            temp_filename = filename + ".fix"
+            with open(temp_filename, "wb") as script:
+                script.write(content.replace(old, new))
+            shutil.copymode(filename, temp_filename)
+            os.rename(temp_filename, filename)
+
+def link_tree(source, destination):
+    '''Copy source to destination as hard links, apart from the path files
+    setuptools rewrites in place, or as plain copies across filesystems.'''
+    for root, dirs, files in os.walk(source):
+        target = os.path.normpath(os.path.join(destination,
+            os.path.relpath(root, source)))
+        os.mkdir(target)
+        shutil.copystat(root, target)
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            elif name in files:
+                if not name.endswith(".pth"):
+                    try:
+                        os.link(path, os.path.join(target, name))
+                        continue
+                    except OSError:
+                        pass
+                shutil.copy2(path, os.path.join(target, name))
+
+def lock_filename(path):
+    return os.path.join(os.path.dirname(path),
+            ".%s.lock" % os.path.basename(path))
+
+@contextmanager
+def template_lock(path, shared=True):
+    '''Hold the lock on a template: shared while it is being copied, and
+    exclusive while it is pruned. Yields whether the lock was taken, which
+    is never waited for when it is exclusive, since a template in use isn't
+    pruned.'''
+    with open(lock_filename(path), "a") as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_SH if shared else
+                    fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        yield True
+
+def copy_tree(source, destination):
+    '''Copy source to destination, sharing its files through reflinks
+    where the filesystem has them and hard links where it doesn't.'''
+    with open(os.devnull, "w") as devnull:
+        reflinked = subprocess.call(["cp", "-a", "--reflink=always",
+            source, destination], stdout=devnull, stderr=devnull) == 0
+    if not reflinked:
+        shutil.rmtree(destination, ignore_errors=True)
+        link_tree(source, destination)
+
+def copy_environment(template, destination):
+    '''Make a new environment at destination from a template, and return
+    the requirements installed in it, or None if the template was pruned
+    before it could be copied.'''
+    with template_lock(template):
+        installed = read_template(template)
+        if installed is None:
+            return None
+        # Recently used templates are the last to be pruned
+        os.utime(template, None)
+        copy_tree(template, destination)
+    for name in (TEMPLATE_PYTHON, TEMPLATE_REQUIREMENTS):
+        os.remove(os.path.join(destination, name))
+    fix_paths(destination, template, destination)
+    return installed[1]
+
+def make_template(python, requirements=(), environment=None):
+    '''Make a template from a copy of environment, which has requirements
+    installed, or a bare one from a new environment if there is none.
+    Returns the template, or None if it couldn't be made, and the output of
+    making it.'''
+    directory = template_directory()
+    path = os.path.join(directory, template_key(python, requirements))
+    build_directory = tempfile.mkdtemp(prefix=".build-", dir=directory)
+    build = os.path.join(build_directory, "env")
+    try:
+        if environment:
+            copy_tree(environment, build)
+            returncode, response = 0, ""
+        else:
+            environment = build
+            returncode, response = run_command(virtualenv_command(build,
+                python))
+        if returncode:
+            return None, response
+        with open(os.path.join(build, TEMPLATE_REQUIREMENTS), "w") as req_file:
+            req_file.write("".join("%s\n" % requirement
+                for requirement in sorted(requirements)))
+        with open(os.path.join(build, TEMPLATE_PYTHON), "w") as python_file:
+            python_file.write(python or "")
+        fix_paths(build, environment, path)
+        try:
+            os.rename(build, path)
+        except OSError:
+            # Another job made the same template first
+            pass
+        return path, response
+    finally:
+        shutil.rmtree(build_directory, ignore_errors=True)
+
+def prune_templates():
+    '''Throw away the least recently used templates beyond the
+    VIRTUALENV_TEMPLATES most recent, leaving any being copied.'''
+    directory = template_directory()
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+            if not name.startswith(".")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[settings.VIRTUALENV_TEMPLATES:]:
+        trash = tempfile.mkdtemp(prefix=".old-", dir=directory)
+        with template_lock(path, shared=False) as locked:
+            if locked:
+                # Move it out of the way first, so nothing starts copying it
+                try:
+                    os.rename(path, os.path.join(trash, "env"))
+                    os.remove(lock_filename(path))
+                except OSError:
+                    # Another job pruned it first
+                    pass
+        shutil.rmtree(trash, ignore_errors=True)
+
+def environment_template(python, requirements):
+    '''The template for the interpreter with the most of requirements
+    installed, making a bare one if there are none. Returns the template,
+    or None if it couldn't be made, and the output of making it.'''
+    try:
+        os.makedirs(template_directory())
+    except OSError, e:
+        # Another job got there first
+        if e.errno != errno.EEXIST:
+            raise
+    template = best_template(python, requirements)
+    if template:
+        return template, ""
+    return make_template(python)
+
+def new_environment(python, requirements, destination):
+    '''Make an environment at destination by copying the template with the
+    most of requirements installed. Returns the requirements installed in
+    it, or None if it couldn't be made, and the output of making it.'''
+    response = ""
+    for attempt in range(TEMPLATE_ATTEMPTS):
+        template, output = environment_template(python, requirements)
+        response += output
+        if template is None:
+            return None, response
+        installed = copy_environment(template, destination)
+        if installed is not None:
+            return installed, response
+    return None, response + "The templates were pruned while being copied\n"
+
+def save_template(python, requirements, environment):
+    '''Keep a copy of environment, which has requirements installed, as a
+    template for the next environments that need them.'''
+    path, response = make_template(python, requirements, environment)
+    prune_templates()
+    return path, response
@@ -0,0 +1,530 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import Queue
+import signal
+import select
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Seconds between flushes of a running job's log to disk
+FLUSH_INTERVAL = 0.5
+
+# How much of the start and the end of a command's output to keep for its
+# notification
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 192 * 1024
+
+# Seconds a killed command gets to exit after SIGTERM before it is sent
+# SIGKILL
+KILL_GRACE = 5
+
+# The job running on this thread, set by the job processor
+current = threading.local()
+
+# Jobs running on any thread, by id, so they can be cancelled from another
+running = {}
+running_lock = threading.Lock()
+# Jobs cancelled before they started running
+cancelled = set()
+
+# The CommandReactor supervising every command in this process, if the job
+# processor runs one; otherwise each command is watched by its own thread
+reactor = None
+# The WritePool database writes go through, if the job processor has one
+writes = None
+
+class JobInterrupted(Exception):
+    '''The job's commands were killed before they finished.'''
+    status = "cancelled"
+
+class JobCancelled(JobInterrupted):
+    pass
+
+class JobTimedOut(JobInterrupted):
+    status = "timeout"
+
+class RunningJob(object):
+    '''What's needed to stop a job from another thread.'''
+    def __init__(self, job_id, timeout=None):
+        self.job_id = job_id
+        self.started = time.time()
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+        # The job's running commands; a TEST job may run several at once
+        self.processes = set()
+        # Set once the job's running commands have been sent SIGTERM
+        self.killed_at = None
+        self.interrupted = None
+
+    def check(self):
+        '''Raise if the job has been cancelled or has run out of time.'''
+        if self.interrupted is None:
+            if self.cancelled.isSet():
+                self.interrupted = JobCancelled("Job %s was cancelled" % (
+                    self.job_id))
+            elif self.timeout and time.time() - self.started > self.timeout:
+                self.interrupted = JobTimedOut(
+                        "Job %s timed out after %d seconds" % (self.job_id,
+                            self.timeout))
+        if self.interrupted:
+            raise self.interrupted
+
+    def kill(self):
+        '''Kill the whole process group of each running command, politely
+        the first time and for good once KILL_GRACE has passed.'''
+        processes = [process for process in list(self.processes)
+                if process.returncode is None]
+        if not processes:
+            return
+        if self.killed_at is None:
+            self.killed_at = time.time()
+            sig = signal.SIGTERM
+        elif time.time() - self.killed_at > KILL_GRACE:
+            sig = signal.SIGKILL
+        else:
+            return
+        for process in processes:
+            try:
+                os.killpg(process.pid, sig)
+            except OSError:
+                # Already gone
+                pass
+
+def output_directory(project_id):
+    return os.path.join(settings.JOB_OUTPUT_DIRECTORY, str(project_id))
+
+def log_filename(project_id, job_id, running=False):
+    '''Where the output of a job is logged. The log has a different name
+    while the job is running, so readers can tell when it is finished.'''
+    return os.path.join(output_directory(project_id),
+            "%s.%s" % (job_id, "running" if running else "log"))
+
+def start_job(job_id, project_id, timeout=None):
+    '''Send the output of commands run on this thread to the job's log, and
+    stop them if they run for more than timeout seconds in all.'''
+    current.job_id = job_id
+    current.project_id = project_id
+    current.log = None
+    current.exit_code = None
+    current.output_size = 0
+    current.job = RunningJob(job_id, timeout)
+    running_lock.acquire()
+    try:
+        running[job_id] = current.job
+        if job_id in cancelled:
+            cancelled.discard(job_id)
+            current.job.cancelled.set()
+    finally:
+        running_lock.release()
+
+def cancel_job(job_id):
+    '''Stop a job started on any thread. A job that hasn't started yet is
+    stopped as soon as it does.'''
+    running_lock.acquire()
+    try:
+        job = running.get(job_id)
+        if job is None:
+            cancelled.add(job_id)
+            return
+        job.cancelled.set()
+        job.kill()
+    finally:
+        running_lock.release()
+
+def forget_job(job_id):
+    '''Drop a cancellation that came in too late to stop the job.'''
+    running_lock.acquire()
+    try:
+        cancelled.discard(job_id)
+    finally:
+        running_lock.release()
+
+def check_job():
+    '''Raise JobInterrupted if the current job should stop.'''
+    job = getattr(current, 'job', None)
+    if job:
+        job.check()
+
+@contextmanager
+def file_lock(filename, check=None, poll_interval=1):
+    '''Hold an exclusive lock on filename, which is shared with other
+    processes. check is called every poll_interval seconds while waiting,
+    so a cancelled job can stop waiting by raising (see check_job).'''
+    with open(filename, "a") as lock:
+        while True:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if check:
+                check()
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+def finish_job():
+    '''Close the job's log, returning the exit code of its first failed
+    command (or of its last command if none failed) and the total size of
+    its output.'''
+    log = getattr(current, 'log', None)
+    if log:
+        log.close()
+        os.rename(log.name, log_filename(current.project_id, current.job_id))
+    result = current.exit_code, current.output_size
+    running_lock.acquire()
+    try:
+        running.pop(current.job_id, None)
+    finally:
+        running_lock.release()
+    current.job_id = current.project_id = current.log = current.job = None
+    return result
+
+def job_log():
+    '''Open the log for the current job the first time it is needed.'''
+    if getattr(current, 'project_id', None) is None:
+        return None
+    if not current.log:
+        directory = output_directory(current.project_id)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        prune_logs(directory)
+        current.log = open(log_filename(current.project_id, current.job_id,
+            running=True), "a")
+    return current.log
+
+def prune_logs(directory, keep=20):
+    '''Remove all but the newest finished logs for a project.'''
+    logs = sorted((int(name.split('.')[0]), name)
+            for name in os.listdir(directory) if name.endswith('.log'))
+    for job_id, name in logs[:-keep]:
+        os.remove(os.path.join(directory, name))
+
+class OutputBuffer(object):
+    '''Keeps the start and the end of a command's output. Once there is
+    more than fits, the middle is dropped and replaced by a note saying how
+    much was skipped.'''
+    def __init__(self, head_size=HEAD_SIZE, tail_size=TAIL_SIZE):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.head = []
+        self.head_length = 0
+        self.tail = deque()
+        self.tail_length = 0
+        self.skipped = 0
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.head_length < self.head_size:
+            chunk = data[:self.head_size - self.head_length]
+            self.head.append(chunk)
+            self.head_length += len(chunk)
+            data = data[len(chunk):]
+        if not data:
+            return
+        self.tail.append(data)
+        self.tail_length += len(data)
+        while self.tail_length > self.tail_size:
+            extra = self.tail_length - self.tail_size
+            if len(self.tail[0]) <= extra:
+                dropped = self.tail.popleft()
+            else:
+                dropped = self.tail[0][:extra]
+                self.tail[0] = self.tail[0][extra:]
+            self.tail_length -= len(dropped)
+            self.skipped += len(dropped)
+
+    def getvalue(self):
+        output = ''.join(self.head)
+        if self.skipped:
+            output += "\n\n[... %d bytes of output skipped ...]\n\n" % (
+                    self.skipped)
+        return output + ''.join(self.tail)
+
+class SupervisedCommand(object):
+    '''A started command whose output is being read. It is put on the
+    finished queue once it closes its output.'''
+    def __init__(self, process, job, log, finished):
+        self.process = process
+        self.job = job
+        self.log = log
+        self.output = OutputBuffer()
+        self.last_flush = time.time()
+        self.finished = finished
+
+    def read(self, fd):
+        '''Read what the command has written, returning False once it has
+        closed its output.'''
+        data = os.read(fd, 4096)
+        if not data:
+            return False
+        self.output.write(data)
+        if self.log:
+            self.log.write(data)
+        return True
+
+    def tick(self, now):
+        '''Flush the log now and then, and kill the command once its job
+        has been cancelled or has run out of time.'''
+        if self.log and now - self.last_flush >= FLUSH_INTERVAL:
+            self.log.flush()
+            self.last_flush = now
+        if self.job:
+            try:
+                self.job.check()
+            except JobInterrupted:
+                self.job.kill()
+
+class CommandReactor(object):
+    '''Watches the output of many commands at once.
+
+    run_command uses a private reactor to watch a job's own commands from
+    the job's thread. The job processor's --multiplex mode starts a shared
+    one on a thread of its own, which job threads hand their commands to
+    before sleeping until they have finished; a processor running dozens
+    of buildouts at once then has one thread selecting on all of their
+    output, flushing logs and killing cancelled or timed out commands,
+    rather than dozens of threads each waking up to do so.'''
+    def __init__(self):
+        # Commands being watched, by the descriptor of their output
+        self.commands = {}
+        self.lock = threading.Lock()
+        # Written to when a command is added to a started reactor, to wake
+        # the select up
+        self.wake_read = self.wake_write = None
+
+    def start(self):
+        self.wake_read, self.wake_write = os.pipe()
+        thread = threading.Thread(target=self.run)
+        thread.setDaemon(True)
+        thread.start()
+
+    def add(self, command):
+        self.lock.acquire()
+        try:
+            self.commands[command.process.stdout.fileno()] = command
+        finally:
+            self.lock.release()
+        if self.wake_write is not None:
+            os.write(self.wake_write, "x")
+
+    def run(self):
+        while True:
+            self.poll(FLUSH_INTERVAL)
+
+    def poll(self, timeout):
+        '''Read whatever the commands write within timeout seconds, then
+        flush their logs and kill those whose job should stop.'''
+        self.lock.acquire()
+        try:
+            commands = self.commands.copy()
+        finally:
+            self.lock.release()
+        fds = commands.keys()
+        if self.wake_read is not None:
+            fds.append(self.wake_read)
+        for fd in select.select(fds, [], [], timeout)[0]:
+            if fd == self.wake_read:
+                os.read(fd, 4096)
+            elif not commands[fd].read(fd):
+                self.lock.acquire()
+                try:
+                    del self.commands[fd]
+                finally:
+                    self.lock.release()
+                command = commands.pop(fd)
+                command.finished.put(command)
+        now = time.time()
+        for command in commands.values():
+            command.tick(now)
+
+class WritePool(object):
+    '''A bounded set of threads that notifications and job runs are
+    written on. Only those writes go through it: jobs still read and save
+    their projects on their own threads, so each running job holds a
+    database connection of its own, which run_job closes once the job is
+    over.'''
+    def __init__(self, size=2):
+        self.requests = Queue.Queue()
+        for i in range(size):
+            thread = threading.Thread(target=self.work)
+            thread.setDaemon(True)
+            thread.start()
+
+    def call(self, function, *args, **kwargs):
+        '''Run function on one of the pool's threads, returning what it
+        returns or raising what it raises.'''
+        result = {}
+        done = threading.Event()
+        self.requests.put((function, args, kwargs, result, done))
+        done.wait()
+        if 'error' in result:
+            raise result['error'][0], result['error'][1], result['error'][2]
+        return result['value']
+
+    def work(self):
+        while True:
+            function, args, kwargs, result, done = self.requests.get()
+            try:
+                result['value'] = function(*args, **kwargs)
+            except Exception:
+                result['error'] = sys.exc_info()
+            done.set()
+
+def write(function, *args, **kwargs):
+    '''Make a database write through the processor's WritePool if it has
+    one, or on this thread otherwise.'''
+    if writes is None:
+        return function(*args, **kwargs)
+    return writes.call(function, *args, **kwargs)
+
+def run_command(command, cwd=None, recoverable=False):
+    '''Run a shell command, returning its exit code and combined output.
+
+    Output is read as it is produced and written to the current job's log,
+    which is flushed every FLUSH_INTERVAL seconds so the web app can show
+    it while the command is still running. Only the head and tail of very
+    long output is returned.
+
+    The command runs in a process group of its own. If the job is
+    cancelled or runs out of time, the whole group is killed and
+    JobInterrupted is raised.
+
+    A command is recoverable if the job goes on without it when it fails,
+    so its exit code doesn't count toward the job's (see finish_job).'''
+    return run_commands([command], cwd, recoverable=recoverable)[0]
+
+def run_commands(commands, cwd=None, parallel=None, recoverable=False):
+    '''Run shell commands side by side, at most parallel of them at once
+    (all of them by default), returning the exit code and output of each,
+    in the order they were given. Their output is interleaved in the job's
+    log but kept apart in what is returned. See run_command.'''
+    job = getattr(current, 'job', None)
+    if job:
+        job.check()
+    log = job_log()
+    watcher = reactor or CommandReactor()
+    finished = Queue.Queue()
+    waiting = deque(enumerate(commands))
+    running = {}
+    results = [None] * len(commands)
+    while waiting or running:
+        while waiting and len(running) < (parallel or len(commands)) and not (
+                job and job.interrupted):
+            index, command = waiting.popleft()
+            process = subprocess.Popen(command, cwd=cwd,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    shell=True, preexec_fn=os.setsid)
+            if job:
+                if not job.processes:
+                    job.killed_at = None
+                job.processes.add(process)
+            supervised = SupervisedCommand(process, job, log, finished)
+            running[supervised] = index
+            watcher.add(supervised)
+        if not running:
+            # The job was interrupted before the rest could start
+            break
+        if watcher is not reactor:
+            watcher.poll(FLUSH_INTERVAL)
+        done = []
+        if watcher is reactor:
+            done.append(finished.get())
+        while not finished.empty():
+            done.append(finished.get())
+        for supervised in done:
+            process = supervised.process
+            process.stdout.close()
+            process.wait()
+            if job:
+                job.processes.discard(process)
+            results[running.pop(supervised)] = (process.returncode,
+                    supervised.output)
+    if log:
+        log.flush()
+    if job:
+        # A cancelled command may have been killed between checks
+        try:
+            job.check()
+        except JobInterrupted:
+            pass
+    if getattr(current, 'job_id', None) is not None:
+        for result in results:
+            if result is None:
+                continue
+            if not current.exit_code and not recoverable:
+                current.exit_code = result[0]
+            current.output_size += result[1].size
+    if job and job.interrupted:
+        if log:
+            log.write("\n[%s]\n" % job.interrupted)
+        raise job.interrupted
+    return [(returncode, output.getvalue())
+            for returncode, output in results]
+
+def latest_job(project_id):
+    '''Return the id of the newest job with a log for the project.'''
+    directory = output_directory(project_id)
+    if not os.path.isdir(directory):
+        return None
+    job_ids = [int(name.split('.')[0]) for name in os.listdir(directory)
+            if name.endswith('.log') or name.endswith('.running')]
+    if not job_ids:
+        return None
+    return max(job_ids)
+
+def read_output(project_id, job_id, offset=None, tail=16 * 1024,
+        limit=64 * 1024):
+    '''Read a chunk of a job's log. Without an offset, reading starts near
+    the end of the log.
+
+    Returns a dict with the job id, the output read, the offset to read
+    from next time and whether the job is still running; or None if there
+    is no log.'''
+    # The log may be renamed as the job finishes, so try the running name
+    # first
+    for running in (True, False):
+        try:
+            log = open(log_filename(project_id, job_id, running))
+        except IOError:
+            continue
+        break
+    else:
+        return None
+
+    with log:
+        log.seek(0, os.SEEK_END)
+        size = log.tell()
+        if offset is None or offset > size:
+            offset = max(0, size - tail)
+        log.seek(offset)
+        output = log.read(limit)
+    return {'job': job_id, 'output': output, 'offset': offset + len(output),
+            'running': running}
@@ -1,5 +1,45 @@
+import datetime
+
 from django import forms
+from project.models import PROJECT_FILTERS
+from job_queue.jobs import BULK_COMMANDS
+from job_queue.models import Schedule
+from job_queue.cron import CronRule
+
+make_choice = lambda x: ([(p,p) for p in x])
 
 class StartAppForm(forms.Form):
     "Simple form to prompt for the appname when running django startapp."
     app_name = forms.CharField()
+
+class BulkJobForm(forms.Form):
+    "Pick a command to run on a group of projects."
+    command = forms.ChoiceField(choices=make_choice(sorted(BULK_COMMANDS)))
+    projects = forms.ChoiceField(choices=make_choice(PROJECT_FILTERS))
+
+class ScheduleForm(forms.ModelForm):
+    "Run a command on a project whenever a cron style rule matches."
+    class Meta:
+        model = Schedule
+        fields = ('command', 'rule', 'jitter', 'enabled')
+
+    def clean_rule(self):
+        rule = self.cleaned_data['rule'].strip()
+        try:
+            CronRule(rule).next_after(datetime.datetime.now())
+        except ValueError, e:
+            raise forms.ValidationError(str(e))
+        return rule
+
+    def save(self, *args, **kwargs):
+        # Work out when the (possibly changed) rule next matches
+        self.instance.next_run = None
+        return super(ScheduleForm, self).save(*args, **kwargs)
+
+class GroupScheduleForm(ScheduleForm):
+    "Run a command on a group of projects whenever a rule matches."
+    projects = forms.ChoiceField(choices=make_choice(PROJECT_FILTERS))
+
+    class Meta:
+        model = Schedule
+        fields = ('command', 'projects', 'rule', 'jitter', 'enabled')
@@ -15,45 +15,287 @@ limitations under the License.
 """
 
 import os.path
-import zmq
 import json
+import uuid
+import pipes
+import signal
+import select
+import hashlib
 import subprocess
-from project.models import Project
+from django.conf import settings
+from project.models import Project, PipProject
 from preferences.models import Preference
 from notifications.models import Notification
-from buildout_manage.parser import buildout_parse
-
-addr = 'tcp://127.0.0.1:5555'
-
-context = zmq.Context()
-socket = context.socket(zmq.REQ)
-socket.connect(addr)
+from buildout_manage.parser import buildout_parse, buildout_extends
+from buildout_manage.cache import buildout_cache, shares_eggs, stage_eggs
+from buildout_manage.cache import publish_eggs
+from job_queue.executor import run_command, run_commands, write, check_job
+from job_queue.executor import JobInterrupted
+from job_queue.client import JobClient
+from job_queue.wheelhouse import parse_requirements, build_wheels
+from job_queue.wheelhouse import install_command, install_packages_command
+from job_queue.wheelhouse import uninstall_command, requirement_name
+from job_queue.environments import new_environment, save_template
+from job_queue.environments import virtualenv_command
+from job_queue.mirrors import update_mirror, clone_command, pull_command
+from job_queue.pipeline import validate
+
+client = JobClient(settings.JOB_SERVER_ADDRESS, settings.JOB_CLIENT_TIMEOUT,
+        settings.JOB_SPOOL_DIRECTORY)
 
 def queue_job(command, **kwargs):
-    '''Run the given command on the job queue, passing it any arguments as kwargs.'''
+    '''Run the given command on the job queue, passing it any arguments as kwargs.
+    Returns False if the job server is down and the job was spooled.'''
     serialized = make_job_string(command, **kwargs)
-    send_job(serialized)
-
-def send_job(serialized):
-    socket.send(serialized)
-    assert socket.recv() == "ACK"
+    return send_job(serialized)
+
+def send_job(serialized, wait=True):
+    '''Send a serialized job to the job server. See JobClient.send_job.'''
+    return client.send_job(serialized, wait)
+
+def queue_batch(command, projects, wait=True, **kwargs):
+    '''Run the command on many projects with a single request to the job
+    server. Projects the command doesn't make sense for are skipped.
+
+    Returns the batch id, the ids of the projects that jobs were queued for
+    and the result of JobClient.send_batch.'''
+    applies = BULK_COMMANDS[command]
+    project_ids = [project.id for project in projects if applies(project)]
+    batch = uuid.uuid4().hex
+    jobs = [make_job_string(command, project_id=project_id, **kwargs)
+            for project_id in project_ids]
+    sent = True
+    if jobs:
+        sent = client.send_batch(batch, jobs, wait)
+    return batch, project_ids, sent
+
+def pipeline_step(name, command, after=(), on_failure="stop", **kwargs):
+    '''One step of a pipeline, running command once the steps named in
+    after have finished. If it fails, the steps after it are skipped when
+    on_failure is "stop" and run anyway when it is "continue".'''
+    return {'name': name, 'job': make_job_string(command, **kwargs),
+            'after': list(after), 'on_failure': on_failure}
+
+def queue_pipeline(steps, wait=True):
+    '''Queue a graph of pipeline_steps, which the job server runs in
+    dependency order. Returns False if the pipeline was spooled.'''
+    spec = {'steps': steps}
+    validate(spec)
+    return client.send(["PIPELINE", json.dumps(spec)], wait)
+
+def update_steps(project):
+    '''Pull a project, bring its dependencies up to date and test it,
+    stopping at the first step that fails.'''
+    steps = []
+    if project.git_repo:
+        steps.append(pipeline_step("pull", "GITPULL", project_id=project.id))
+    install = "BUILDOUT" if project.project_type == "buildout" else "PIPINSTALL"
+    steps.append(pipeline_step("install", install,
+        after=[step['name'] for step in steps], project_id=project.id))
+    steps.append(pipeline_step("test", "TEST", after=["install"],
+        project_id=project.id))
+    return steps
+
+def clone_steps(project):
+    '''Clone a new project, then bootstrap it if it uses buildout.'''
+    steps = [pipeline_step("clone", "GITCLONE", project_id=project.id)]
+    if project.project_type == "buildout":
+        steps.append(pipeline_step("bootstrap", "BOOTSTRAP", after=["clone"],
+            project_id=project.id))
+    return steps
+
+def queue_stats():
+    '''What the job server has queued and running; see JobServer.stats.'''
+    return client.stats()
+
+def cancel_job(job_id):
+    '''Ask the job server to drop a queued job or kill a running one.'''
+    return client.send(["CANCEL", str(job_id)])
+
+def notify(**kwargs):
+    '''Create a Notification, through the job processor's pool of database
+    threads if it has one.'''
+    return write(Notification.objects.create, **kwargs)
+
+# How much command output to hash at a time, and seconds between checks
+# of the job while the command writes nothing
+FINGERPRINT_CHUNK = 64 * 1024
+FINGERPRINT_POLL = 0.5
+
+def hash_output(fingerprint, command, cwd, consume=None):
+    '''Feed the output of command into fingerprint a chunk at a time,
+    passing each chunk to consume as well, and return whether the command
+    succeeded. The job is checked between chunks and while the command is
+    quiet, so neither a large diff nor a slow git can hold up its timeout
+    or cancellation; the command runs in its own process group, so git is
+    killed along with the shell.'''
+    fingerprint.update(command + "\0")
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, cwd=cwd, shell=True,
+                stdout=subprocess.PIPE, stderr=devnull,
+                preexec_fn=os.setsid)
+    output = process.stdout.fileno()
+    try:
+        while True:
+            check_job()
+            if not select.select([output], [], [], FINGERPRINT_POLL)[0]:
+                continue
+            chunk = os.read(output, FINGERPRINT_CHUNK)
+            if not chunk:
+                break
+            fingerprint.update(chunk)
+            if consume:
+                consume(chunk)
+    except JobInterrupted:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # Already gone
+            pass
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+    fingerprint.update("\0")
+    return process.wait() == 0
+
+def test_fingerprint(project, test_binaries):
+    '''A hash of everything a project's test results depend on: the git
+    commit it has checked out, its uncommitted changes and untracked files,
+    its buildout.cfg and pip requirements and the test commands themselves.
+
+    Untracked files count by name, size and modification time, so an
+    untracked eggs directory doesn't have to be read every time. Returns
+    None if the project isn't a git checkout, since then there is no
+    telling what changed.'''
+    directory = project.base_directory
+    if not os.path.isdir(os.path.join(directory, '.git')):
+        return None
+    fingerprint = hashlib.sha1()
+    for command in ("git rev-parse HEAD", "git diff HEAD --binary"):
+        if not hash_output(fingerprint, command, directory):
+            return None
+    untracked = []
+    if not hash_output(fingerprint,
+            "git ls-files --others --exclude-standard -z", directory,
+            untracked.append):
+        return None
+    for name in sorted(name for name in "".join(untracked).split("\0")
+            if name):
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        fingerprint.update("%s\0%d\0%d\0" % (name, stat.st_size,
+            stat.st_mtime))
+    for filename in (project.buildout_filename(),
+            project.requirements_filename()):
+        if os.path.isfile(filename):
+            with open(filename) as config:
+                fingerprint.update(config.read())
+        fingerprint.update("\0")
+    fingerprint.update("\0".join(test_binaries))
+    return fingerprint.hexdigest()
+
+def buildout_fingerprint(project):
+    '''A hash of everything that decides what bin/buildout does: each
+    config in the extends chain of buildout.cfg (and so its [versions]),
+    the setup.py and setup.cfg of each develop path, and what the last
+    buildout installed.'''
+    fingerprint = hashlib.sha1()
+    files, urls = buildout_extends(project.buildout_filename())
+    develop = []
+    for filename in files:
+        fingerprint.update(filename + "\0")
+        if os.path.isfile(filename):
+            with open(filename) as config:
+                fingerprint.update(config.read())
+            paths = buildout_parse(filename)['buildout'].get('develop', [])
+            if not isinstance(paths, list):
+                paths = [paths]
+            develop.extend(path for value in paths for path in value.split())
+        fingerprint.update("\0")
+    fingerprint.update("\0".join(urls) + "\0")
+    for path in develop:
+        for name in ("setup.py", "setup.cfg"):
+            filename = os.path.join(project.base_directory, path, name)
+            fingerprint.update(filename + "\0")
+            if os.path.isfile(filename):
+                with open(filename) as setup:
+                    fingerprint.update(setup.read())
+            fingerprint.update("\0")
+    # A fresh bootstrap, or a buildout run by hand, means buildout must run
+    installed = os.path.join(project.base_directory, '.installed.cfg')
+    if os.path.isfile(installed):
+        with open(installed) as config:
+            fingerprint.update(config.read())
+    script = os.path.join(project.base_directory, 'bin', 'buildout')
+    if os.path.exists(script):
+        fingerprint.update("%d" % os.stat(script).st_mtime)
+    fingerprint.update(" ".join(buildout_cache(project)[0]))
+    return fingerprint.hexdigest()
+
+def run_buildout_command(project, command):
+    '''Run bootstrap or buildout in the project, using the shared egg and
+    download cache for whatever its config doesn't say otherwise. Buildouts
+    sharing the egg cache install into a staging directory of their own and
+    run side by side (see publish_eggs).'''
+    options = buildout_cache(project)[0]
+    staged = shares_eggs(project)
+    if staged:
+        options = ["buildout:eggs-directory=%s" % stage_eggs(project)] + [
+                option for option in options
+                if not option.startswith("buildout:eggs-directory=")]
+    command = " ".join([command] + [pipes.quote(option)
+        for option in options])
+    if not staged:
+        return run_command(command, cwd=project.base_directory)
+    returncode = None
+    try:
+        returncode, response = run_command(command,
+                cwd=project.base_directory)
+    finally:
+        publish_eggs(project, complete=returncode == 0)
+    return returncode, response
 
 def make_job_string(command, **kwargs):
     assert command in command_map
     kwargs.update(command=command)
     return json.dumps(kwargs)
 
-def command(command_name):
-    "Decorator that marks a function as a queuable command."
+command_map = {}
+
+# Seconds a command may run for unless it says otherwise
+DEFAULT_TIMEOUT = 10 * 60
+
+# Job server lanes, in the order they are drained
+LANES = ("interactive", "normal", "bulk")
+
+def command(command_name, lane="normal", timeout=DEFAULT_TIMEOUT,
+        max_concurrent=None, rate=None):
+    """Decorator that marks a function as a queuable command.
+
+    lane is the priority lane the job server queues the command in; quick
+    interactive commands shouldn't have to wait behind long running ones.
+    timeout is how many seconds the job processor lets the command run
+    before killing it.
+
+    max_concurrent caps how many runs of the command all the job processors
+    together may have at once, and rate, a (runs, seconds) pair, how often
+    new runs may start. The job server holds back jobs over either limit
+    and keeps dispatching other commands meanwhile."""
+    assert lane in LANES
     def wrap(function):
+        function.lane = lane
+        function.timeout = timeout
+        function.max_concurrent = max_concurrent
+        function.rate = rate
         command_map[command_name] = function
         return function
     return wrap
 
-command_map = {}
-
 # Create the actual commands here. Use command decorator to keep the map up to date
-@command("BOOTSTRAP")
+@command("BOOTSTRAP", lane="bulk", timeout=60 * 60, max_concurrent=2)
 def bootstrap(project_id):
     '''Run the bootstrap process inside the given project's base directory.'''
     project = Project.objects.get(id=project_id)
@@ -61,41 +303,54 @@ def bootstrap(project_id):
 
     project.prep_project()
 
-    process = subprocess.Popen("python bootstrap.py", cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
+    returncode, response = run_buildout_command(project,
+            "python bootstrap.py")
 
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Bootstrapping '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
-@command("BUILDOUT")
-def buildout(project_id):
-    """Run the buildout process in the given project's base directory."""
+@command("BUILDOUT", lane="bulk", timeout=60 * 60, max_concurrent=2)
+def buildout(project_id, force=False):
+    """Run the buildout process in the given project's base directory.
+
+    Unless force is given, buildout isn't run if nothing that matters to it
+    has changed since it last succeeded (see buildout_fingerprint). Eggs
+    that aren't pinned aren't upgraded by a skipped run."""
     project = Project.objects.get(id=project_id)
+    if not force and project.buildout_fingerprint == buildout_fingerprint(
+            project):
+        notify(status="success",
+                summary="Buildout '%s' no changes" % (project.name),
+                message="Nothing has changed since the last successful "
+                "buildout, so it wasn't run again.",
+                project=project)
+        return
     print("running buildout %s" % project.name)
-    Notification.objects.create(status="general",
+    notify(status="general",
             summary="Buildout '%s' started" % (project.name),
             message="Buildout for '%s' project has started" % (project.name),
             project=project)
-    process = subprocess.Popen("bin/buildout", cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
+    returncode, response = run_buildout_command(project, "bin/buildout")
+    Project.objects.filter(id=project.id).update(buildout_fingerprint=
+            buildout_fingerprint(project) if not returncode else "")
 
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Buildouting '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
-@command("TEST")
-def test_buildout(project_id):
+@command("TEST", lane="bulk", timeout=60 * 60)
+def test_buildout(project_id, force=False):
     """Run the test command in the buildout project's base directory.
-    Tries to do some intelligent guessing about how tests should be run."""
+    Tries to do some intelligent guessing about how tests should be run.
+
+    If nothing the tests depend on has changed since they last passed (see
+    test_fingerprint), they pass again without being run, unless force is
+    given."""
     project = Project.objects.get(id=project_id)
     print("running tests for %s" % project.name)
 
@@ -139,20 +394,35 @@ def test_buildout(project_id):
                 project.pipproject.test_command)
         test_binaries.append(command)
 
+    fingerprint = test_fingerprint(project, test_binaries)
+    if (not force and fingerprint and project.test_status and
+            fingerprint == project.test_fingerprint):
+        notify(status="success",
+                summary="Testing '%s' success (unchanged)" % (project.name),
+                message="Nothing has changed since the tests last passed, "
+                "so they weren't run again.",
+                project=project,
+                rerun_job=make_job_string("TEST", project_id=project_id,
+                    force=True),
+                notification_type="TEST",
+                )
+        return
+
     # Run the test commands
     errors = False
     responses = []
     try:
-        Notification.objects.create(status="general",
+        notify(status="general",
                 summary="Testing of '%s' started" % (project.name),
                 message="Testing for '%s' project has started" % (project.name),
                 project=project)
-        for binary in test_binaries:
-            process = subprocess.Popen(binary, cwd=project.base_directory,
-                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-            responses.append(process.communicate()[0])
-            errors = errors or process.returncode != 0
+        # The suites run side by side, but are reported in the order they
+        # were found
+        for returncode, response in run_commands(test_binaries,
+                cwd=project.base_directory,
+                parallel=settings.TEST_PARALLELISM):
+            responses.append(response)
+            errors = errors or returncode != 0
 
         # Make the output a little nicer when you run multiple test suites
 
@@ -170,64 +440,74 @@ def test_buildout(project_id):
             response_set.append(response)
             message.append(''.join(response_set))
     except Exception:
-        project.test_status = False
-        project.save
+        Project.objects.filter(id=project.id).update(test_status=False)
         raise
 
-    Notification.objects.create(status="success" if not errors else "error",
+    notify(status="success" if not errors else "error",
             summary="Testing '%s' %s" % (
                 project.name, "success" if not errors else "error"),
             message=('\n\n'+'*'*50+'\n\n').join(message),
             project=project,
-            rerun_job=make_job_string("TEST", project_id=project_id),
+            rerun_job=make_job_string("TEST", project_id=project_id,
+                force=True),
             notification_type="TEST",
             )
-    project.test_status = not errors
-    project.save()
+    # Only the test results are saved, so a buildout finishing meanwhile on
+    # another processor keeps its fingerprint
+    Project.objects.filter(id=project.id).update(test_status=not errors,
+            test_fingerprint=fingerprint if fingerprint and not errors else "")
 
-@command("GITCLONE")
+@command("GITCLONE", lane="bulk", timeout=60 * 60, max_concurrent=4)
 def clone_repo(project_id):
     """clone a git repo into the directory if it does not exist."""
-    from greatbigcrane.job_queue.jobs import queue_job
     project = Project.objects.get(id=project_id)
     print("cloning repo for %s" % project.name)
 
     if os.path.exists(project.base_directory):
-        Notification.objects.create(status="general",
+        notify(status="general",
                 summary="Cloning '%s' %s" % (
                     project.name, "not necessary"),
                 message="Repo not cloned because directory already exists",
                 project=project)
     else:
-        process = subprocess.Popen('git clone "%s" "%s"' % (project.git_repo, project.base_directory), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-        response = process.communicate()[0]
-
-        Notification.objects.create(status="success" if not process.returncode else "error",
+        mirror, response = update_mirror(project.git_repo, check_job)
+        if mirror:
+            command = clone_command(project.git_repo, mirror,
+                    project.base_directory)
+        else:
+            command = 'git clone "%s" "%s"' % (project.git_repo,
+                    project.base_directory)
+        returncode, output = run_command(command)
+        response += output
+
+        notify(status="success" if not returncode else "error",
                 summary="Cloning '%s' %s" % (
-                    project.name, "success" if not process.returncode else "error"),
+                    project.name, "success" if not returncode else "error"),
                 message=response,
                 project=project,
                 notification_type="GITCLONE",
                 )
 
-    if project.project_type == "buildout":
-        queue_job('BOOTSTRAP', project_id=project_id)
-
 @command("GITPULL")
 def pull_repo(project_id):
-    """Run git pull in the base directory to update from the default origin"""
+    """Run git pull in the base directory to update from the default origin,
+    by way of the repository's mirror"""
     project = Project.objects.get(id=project_id)
     print("pulling repo for %s" % project.name)
 
-    process = subprocess.Popen('git pull', cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
+    mirror, response = None, ""
+    if project.git_repo:
+        mirror, response = update_mirror(project.git_repo, check_job)
+    if mirror:
+        command = pull_command(project.git_repo, mirror)
+    else:
+        command = 'git pull'
+    returncode, output = run_command(command, cwd=project.base_directory)
+    response += output
 
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Pulling '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
@@ -238,32 +518,27 @@ def syncdb(project_id):
     project = Project.objects.get(id=project_id)
     print("running syncdb for %s" % project.name)
 
-    process = subprocess.Popen('bin/django syncdb --noinput', cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
+    returncode, response = run_command('bin/django syncdb --noinput',
+            cwd=project.base_directory)
 
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Syncdb '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
-@command("STARTAPP")
+@command("STARTAPP", lane="interactive")
 def startapp(project_id, app_name):
     """Start a new app in the django project"""
     project = Project.objects.get(id=project_id)
     print("running startapp %s for %s" % (app_name, project.name))
 
-    process = subprocess.Popen('bin/django startapp %s' % app_name,
-            cwd=project.base_directory, stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT, shell=True)
+    returncode, response = run_command('bin/django startapp %s' % app_name,
+            cwd=project.base_directory)
 
-    response = process.communicate()[0]
-
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Startapp %s '%s' %s" % (
-                app_name, project.name, "success" if not process.returncode else "error"),
+                app_name, project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
@@ -273,18 +548,16 @@ def migrate(project_id):
     project = Project.objects.get(id=project_id)
     print("running migrate for %s" % project.name)
 
-    process = subprocess.Popen('bin/django migrate', cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
+    returncode, response = run_command('bin/django migrate',
+            cwd=project.base_directory)
 
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="Migrate '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
-@command("EDIT")
+@command("EDIT", lane="interactive")
 def edit(project_id):
     """Open the user's favourite editor"""
     project = Project.objects.get(id=project_id)
@@ -302,40 +575,141 @@ def edit(project_id):
 
     process.communicate()
 
-@command("VIRTUALENV")
+def requirement_changes(project):
+    '''What to install and what to uninstall to bring the project's
+    virtualenv up to date with its requirements, going by what the last
+    successful install recorded. Returns None if there is no telling, such
+    as when the requirements include other files or editable checkouts, so
+    they all have to be installed.'''
+    pip_project = project.pipproject
+    requirements, others = parse_requirements(pip_project.requirements)
+    if others or not (pip_project.installed_requirements or
+            pip_project.installed_packages):
+        return None
+    installed = set(pip_project.installed_requirements.splitlines())
+    install = [requirement for requirement in requirements
+            if requirement not in installed]
+    # Requirements whose version changed are upgraded by installing them, and
+    # packages that aren't installed don't need uninstalling
+    wanted = set(requirement_name(requirement) for requirement in requirements)
+    frozen = set(requirement_name(package) for package in
+            pip_project.installed_packages.splitlines())
+    uninstall = sorted(set(requirement_name(requirement)
+        for requirement in installed.difference(requirements)
+        if requirement_name(requirement) not in wanted
+        and requirement_name(requirement) in frozen))
+    return install, uninstall
+
+def install_requirements(project, changes=None):
+    '''Install the project's requirements in its virtualenv from the shared
+    wheelhouse, building the wheels it is missing first, side by side. Given
+    the changes from requirement_changes, only those are made. What was
+    installed is recorded for the next time.'''
+    cwd = project.base_directory
+    activate = os.path.join(project.pipproject.virtualenv_path, 'bin',
+            'activate')
+    requirements, others = parse_requirements(project.pipproject.requirements)
+    if changes is None:
+        built, response = build_wheels(requirements, activate, cwd=cwd)
+        # Whatever couldn't be built ahead of time has to come from the index
+        returncode, output = run_command(install_command(activate,
+            offline=built and not others), cwd=cwd)
+        response += output
+    else:
+        install, uninstall = changes
+        returncode, response = 0, ""
+        if uninstall:
+            returncode, response = run_command(uninstall_command(activate,
+                uninstall), cwd=cwd)
+        if install and not returncode:
+            built, output = build_wheels(install, activate, cwd=cwd)
+            returncode, install_output = run_command(install_packages_command(
+                activate, install, offline=built), cwd=cwd)
+            response += output + install_output
+    installed_requirements = installed_packages = ""
+    if not returncode and not others:
+        # Without a record the next install is a full one, as it is now
+        freeze_code, frozen = run_command(". %s ; pip freeze" % activate,
+                cwd=cwd, recoverable=True)
+        if not freeze_code:
+            installed_requirements = "\n".join(requirements)
+            installed_packages = frozen
+    PipProject.objects.filter(id=project.pipproject.id).update(
+            installed_requirements=installed_requirements,
+            installed_packages=installed_packages)
+    return returncode, response
+
+@command("VIRTUALENV", lane="bulk", timeout=60 * 60)
 def virtualenv(project_id):
-    """Run virtualenv in the project directory"""
+    """Make the project's virtualenv by copying the template environment that
+    has the most of its requirements installed, then install the rest. The
+    result is kept as a template in turn if anything had to be installed."""
     project = Project.objects.get(id=project_id, pipproject__isnull=False)
     print "Running virtualenv for %s" % project.name
 
-    process = subprocess.Popen('virtualenv --no-site-packages %s' % (
-        project.pipproject.virtualenv_path), cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-    response = process.communicate()[0]
-
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    destination = os.path.normpath(os.path.join(project.base_directory,
+        project.pipproject.virtualenv_path))
+    if os.path.exists(destination):
+        # Leave what is installed alone and update the environment in place
+        returncode, response = run_command(virtualenv_command(destination,
+            settings.VIRTUALENV_PYTHON), cwd=project.base_directory)
+    else:
+        requirements, others = parse_requirements(
+                project.pipproject.requirements)
+        installed, response = new_environment(settings.VIRTUALENV_PYTHON,
+                requirements, destination)
+        returncode = 1
+        if installed is not None:
+            missing = [requirement for requirement in requirements
+                    if requirement not in installed]
+            # Other requirement files and checkouts can't be compared with
+            # the template, so those projects get a full install
+            changes = None if others else (missing, [])
+            returncode, output = install_requirements(project, changes)
+            response += output
+            if not returncode and missing and not others:
+                output = save_template(settings.VIRTUALENV_PYTHON,
+                        requirements, destination)[1]
+                response += output
+
+    notify(status="success" if not returncode else "error",
             summary="Virtualenv '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
 
-@command("PIPINSTALL")
-def virtualenv(project_id):
-    """Run pip install in the project directory"""
+@command("PIPINSTALL", lane="bulk", timeout=60 * 60, max_concurrent=2,
+        rate=(10, 60))
+def pip_install(project_id, force=False):
+    """Run pip install in the project directory, from the shared wheelhouse.
+
+    Unless force is given, only the requirements that changed since the last
+    successful install are installed or uninstalled, and pip isn't run at
+    all if none did (see requirement_changes)."""
     project = Project.objects.get(id=project_id, pipproject__isnull=False)
+    changes = None if force else requirement_changes(project)
+    if changes == ([], []):
+        notify(status="success",
+                summary="pip install '%s' no changes" % (project.name),
+                message="The requirements haven't changed since the last "
+                "successful install, so pip wasn't run again.",
+                project=project)
+        return
     print "Running pip install for %s" % project.name
 
-    command = "source %s ; pip install -r requirements.txt" % (
-            os.path.join(project.pipproject.virtualenv_path, 'bin', 'activate'))
-
-    process = subprocess.Popen(command, cwd=project.base_directory,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+    returncode, response = install_requirements(project, changes)
 
-    response = process.communicate()[0]
-
-    Notification.objects.create(status="success" if not process.returncode else "error",
+    notify(status="success" if not returncode else "error",
             summary="pip install '%s' %s" % (
-                project.name, "success" if not process.returncode else "error"),
+                project.name, "success" if not returncode else "error"),
             message=response,
             project=project)
+
+# Commands that can be run on many projects at once, and which projects each
+# one makes sense for
+BULK_COMMANDS = {
+    "BUILDOUT": lambda project: project.project_type == "buildout",
+    "TEST": lambda project: True,
+    "GITPULL": lambda project: bool(project.git_repo),
+    "PIPINSTALL": lambda project: project.project_type == "pip",
+}
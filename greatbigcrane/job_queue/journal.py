@@ -0,0 +1,200 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+
+class Journal(object):
+    '''Append-only record of the jobs the job server has accepted.
+
+    Every queued job is written as a "put" line and every finished job as a
+    "done" line, one JSON object per line. Writes are buffered; call sync()
+    to flush them to disk, so that a burst of jobs costs a single fsync.
+    After a crash, replay() returns the jobs that were put but never done.
+
+    Pipelines are kept the same way: a "pipeline" line holds the spec, a
+    "step" line records how each step ended and "pipeline_done" forgets the
+    whole thing. Jobs put for a pipeline step are tagged with it, in
+    steps, and jobs held back until a later time carry that time, in
+    not_before.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.next_id = 1
+        self.live = {}
+        # Unfinished pipelines by id, each a dict with its spec and the
+        # steps that have finished
+        self.pipelines = {}
+        # The pipeline id and step name of live jobs that are pipeline steps
+        self.steps = {}
+        # The time before which live jobs that were queued with a delay
+        # mustn't run
+        self.not_before = {}
+        self.garbage = 0
+        self.dirty = False
+        self.file = None
+
+    def replay(self):
+        '''Load the journal from disk, returning (job_id, job) pairs for
+        every unfinished job in the order they were queued. The journal is
+        compacted as a side effect.'''
+        if os.path.exists(self.filename):
+            with open(self.filename) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write from a crash; nothing after it
+                        # could have been synced either
+                        break
+                    self.apply(record)
+        self.compact()
+        return sorted(self.live.items())
+
+    def apply(self, record):
+        if record['op'] == 'put':
+            self.live[record['id']] = record['job'].encode('utf-8')
+            self.next_id = max(self.next_id, record['id'] + 1)
+            if 'pipeline' in record:
+                self.steps[record['id']] = (record['pipeline'], record['step'])
+            if 'not_before' in record:
+                self.not_before[record['id']] = record['not_before']
+        elif record['op'] == 'done':
+            self.live.pop(record['id'], None)
+            self.steps.pop(record['id'], None)
+            self.not_before.pop(record['id'], None)
+        elif record['op'] == 'pipeline':
+            self.pipelines[record['id']] = {'spec': record['spec'],
+                    'finished': record.get('finished', {})}
+            self.next_id = max(self.next_id, record['id'] + 1)
+        elif record['op'] == 'step':
+            if record['pipeline'] in self.pipelines:
+                self.pipelines[record['pipeline']]['finished'][
+                        record['step']] = record['status']
+        elif record['op'] == 'pipeline_done':
+            self.pipelines.pop(record['id'], None)
+        elif record['op'] == 'seq':
+            self.next_id = max(self.next_id, record['next'])
+
+    def put(self, job, pipeline=None, step=None, not_before=None):
+        '''Record a newly queued job and return its id. A job run as a
+        pipeline step is tagged with the pipeline id and step name, and a
+        delayed job with the time it may run from.'''
+        job_id = self.next_id
+        self.next_id += 1
+        self.live[job_id] = job
+        record = {'op': 'put', 'id': job_id, 'job': job}
+        if pipeline is not None:
+            self.steps[job_id] = (pipeline, step)
+            record.update(pipeline=pipeline, step=step)
+        if not_before is not None:
+            self.not_before[job_id] = not_before
+            record['not_before'] = not_before
+        self.write(record)
+        return job_id
+
+    def done(self, job_id):
+        '''Record that a job no longer needs to be replayed.'''
+        if self.live.pop(job_id, None) is not None:
+            self.steps.pop(job_id, None)
+            self.not_before.pop(job_id, None)
+            self.garbage += 2
+            self.write({'op': 'done', 'id': job_id})
+
+    def put_pipeline(self, spec):
+        '''Record a new pipeline and return its id.'''
+        pipeline_id = self.next_id
+        self.next_id += 1
+        self.pipelines[pipeline_id] = {'spec': spec, 'finished': {}}
+        self.write({'op': 'pipeline', 'id': pipeline_id, 'spec': spec})
+        return pipeline_id
+
+    def step_done(self, pipeline_id, step, status):
+        self.pipelines[pipeline_id]['finished'][step] = status
+        self.garbage += 1
+        self.write({'op': 'step', 'pipeline': pipeline_id, 'step': step,
+            'status': status})
+
+    def pipeline_done(self, pipeline_id):
+        if self.pipelines.pop(pipeline_id, None) is not None:
+            self.garbage += 2
+            self.write({'op': 'pipeline_done', 'id': pipeline_id})
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.dirty = True
+
+    def sync(self):
+        '''Make everything written so far durable.'''
+        if self.dirty:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+        if self.garbage > max(1000, 2 * (len(self.live) +
+                len(self.pipelines))):
+            self.compact()
+
+    def compact(self):
+        '''Rewrite the journal with only the unfinished jobs and pipelines
+        in it.'''
+        if self.file:
+            self.file.close()
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as temp_file:
+            temp_file.write(json.dumps({'op': 'seq', 'next': self.next_id}) + "\n")
+            for pipeline_id, pipeline in sorted(self.pipelines.items()):
+                temp_file.write(json.dumps({'op': 'pipeline',
+                    'id': pipeline_id, 'spec': pipeline['spec'],
+                    'finished': pipeline['finished']}) + "\n")
+            for job_id, job in sorted(self.live.items()):
+                record = {'op': 'put', 'id': job_id, 'job': job}
+                if job_id in self.steps:
+                    pipeline, step = self.steps[job_id]
+                    record.update(pipeline=pipeline, step=step)
+                if job_id in self.not_before:
+                    record['not_before'] = self.not_before[job_id]
+                temp_file.write(json.dumps(record) + "\n")
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.rename(temp_filename, self.filename)
+        self.file = open(self.filename, "a")
+        self.garbage = 0
+        self.dirty = False
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+class MemoryJournal(Journal):
+    '''A journal that keeps nothing on disk, for running without
+    durability (and for tests).'''
+    def __init__(self):
+        super(MemoryJournal, self).__init__(None)
+
+    def replay(self):
+        return []
+
+    def write(self, record):
+        pass
+
+    def sync(self):
+        pass
+
+    def compact(self):
+        pass
+
+    def close(self):
+        pass
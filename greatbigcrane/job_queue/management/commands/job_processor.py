@@ -30,46 +30,50 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
 import zmq
-import time
-import json
+from socket import gethostname
+from optparse import make_option
 
 from django.core.management.base import NoArgsCommand
+from django.conf import settings
 
-from job_queue.jobs import command_map 
-from notifications.models import Notification
-
-addr = 'tcp://127.0.0.1:5555'
+from job_queue.worker import JobProcessor
 
 class Command(NoArgsCommand):
     help = "Run the 0MQ based job processor. Accepts jobs from the job server and processes them."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', default=1,
+            help="Number of jobs to run at once. Jobs for the same project "
+            "always run one after another."),
+        make_option('--reserved', type='int', default=1,
+            help="Number of extra jobs to run at once that are kept free "
+            "for quick interactive commands."),
+        make_option('--connect', default=settings.JOB_SERVER_ADDRESS,
+            help="0MQ address of the job server."),
+        make_option('--roots', default="",
+            help="Directories holding the projects this host can see, "
+            "separated by '%s'. Only jobs for projects under them are "
+            "sent here. By default any job is." % os.pathsep),
+        make_option('--multiplex', action='store_true', default=False,
+            help="Watch every running command from a single thread, so "
+            "--workers can be in the dozens."),
+        make_option('--database-threads', type='int', default=2,
+            help="With --multiplex, the number of threads notifications "
+            "and job runs are written on."),
+    )
+
     def handle(self, **options):
         context = zmq.Context()
-        socket = context.socket(zmq.REQ)
-        socket.connect(addr)
+        socket = context.socket(zmq.XREQ)
+        # Name ourselves so the job history shows where each job ran
+        socket.setsockopt(zmq.IDENTITY, "%s:%s" % (gethostname(), os.getpid()))
+        socket.connect(options['connect'])
 
-        print "Job Processor Is Running"
-        while True:
-            socket.send("GET")
-            job = socket.recv()
-            if job == "EMPTY":
-                time.sleep(1)
-                continue
-
-            job = json.loads(job)
-            command_name = job['command']
-            del job['command']
-            command = command_map[command_name]
-            # unicode strings as keyword arguments != cool for Python 2.6.1
-            job = dict((str(k), v) for k,v in job.iteritems())
-            try:
-                print repr(job)
-                command(**job)
-            except Exception, e:
-                Notification.objects.create(status="error",
-                        summary="%s command failed to run" %(command_name),
-                        project_id=job.get('project_id', None),
-                        message = "%s failed on these arguments: \n%s\n\n"
-                        "The exception was %s" % (
-                            command_name, job, str(e)))
+        roots = [os.path.abspath(os.path.expanduser(root))
+                for root in options['roots'].split(os.pathsep) if root]
 
+        print "Job Processor Is Running"
+        JobProcessor(context, socket, options['workers'],
+                options['reserved'], roots, multiplex=options['multiplex'],
+                database_threads=options['database_threads']).run()
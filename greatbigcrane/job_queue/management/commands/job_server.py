@@ -30,33 +30,40 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import Queue
 import zmq
-
-addr = 'tcp://127.0.0.1:5555'
+from optparse import make_option
 
 from django.core.management.base import NoArgsCommand
+from django.conf import settings
+from django.db import transaction
+
+from job_queue.server import JobServer
+from job_queue.journal import Journal
+from job_queue.scheduler import Scheduler
 
 class Command(NoArgsCommand):
     help = "Run the 0MQ based job server for greatbigcrane."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--bind', default=settings.JOB_SERVER_BIND,
+            help="0MQ address to accept the web app and job processors "
+            "on."),
+    )
+
     def handle(self, **options):
         context = zmq.Context()
-        socket = context.socket(zmq.REP) # Receives job requests from application server
-        socket.bind(addr)
+        # Receives job requests from the application server and pushes them
+        # to idle job processors
+        socket = context.socket(zmq.XREP)
+        socket.bind(options['bind'])
+
+        journal = None
+        if settings.JOB_QUEUE_JOURNAL:
+            journal = Journal(settings.JOB_QUEUE_JOURNAL)
 
-        jobs = Queue.Queue()
+        # JobRun rows are committed a batch of requests at a time
+        transaction.enter_transaction_management()
+        transaction.managed(True)
 
         print("Job Server Is Running")
-        while True:
-            request = socket.recv()
-            if request == "GET":
-                # Request came from a worker send it the next available job
-                try:
-                    job = jobs.get_nowait()
-                    socket.send(job)
-                except Queue.Empty:
-                    socket.send("EMPTY")
-            else:
-                # Request came from the django app, queue the job
-                jobs.put(request)
-                socket.send("ACK")
+        JobServer(socket, journal, record_runs=True,
+                scheduler=Scheduler()).serve_forever()
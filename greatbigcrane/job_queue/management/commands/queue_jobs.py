@@ -0,0 +1,41 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project.models import Project, PROJECT_FILTERS
+from job_queue.jobs import queue_batch, BULK_COMMANDS
+
+class Command(BaseCommand):
+    help = "Queue a command on a group of projects as a single batch."
+    args = "|".join(sorted(BULK_COMMANDS))
+    option_list = BaseCommand.option_list + (
+        make_option('--projects', default="all", choices=PROJECT_FILTERS,
+            help="Which projects to run the command on: %s." % (
+                ", ".join(PROJECT_FILTERS))),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in BULK_COMMANDS:
+            raise CommandError("Give one command to run: %s" % self.args)
+        batch, project_ids, sent = queue_batch(args[0],
+                Project.objects.filtered(options['projects']))
+        if not sent:
+            print "Job server is unavailable; the batch was spooled"
+        print "Queued %s on %d projects as batch %s" % (args[0],
+                len(project_ids), batch)
@@ -0,0 +1,75 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'JobRun'
+        db.create_table('job_queue_jobrun', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('job_id', self.gf('django.db.models.fields.IntegerField')(db_index=True)),
+            ('job', self.gf('django.db.models.fields.TextField')()),
+            ('command', self.gf('django.db.models.fields.CharField')(max_length=16)),
+            ('project', self.gf('django.db.models.fields.related.ForeignKey')(default=None, to=orm['project.Project'], null=True, blank=True)),
+            ('status', self.gf('django.db.models.fields.CharField')(default='queued', max_length=10)),
+            ('worker', self.gf('django.db.models.fields.CharField')(max_length=128, blank=True)),
+            ('queued_at', self.gf('django.db.models.fields.DateTimeField')()),
+            ('dispatched_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('started_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('finished_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('exit_code', self.gf('django.db.models.fields.IntegerField')(null=True, blank=True)),
+            ('output_size', self.gf('django.db.models.fields.IntegerField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('job_queue', ['JobRun'])
+
+        # Indexes for the project history and its timing percentiles
+        db.create_index('job_queue_jobrun', ['project_id', 'queued_at'])
+        db.create_index('job_queue_jobrun', ['project_id', 'command', 'finished_at'])
+
+
+    def backwards(self, orm):
+        
+        db.delete_index('job_queue_jobrun', ['project_id', 'queued_at'])
+        db.delete_index('job_queue_jobrun', ['project_id', 'command', 'finished_at'])
+
+        # Deleting model 'JobRun'
+        db.delete_table('job_queue_jobrun')
+
+
+    models = {
+        'job_queue.jobrun': {
+            'Meta': {'object_name': 'JobRun'},
+            'command': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'dispatched_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'exit_code': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.TextField', [], {}),
+            'job_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'output_size': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'to': "orm['project.Project']", 'null': 'True', 'blank': 'True'}),
+            'queued_at': ('django.db.models.fields.DateTimeField', [], {}),
+            'started_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'queued'", 'max_length': '10'}),
+            'worker': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'})
+        },
+        'project.project': {
+            'Meta': {'object_name': 'Project'},
+            'base_directory': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '512'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'favourite': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'git_repo': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '512', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'project_type': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'test_status': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['job_queue']
@@ -0,0 +1,78 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'Schedule'
+        db.create_table('job_queue_schedule', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('project', self.gf('django.db.models.fields.related.ForeignKey')(default=None, to=orm['project.Project'], null=True, blank=True)),
+            ('projects', self.gf('django.db.models.fields.CharField')(max_length=10, blank=True)),
+            ('command', self.gf('django.db.models.fields.CharField')(max_length=16)),
+            ('rule', self.gf('django.db.models.fields.CharField')(max_length=64)),
+            ('jitter', self.gf('django.db.models.fields.IntegerField')(default=600)),
+            ('enabled', self.gf('django.db.models.fields.BooleanField')(default=True, blank=True)),
+            ('next_run', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('last_run', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('job_queue', ['Schedule'])
+
+
+    def backwards(self, orm):
+        
+        # Deleting model 'Schedule'
+        db.delete_table('job_queue_schedule')
+
+
+    models = {
+        'job_queue.jobrun': {
+            'Meta': {'object_name': 'JobRun'},
+            'batch': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'blank': 'True'}),
+            'command': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'dispatched_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'exit_code': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job': ('django.db.models.fields.TextField', [], {}),
+            'job_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'lease': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'output_size': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'to': "orm['project.Project']", 'null': 'True', 'blank': 'True'}),
+            'queued_at': ('django.db.models.fields.DateTimeField', [], {}),
+            'started_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'queued'", 'max_length': '10'}),
+            'worker': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'})
+        },
+        'job_queue.schedule': {
+            'Meta': {'object_name': 'Schedule'},
+            'command': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'enabled': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'jitter': ('django.db.models.fields.IntegerField', [], {'default': '600'}),
+            'last_run': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'next_run': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'to': "orm['project.Project']", 'null': 'True', 'blank': 'True'}),
+            'projects': ('django.db.models.fields.CharField', [], {'max_length': '10', 'blank': 'True'}),
+            'rule': ('django.db.models.fields.CharField', [], {'max_length': '64'})
+        },
+        'project.project': {
+            'Meta': {'object_name': 'Project'},
+            'base_directory': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '512'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'favourite': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'git_repo': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '512', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'project_type': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'test_status': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['job_queue']
@@ -0,0 +1,98 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import time
+import errno
+import pipes
+import shutil
+import hashlib
+
+from django.conf import settings
+
+from job_queue.executor import run_command, file_lock
+
+# Touched in a mirror each time it is fetched
+FETCH_STAMP = "greatbigcrane-fetched"
+
+def mirror_directory():
+    return os.path.abspath(settings.GIT_MIRROR_DIRECTORY)
+
+def mirror_path(url):
+    '''The bare mirror of the repository at url, named for the repository
+    so there is some telling them apart.'''
+    name = re.sub(r"[^\w.-]+", "_", re.split(r"[/:]", url.rstrip("/"))[-1])
+    return os.path.join(mirror_directory(), "%s-%s" % (
+        hashlib.sha1(url).hexdigest(), name))
+
+def fetched_since(path, max_age):
+    try:
+        return time.time() - os.path.getmtime(os.path.join(path,
+            FETCH_STAMP)) < max_age
+    except OSError:
+        return False
+
+def update_mirror(url, check=None):
+    '''Bring the mirror of the repository at url up to date, cloning it the
+    first time. A mirror fetched in the last GIT_MIRROR_MAX_AGE seconds
+    isn't fetched again, so updating many checkouts of a repository at once
+    only fetches it once. Returns the mirror, or None if it couldn't be
+    brought up to date, and the output of git. A failure here doesn't fail
+    the job, which can still go to the remote itself.'''
+    try:
+        os.makedirs(mirror_directory())
+    except OSError, e:
+        # Another job got there first
+        if e.errno != errno.EEXIST:
+            raise
+    path = mirror_path(url)
+    # Only one job fetches into a mirror at a time
+    with file_lock(path + ".lock", check):
+        if os.path.isdir(path):
+            if fetched_since(path, settings.GIT_MIRROR_MAX_AGE):
+                return path, ""
+            returncode, response = run_command("git fetch --prune", cwd=path,
+                    recoverable=True)
+        else:
+            # Checkouts borrow the mirror's objects, so it must never throw
+            # any away, even once no branch refers to them
+            new_path = path + ".new"
+            shutil.rmtree(new_path, ignore_errors=True)
+            returncode, response = run_command("git clone --mirror "
+                    "--config gc.pruneExpire=never %s %s" % (pipes.quote(url),
+                        pipes.quote(new_path)), recoverable=True)
+            if not returncode:
+                os.rename(new_path, path)
+        if returncode:
+            return None, response
+        open(os.path.join(path, FETCH_STAMP), "w").close()
+        return path, response
+
+def mirrored(command, url, mirror):
+    '''A git command that goes to the mirror wherever it would go to url.'''
+    return "git -c %s %s" % (pipes.quote("url.%s.insteadOf=%s" % (mirror,
+        url)), command)
+
+def clone_command(url, mirror, directory):
+    '''Clone url into directory from its mirror, borrowing the mirror's
+    objects rather than copying them. The clone's origin is still url.'''
+    return mirrored("clone --reference %s %s %s" % (pipes.quote(mirror),
+        pipes.quote(url), pipes.quote(directory)), url, mirror)
+
+def pull_command(url, mirror):
+    '''Pull a checkout of url from its mirror.'''
+    return mirrored("pull", url, mirror)
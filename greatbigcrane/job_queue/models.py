@@ -13,3 +13,181 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+
+import datetime
+
+from django.db import models
+from django.db.models import Count, Max, Q
+from project.models import Project, PROJECT_FILTERS
+from job_queue.jobs import BULK_COMMANDS
+from job_queue.cron import CronRule
+
+make_choice = lambda x: ([(p,p) for p in x])
+
+JOB_STATUSES = ["queued", "dispatched", "running", "success", "error",
+        "timeout", "cancelled"]
+
+def seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+def percentile(values, fraction):
+    '''Nearest rank percentile of an already sorted list.'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class JobRunManager(models.Manager):
+    '''The job server and job processors record each step of a job's life
+    through these, keyed by the id the job server gave the job.'''
+    def next_job_id(self):
+        return (self.aggregate(Max('job_id'))['job_id__max'] or 0) + 1
+
+    def record_queued(self, job_id, job, command, project_id, batch=""):
+        return self.create(job_id=job_id, job=job, command=command,
+                project_id=project_id, batch=batch,
+                queued_at=datetime.datetime.now())
+
+    def record_dispatched(self, job_id, worker, lease=""):
+        self.filter(job_id=job_id).update(status="dispatched",
+                dispatched_at=datetime.datetime.now(), worker=worker,
+                lease=lease)
+
+    def record_requeued(self, job_id):
+        '''The worker running the job went quiet, so it is queued again.'''
+        self.filter(job_id=job_id).update(status="queued", worker="",
+                lease="", dispatched_at=None, started_at=None)
+
+    def leased(self, job_id, lease):
+        '''The run of a job, as long as it is still leased to the worker
+        that asks. A worker whose lease was lost can't change the run.'''
+        runs = self.filter(job_id=job_id)
+        if lease:
+            runs = runs.filter(lease=lease)
+        return runs
+
+    def record_started(self, job_id, lease=""):
+        self.leased(job_id, lease).update(status="running",
+                started_at=datetime.datetime.now())
+
+    def record_finished(self, job_id, status, exit_code, output_size,
+            lease=""):
+        self.leased(job_id, lease).update(status=status,
+                finished_at=datetime.datetime.now(), exit_code=exit_code,
+                output_size=output_size)
+
+    def timings(self, project, sample_size=500):
+        '''Queue wait and run time percentiles for each command run on the
+        project, over its most recent finished runs.'''
+        commands = self.filter(project=project).values_list(
+                'command', flat=True).order_by('command').distinct()
+        timings = []
+        for command in commands:
+            runs = self.filter(project=project, command=command,
+                    finished_at__isnull=False).order_by('-finished_at')[
+                            :sample_size]
+            waits = sorted(run.queue_wait() for run in runs
+                    if run.queue_wait() is not None)
+            run_times = sorted(run.run_time() for run in runs
+                    if run.run_time() is not None)
+            timings.append({'command': command, 'runs': len(runs),
+                'queue_wait': [percentile(waits, f) for f in (.5, .9, .99)],
+                'run_time': [percentile(run_times, f) for f in (.5, .9, .99)]})
+        return timings
+
+    def batch_progress(self, batch):
+        '''How many of a batch's jobs are in each status, counting the
+        waiting jobs it was merged into.'''
+        progress = dict((status, 0) for status in JOB_STATUSES)
+        merged = BatchMember.objects.filter(batch=batch).values('job_id')
+        for row in self.filter(Q(batch=batch) | Q(job_id__in=merged)).values(
+                'status').annotate(count=Count('id')).order_by():
+            progress[row['status']] = row['count']
+        progress['total'] = sum(progress.values())
+        progress['finished'] = progress['total'] - (progress['queued'] +
+                progress['dispatched'] + progress['running'])
+        return progress
+
+class JobRun(models.Model):
+    '''One job from when it is queued until it has finished running.'''
+    job_id = models.IntegerField(db_index=True)
+    job = models.TextField()
+    command = models.CharField(max_length=16)
+    project = models.ForeignKey(Project, null=True, blank=True, default=None)
+    status = models.CharField(max_length=10, default="queued",
+            choices=make_choice(JOB_STATUSES))
+    # Jobs queued together by a bulk action share a batch id
+    batch = models.CharField(max_length=32, blank=True, db_index=True)
+    worker = models.CharField(max_length=128, blank=True)
+    # The token of the worker's lease on the job
+    lease = models.CharField(max_length=32, blank=True)
+    queued_at = models.DateTimeField()
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    exit_code = models.IntegerField(null=True, blank=True)
+    output_size = models.IntegerField(null=True, blank=True)
+
+    objects = JobRunManager()
+
+    def queue_wait(self):
+        '''Seconds between being queued and starting to run.'''
+        if self.started_at:
+            return seconds(self.started_at - self.queued_at)
+        return None
+
+    def run_time(self):
+        if self.started_at and self.finished_at:
+            return seconds(self.finished_at - self.started_at)
+        return None
+
+    class Meta:
+        ordering = ["-queued_at"]
+
+class BatchMember(models.Model):
+    '''A job of a batch that was merged into an identical job already
+    waiting, whose JobRun belongs to the batch that queued it.'''
+    batch = models.CharField(max_length=32, db_index=True)
+    job_id = models.IntegerField()
+
+class Schedule(models.Model):
+    '''Runs a command on a project, or on every project in a group, each
+    time its cron style rule matches. The job server fires schedules.'''
+    project = models.ForeignKey(Project, null=True, blank=True, default=None)
+    projects = models.CharField(max_length=10, blank=True,
+            choices=make_choice(PROJECT_FILTERS),
+            help_text="The group of projects to run on, if not a single "
+            "project")
+    command = models.CharField(max_length=16,
+            choices=make_choice(sorted(BULK_COMMANDS)))
+    rule = models.CharField(max_length=64,
+            help_text="Minute, hour, day of month, month and day of week, "
+            "as in crontab, or @hourly, @nightly or @weekly")
+    jitter = models.IntegerField(default=600,
+            help_text="Seconds to spread the jobs over, so they don't all "
+            "start at once")
+    enabled = models.BooleanField(default=True)
+    next_run = models.DateTimeField(null=True, blank=True)
+    last_run = models.DateTimeField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        if self.next_run is None:
+            self.next_run = CronRule(self.rule).next_after(
+                    datetime.datetime.now())
+        super(Schedule, self).save(*args, **kwargs)
+
+    def target_projects(self):
+        '''The projects to run the command on, leaving out those it
+        doesn't make sense for.'''
+        if self.project_id:
+            projects = [self.project]
+        else:
+            projects = Project.objects.filtered(self.projects)
+        return [project for project in projects
+                if BULK_COMMANDS[self.command](project)]
+
+    def __unicode__(self):
+        return "%s on %s at %s" % (self.command,
+                self.project or "%s projects" % self.projects, self.rule)
+
+    class Meta:
+        ordering = ["next_run"]
@@ -0,0 +1,109 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# What a step can do to the steps that come after it when it fails
+FAILURE_POLICIES = ("stop", "continue")
+
+def validate(spec):
+    '''Check a pipeline spec, raising ValueError if it can't be run. Returns
+    its steps ordered so every step comes after its prerequisites.'''
+    steps = spec.get('steps') if isinstance(spec, dict) else None
+    if not steps:
+        raise ValueError("A pipeline needs some steps")
+    by_name = {}
+    for step in steps:
+        if not isinstance(step, dict) or not isinstance(step.get('name'),
+                basestring):
+            raise ValueError("Every step needs a name")
+        if not isinstance(step.get('job'), basestring):
+            raise ValueError("Step %s has no job" % step['name'])
+        if step['name'] in by_name:
+            raise ValueError("Step %s appears twice" % step['name'])
+        if step.get('on_failure', "stop") not in FAILURE_POLICIES:
+            raise ValueError("Step %s has an unknown failure policy" % (
+                step['name']))
+        by_name[step['name']] = step
+    for step in steps:
+        for name in step.get('after', ()):
+            if name not in by_name:
+                raise ValueError("Step %s comes after unknown step %s" % (
+                    step['name'], name))
+
+    ordered = []
+    placed = set()
+    while len(ordered) < len(steps):
+        progress = False
+        for step in steps:
+            if step['name'] not in placed and placed.issuperset(
+                    step.get('after', ())):
+                ordered.append(step)
+                placed.add(step['name'])
+                progress = True
+        if not progress:
+            raise ValueError("Pipeline steps depend on each other in a loop")
+    return ordered
+
+class Step(object):
+    def __init__(self, name, job, after, on_failure):
+        self.name = name
+        self.job = job
+        self.after = after
+        self.on_failure = on_failure
+        # The id of the step's job once it has been queued
+        self.job_id = None
+        # How the step ended, or "skipped" if it never ran
+        self.status = None
+
+    def failed(self):
+        return self.status is not None and self.status != "success"
+
+class Pipeline(object):
+    '''A graph of jobs in the job server, where each step is queued as soon
+    as the steps it comes after have finished.
+
+    A step that fails with the "stop" policy has everything after it
+    skipped; with "continue", the steps after it run anyway. A step that
+    was skipped always has the steps after it skipped too.'''
+    def __init__(self, pipeline_id, spec, finished=None):
+        self.id = pipeline_id
+        self.steps = [Step(step['name'], step['job'],
+            list(step.get('after', ())), step.get('on_failure', "stop"))
+            for step in validate(spec)]
+        self.by_name = dict((step.name, step) for step in self.steps)
+        for name, status in (finished or {}).items():
+            self.by_name[name].status = status
+
+    def ready(self):
+        '''Return the steps that can be queued now, skipping any that can
+        never run.'''
+        ready = []
+        # Steps are in dependency order, so skips flow forward in one pass
+        for step in self.steps:
+            if step.status is not None or step.job_id is not None:
+                continue
+            before = [self.by_name[name] for name in step.after]
+            if any(b.status == "skipped" or (b.failed() and
+                    b.on_failure == "stop") for b in before):
+                step.status = "skipped"
+            elif all(b.status is not None for b in before):
+                ready.append(step)
+        return ready
+
+    def finish(self, name, status):
+        self.by_name[name].status = status
+
+    def finished(self):
+        return all(step.status is not None for step in self.steps)
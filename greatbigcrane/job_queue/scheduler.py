@@ -0,0 +1,55 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import random
+import datetime
+
+from job_queue.cron import CronRule
+from job_queue.jobs import make_job_string
+from job_queue.models import Schedule
+
+class Scheduler(object):
+    '''Fires the Schedules in the database from inside the job server.'''
+
+    # Seconds between looks for schedules that are due
+    interval = 15
+
+    def due_jobs(self, now):
+        '''Claim the schedules that are due and return their jobs, each
+        with the number of seconds to hold it back for.
+
+        A schedule is claimed by moving its next_run on, but only if
+        next_run hasn't changed since we read it. However many servers
+        race for it, or however often one restarts, each firing is claimed
+        once. A schedule that was due while the server was down fires once,
+        not once for every time it was missed.'''
+        jobs = []
+        for schedule in Schedule.objects.filter(enabled=True,
+                next_run__lte=now):
+            try:
+                next_run = CronRule(schedule.rule).next_after(now)
+            except ValueError:
+                Schedule.objects.filter(id=schedule.id).update(enabled=False)
+                continue
+            claimed = Schedule.objects.filter(id=schedule.id,
+                    next_run=schedule.next_run).update(next_run=next_run,
+                            last_run=now)
+            if not claimed:
+                continue
+            for project in schedule.target_projects():
+                jobs.append((random.uniform(0, schedule.jitter),
+                    make_job_string(schedule.command, project_id=project.id)))
+        return jobs
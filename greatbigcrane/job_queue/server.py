@@ -0,0 +1,673 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import uuid
+import heapq
+import datetime
+from collections import deque
+
+import zmq
+from django.db import transaction
+
+from job_queue.jobs import command_map, LANES
+from job_queue.journal import MemoryJournal
+from job_queue.pipeline import Pipeline
+from job_queue.stats import RingBuffer, BUCKETS
+from job_queue.models import JobRun, BatchMember
+from project.models import Project
+
+# Requests that come from workers, which aren't answered
+WORKER_REQUESTS = ("READY", "HEARTBEAT", "DONE")
+
+def parse_job(job):
+    try:
+        data = json.loads(job)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+class QueuedJob(object):
+    '''A job waiting in the server for a worker. Raises ValueError if the
+    job names a project by anything but its id.'''
+    def __init__(self, job_id, job):
+        self.id = job_id
+        self.job = job
+        data = parse_job(job)
+        self.command = data.get('command', '')
+        self.project_id = data.get('project_id')
+        if self.project_id is not None:
+            try:
+                self.project_id = int(self.project_id)
+            except (TypeError, ValueError):
+                raise ValueError("Bad project id: %r" % (self.project_id,))
+        # Identify duplicates by command and arguments, whatever order the
+        # arguments were serialized in
+        self.key = json.dumps(data, sort_keys=True) if data else job
+        command = command_map.get(self.command)
+        self.lane = getattr(command, 'lane', 'normal')
+        # How many times the job was asked for while it was waiting
+        self.requests = 1
+        # The project's base directory, which a worker must be able to see
+        self.directory = None
+        self.queued_at = time.time()
+
+class Lease(object):
+    '''A job handed to a worker. The lease is lost if the worker goes
+    quiet, and only a DONE quoting its token counts.'''
+    def __init__(self, queued, address, token):
+        self.queued = queued
+        self.address = address
+        self.token = token
+        self.started = time.time()
+
+class CommandLimit(object):
+    '''Caps how many runs of one command are leased at once and, given a
+    (runs, seconds) rate, how often new runs may start. The rate is a token
+    bucket, so up to runs jobs can start in a burst.'''
+    def __init__(self, max_concurrent, rate, now):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.running = 0
+        if rate:
+            self.tokens = float(rate[0])
+            self.updated = now
+
+    def refill(self, now):
+        runs, seconds = self.rate
+        self.tokens = min(runs,
+                self.tokens + (now - self.updated) * runs / float(seconds))
+        self.updated = now
+
+    def allows(self, now):
+        if self.max_concurrent and self.running >= self.max_concurrent:
+            return False
+        if self.rate:
+            self.refill(now)
+            return self.tokens >= 1
+        return True
+
+    def refilled_at(self):
+        '''When the bucket will next hold a whole token.'''
+        runs, seconds = self.rate
+        return self.updated + (1 - self.tokens) * seconds / float(runs)
+
+    def started(self):
+        self.running += 1
+        if self.rate:
+            self.tokens -= 1
+
+    def finished(self):
+        self.running -= 1
+
+class WorkerState(object):
+    '''What the server knows about one job processor.'''
+    def __init__(self, address, now):
+        self.address = address
+        self.last_seen = now
+        # Ids of the jobs it holds leases on
+        self.leases = set()
+        # Its free slots haven't been checked against a heartbeat yet
+        self.unchecked = True
+        # Directories it can see projects under; empty if it sees them all
+        self.roots = []
+        self.dispatched = 0
+        self.done = 0
+        self.lost = 0
+
+    def can_reach(self, directory):
+        if directory is None or not self.roots:
+            return True
+        for root in self.roots:
+            if directory == root or directory.startswith(
+                    root.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+class JobServer(object):
+    '''Routes jobs from the django app to job processors.
+
+    The server owns a single XREP (router) socket. Every message arrives
+    prefixed with the address of the peer that sent it, so we can tell
+    workers apart and push a job to an idle one as soon as it is queued,
+    instead of making workers poll for work.
+
+    Workers announce that they are idle by sending "READY"; they get no
+    reply until there is a job for them, which is sent as its id followed
+    by the serialized job and a lease token. When the job has run they
+    send "DONE", the id, how it ended and the token. Anything else is a
+    serialized job from the django app and is answered with "ACK" once it
+    has been written to the journal. A request the server can't make sense
+    of is answered with "ERROR" and a reason, or ignored if it came from a
+    worker, so no peer can bring the server down.
+
+    Workers also send "HEARTBEAT" with their free general and reserved
+    slots every few seconds. A worker that has said nothing for
+    lease_timeout seconds is presumed dead: its jobs go back to the front
+    of their lanes and its idle slots are forgotten. If it turns out to be
+    alive after all, its DONEs quote a token that has been replaced and are
+    ignored, and its next heartbeat offers its free slots again.
+
+    A heartbeat can also carry a JSON list of the directories the worker
+    can see. Jobs for a project are only sent to workers that can see its
+    base directory; a job no idle worker can take is passed over for
+    later jobs in its lane until one can.
+
+    "BATCH", a batch id and a JSON list of serialized jobs queues them all
+    with a single request and a single "ACK", so running a command on every
+    project doesn't take a round trip per project.
+
+    "STATS" is answered straight away with a JSON snapshot of the queue:
+    how deep each lane is and how long its oldest job has waited, what each
+    worker is running, and histograms of recent queue waits (by lane) and
+    run times (by command), kept in fixed size ring buffers.
+
+    "CANCEL" and a job id drops the job if it is still waiting, or is
+    forwarded to the worker running it, which kills it.
+
+    "PIPELINE" and a JSON spec queues a graph of jobs (see Pipeline). Steps
+    are queued as soon as the DONE for their last prerequisite arrives, so
+    independent branches spread over free workers and nothing polls.
+
+    A job identical to one that is still waiting (same command, project and
+    arguments) is not queued again; its sender is attached to the waiting
+    copy instead, so repeated clicks don't run a buildout three times.
+
+    Commands can declare a max_concurrent number of runs and a rate at
+    which runs may start. A job over its command's limits is passed over,
+    like one no worker can reach, so other commands keep flowing.
+
+    Jobs wait in one of the LANES declared by their command, and lanes are
+    drained in order. A worker can send "READY" followed by a lane name to
+    offer a slot reserved for that lane, so quick interactive commands
+    always have somewhere to run even when every other slot is busy with a
+    buildout. Jobs are sent with the lane of the slot they were given, so
+    the worker knows which kind of slot it is freeing when it is done.
+
+    Given a scheduler (see job_queue.scheduler), the server asks it for due
+    jobs every scheduler.interval seconds. Each comes with a delay so a
+    nightly run on every project is spread out; delayed jobs are journaled
+    with the time they may run from and only join their lane then.
+
+    With record_runs, each job gets a JobRun row when it is queued and
+    dispatched. The server expects to be inside a managed transaction and
+    commits once per batch of requests.'''
+
+    # Most requests to read before making a burst of jobs durable
+    batch_size = 256
+    # Seconds between checks for workers that have gone quiet
+    heartbeat_interval = 5
+    # Seconds a worker can be quiet before its jobs are given to others
+    lease_timeout = 20
+
+    def __init__(self, socket, journal=None, record_runs=False,
+            scheduler=None):
+        self.socket = socket
+        self.journal = journal or MemoryJournal()
+        self.record_runs = record_runs
+        self.lanes = dict((lane, deque()) for lane in LANES)
+        self.waiting = {}
+        self.idle_workers = deque()
+        self.reserved = dict((lane, deque()) for lane in LANES)
+        # Leases on dispatched jobs, by job id
+        self.leases = {}
+        self.workers = {}
+        # Lease tokens must differ from those of an earlier run of the
+        # server, since its workers may still be finishing jobs
+        self.epoch = uuid.uuid4().hex[:8]
+        self.lease_count = 0
+        self.pipelines = {}
+        # The pipeline and step of queued or running pipeline jobs, by id
+        self.pipeline_jobs = {}
+        self.unacked = []
+        now = time.time()
+        self.limits = dict((name, CommandLimit(function.max_concurrent,
+            function.rate, now)) for name, function in command_map.items()
+            if function.max_concurrent or function.rate)
+        # When a job held back by a rate limit may next be dispatched
+        self.throttled_until = None
+        # Recent queue waits by lane and run times by command
+        self.waits = dict((lane, RingBuffer()) for lane in LANES)
+        self.run_times = {}
+        # A heap of (not before, id, job) for jobs queued with a delay
+        self.delayed = []
+        self.scheduler = scheduler
+        self.next_schedule = 0
+        for job_id, job in self.journal.replay():
+            try:
+                queued = self.locate(QueuedJob(job_id, job))
+            except ValueError, e:
+                # Jobs are checked before they are journalled, so this one
+                # was written by an older server; drop it rather than
+                # failing every start
+                print "Dropping bad job %s from the journal: %s" % (job_id, e)
+                self.journal.done(job_id)
+                continue
+            if job_id in self.journal.not_before:
+                heapq.heappush(self.delayed, (self.journal.not_before[job_id],
+                    job_id, queued))
+            else:
+                self.add(queued)
+        if record_runs:
+            # Job ids must stay unique in the history even if the journal
+            # is thrown away
+            self.journal.next_id = max(self.journal.next_id,
+                    JobRun.objects.next_job_id())
+        for pipeline_id, state in sorted(self.journal.pipelines.items()):
+            self.pipelines[pipeline_id] = Pipeline(pipeline_id,
+                    state['spec'], state['finished'])
+        for job_id, (pipeline_id, name) in self.journal.steps.items():
+            pipeline = self.pipelines.get(pipeline_id)
+            if pipeline is None:
+                continue
+            step = pipeline.by_name[name]
+            step.job_id = job_id
+            self.pipeline_jobs[job_id] = (pipeline, step)
+        # Queue any step whose prerequisites finished just before a crash
+        for pipeline in self.pipelines.values():
+            self.advance(pipeline)
+
+    def serve_forever(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        while True:
+            self.serve_once(poller, self.heartbeat_interval)
+
+    def serve_once(self, poller, timeout):
+        '''Handle whatever arrives within timeout seconds.'''
+        # Wake up in time to release the next delayed job or one that was
+        # held back by a rate limit
+        wake_at = [self.delayed[0][0]] if self.delayed else []
+        if self.throttled_until is not None:
+            wake_at.append(self.throttled_until)
+        if wake_at:
+            timeout = max(0, min(timeout, min(wake_at) - time.time()))
+        if poller.poll(timeout * 1000):
+            self.handle(self.socket.recv_multipart())
+            # Read whatever else has already arrived so a burst of jobs
+            # shares one fsync
+            while len(self.unacked) < self.batch_size and poller.poll(0):
+                self.handle(self.socket.recv_multipart())
+        now = time.time()
+        self.expire(now)
+        self.run_schedules(now)
+        self.release(now)
+        self.commit()
+        self.dispatch()
+        if self.record_runs:
+            transaction.commit()
+
+    def handle(self, message):
+        # Both REQ clients and workers put an empty delimiter frame between
+        # their address and the request.
+        address, request = message[0], message[2:]
+        try:
+            self.handle_request(address, request)
+        except (ValueError, IndexError), e:
+            print "Ignoring bad request %r: %s" % (request[:1], e)
+            # Clients wait for an answer; workers don't expect one
+            if request and request[0] not in WORKER_REQUESTS:
+                self.send(address, "ERROR", str(e))
+
+    def handle_request(self, address, request):
+        if request[0] == "READY":
+            self.seen(address)
+            if len(request) > 1:
+                if request[1] not in self.reserved:
+                    raise ValueError("No such lane: %s" % request[1])
+                self.reserved[request[1]].append(address)
+            else:
+                self.idle_workers.append(address)
+        elif request[0] == "HEARTBEAT":
+            worker = self.seen(address)
+            if len(request) > 3:
+                worker.roots = json.loads(request[3])
+            if worker.unchecked:
+                self.check_slots(worker, int(request[1]), int(request[2]))
+        elif request[0] == "DONE":
+            worker = self.seen(address)
+            job_id = int(request[1])
+            status = request[2] if len(request) > 2 else "success"
+            lease = self.leases.get(job_id)
+            if lease is None or lease.address != address or (
+                    len(request) > 3 and request[3] != lease.token):
+                # The lease was lost and the job has been given to someone
+                # else
+                return
+            lease = self.end_lease(job_id)
+            self.run_times.setdefault(lease.queued.command,
+                    RingBuffer()).add(time.time() - lease.started)
+            worker.leases.discard(job_id)
+            worker.done += 1
+            self.journal.done(job_id)
+            self.finish(job_id, status)
+        elif request[0] == "BATCH":
+            batch, jobs = request[1], json.loads(request[2])
+            if not isinstance(jobs, list) or not all(
+                    isinstance(job, basestring) for job in jobs):
+                raise ValueError("A batch is a list of serialized jobs")
+            jobs = [job.encode('utf-8') for job in jobs]
+            # Check them all first, so a bad job queues none of the batch
+            for job in jobs:
+                QueuedJob(None, job)
+            for job in jobs:
+                self.queue_job(job, batch)
+            self.unacked.append(address)
+        elif request[0] == "PIPELINE":
+            self.queue_pipeline(request[1])
+            self.unacked.append(address)
+        elif request[0] == "CANCEL":
+            self.cancel(int(request[1]))
+            self.unacked.append(address)
+        elif request[0] == "STATS":
+            self.send(address, json.dumps(self.stats()))
+        elif request[0] == "GET":
+            # Old polling workers never say DONE, so a job handed to them
+            # is forgotten straight away
+            for lane in LANES:
+                if self.lanes[lane]:
+                    queued = self.pop(lane)
+                    self.journal.done(queued.id)
+                    # and can't say whether it failed
+                    self.finish(queued.id, "success")
+                    self.send(address, queued.job)
+                    break
+            else:
+                self.send(address, "EMPTY")
+        else:
+            self.queue_job(request[0])
+            self.unacked.append(address)
+
+    def queue_job(self, job, batch="", pipeline_step=None, delay=0):
+        '''Queue a job unless an identical one is already waiting, and
+        return its id. Pipeline steps are never merged, since each needs
+        to hear how its own job ended. A job with a delay waits that many
+        seconds before it can be dispatched.'''
+        queued = QueuedJob(None, job)
+        waiting = self.waiting.get(queued.key)
+        if waiting and not pipeline_step:
+            waiting.requests += 1
+            if self.record_runs and batch:
+                BatchMember.objects.create(batch=batch, job_id=waiting.id)
+            return waiting.id
+        # Anything that can go wrong with the job goes wrong before it is
+        # journalled, so it can't come back after a restart
+        self.locate(queued)
+        if pipeline_step:
+            pipeline, step = pipeline_step
+            queued.id = self.journal.put(job, pipeline.id, step.name)
+            step.job_id = queued.id
+            self.pipeline_jobs[queued.id] = (pipeline, step)
+        elif delay:
+            not_before = time.time() + delay
+            queued.id = self.journal.put(job, not_before=not_before)
+            heapq.heappush(self.delayed, (not_before, queued.id, queued))
+        else:
+            queued.id = self.journal.put(job)
+        if not delay:
+            self.add(queued)
+        if self.record_runs:
+            JobRun.objects.record_queued(queued.id, job, queued.command,
+                    queued.project_id, batch)
+        return queued.id
+
+    def queue_pipeline(self, spec):
+        '''Queue the first steps of a pipeline. Raises ValueError if the
+        spec can't be run, before anything is journalled.'''
+        spec = json.loads(spec)
+        pipeline = Pipeline(None, spec)
+        for step in pipeline.by_name.values():
+            QueuedJob(None, step.job)
+        pipeline.id = self.journal.put_pipeline(spec)
+        self.pipelines[pipeline.id] = pipeline
+        self.advance(pipeline)
+
+    def advance(self, pipeline):
+        '''Queue the pipeline's steps that are ready to run, and forget the
+        pipeline once every step has finished or been skipped.'''
+        for step in pipeline.ready():
+            self.queue_job(step.job.encode('utf-8'),
+                    pipeline_step=(pipeline, step))
+        if pipeline.finished():
+            self.journal.pipeline_done(pipeline.id)
+            del self.pipelines[pipeline.id]
+
+    def finish(self, job_id, status):
+        '''Move a pipeline along when one of its jobs has ended.'''
+        if job_id not in self.pipeline_jobs:
+            return
+        pipeline, step = self.pipeline_jobs.pop(job_id)
+        pipeline.finish(step.name, status)
+        self.journal.step_done(pipeline.id, step.name, status)
+        self.advance(pipeline)
+
+    def seen(self, address):
+        '''Note that a worker is alive, renewing its leases.'''
+        now = time.time()
+        worker = self.workers.get(address)
+        if worker is None:
+            worker = self.workers[address] = WorkerState(address, now)
+        worker.last_seen = now
+        return worker
+
+    def check_slots(self, worker, general, reserved):
+        '''Offer any free slots of a newly seen worker that we don't know
+        about, such as those forgotten when it was presumed dead.'''
+        lane = LANES[0]
+        general -= list(self.idle_workers).count(worker.address)
+        reserved -= list(self.reserved[lane]).count(worker.address)
+        self.idle_workers.extend([worker.address] * max(0, general))
+        self.reserved[lane].extend([worker.address] * max(0, reserved))
+        worker.unchecked = False
+
+    def expire(self, now):
+        '''Take back the jobs of workers that have gone quiet and put them
+        at the front of their lanes.'''
+        for address, worker in self.workers.items():
+            if now - worker.last_seen < self.lease_timeout:
+                continue
+            del self.workers[address]
+            self.idle_workers = deque(a for a in self.idle_workers
+                    if a != address)
+            for lane in LANES:
+                self.reserved[lane] = deque(a for a in self.reserved[lane]
+                        if a != address)
+            for job_id in sorted(worker.leases, reverse=True):
+                queued = self.end_lease(job_id).queued
+                worker.lost += 1
+                self.lanes[queued.lane].appendleft(queued)
+                self.waiting.setdefault(queued.key, queued)
+                if self.record_runs:
+                    JobRun.objects.record_requeued(job_id)
+
+    def run_schedules(self, now):
+        '''Queue the jobs of any schedules that have come due.'''
+        if self.scheduler is None or now < self.next_schedule:
+            return
+        self.next_schedule = now + self.scheduler.interval
+        jobs = self.scheduler.due_jobs(datetime.datetime.fromtimestamp(now))
+        if self.record_runs:
+            # Commit the claims before queueing anything: a crash in
+            # between loses a firing rather than running it twice
+            transaction.commit()
+        for delay, job in jobs:
+            self.queue_job(job, delay=delay)
+
+    def release(self, now):
+        '''Move delayed jobs whose time has come onto their lanes.'''
+        while self.delayed and self.delayed[0][0] <= now:
+            not_before, job_id, queued = heapq.heappop(self.delayed)
+            # It has only been waiting for a worker since now
+            queued.queued_at = not_before
+            self.add(queued)
+
+    def cancel(self, job_id):
+        if job_id in self.leases:
+            self.send(self.leases[job_id].address, "CANCEL", str(job_id))
+            return
+        for lane in LANES:
+            for queued in self.lanes[lane]:
+                if queued.id == job_id:
+                    self.lanes[lane].remove(queued)
+                    if self.waiting.get(queued.key) is queued:
+                        del self.waiting[queued.key]
+                    self.cancelled(job_id)
+                    return
+        for entry in self.delayed:
+            if entry[1] == job_id:
+                self.delayed.remove(entry)
+                heapq.heapify(self.delayed)
+                self.cancelled(job_id)
+                return
+
+    def cancelled(self, job_id):
+        self.journal.done(job_id)
+        if self.record_runs:
+            JobRun.objects.record_finished(job_id, "cancelled", None, 0)
+        self.finish(job_id, "cancelled")
+
+    def locate(self, queued):
+        '''Look up the base directory of the job's project, and return the
+        job.'''
+        if queued.project_id is not None:
+            directories = Project.objects.filter(
+                    id=queued.project_id).values_list('base_directory',
+                            flat=True)
+            if directories:
+                queued.directory = os.path.normpath(directories[0])
+        return queued
+
+    def add(self, queued):
+        self.lanes[queued.lane].append(queued)
+        self.waiting.setdefault(queued.key, queued)
+
+    def pop(self, lane):
+        '''Take the next job off a lane.'''
+        return self.taken(self.lanes[lane].popleft())
+
+    def taken(self, queued):
+        '''Once a job has been handed out, asking for it again queues a
+        fresh run.'''
+        if self.waiting.get(queued.key) is queued:
+            del self.waiting[queued.key]
+        return queued
+
+    def commit(self):
+        '''Make queued jobs durable, then tell their senders they're safe.'''
+        self.journal.sync()
+        for address in self.unacked:
+            self.send(address, "ACK")
+        self.unacked = []
+
+    def dispatch(self):
+        '''Hand queued jobs to idle workers that can see their projects,
+        highest lane first and oldest first within a lane. Jobs over their
+        command's limits wait.'''
+        now = time.time()
+        self.throttled_until = None
+        for lane in LANES:
+            jobs = self.lanes[lane]
+            passed_over = deque()
+            while jobs and (self.reserved[lane] or self.idle_workers):
+                queued = jobs.popleft()
+                limit = self.limits.get(queued.command)
+                if limit and not limit.allows(now):
+                    if limit.rate and not (limit.max_concurrent and
+                            limit.running >= limit.max_concurrent):
+                        self.throttled_until = min(self.throttled_until or
+                                limit.refilled_at(), limit.refilled_at())
+                    passed_over.append(queued)
+                    continue
+                found = self.find_slot(queued, lane)
+                if found is None:
+                    passed_over.append(queued)
+                else:
+                    self.start(self.taken(queued), *found)
+            passed_over.extend(jobs)
+            self.lanes[lane] = passed_over
+
+    def find_slot(self, queued, lane):
+        '''Return the address and slot of an idle worker that can take the
+        job, preferring a slot reserved for its lane, and claim it.'''
+        for slots, slot in ((self.reserved[lane], lane),
+                (self.idle_workers, "")):
+            for address in slots:
+                if self.workers[address].can_reach(queued.directory):
+                    slots.remove(address)
+                    return address, slot
+        return None
+
+    def start(self, queued, address, slot):
+        '''Send a job to a worker, leasing it to them.'''
+        self.lease_count += 1
+        token = "%s.%d" % (self.epoch, self.lease_count)
+        self.leases[queued.id] = Lease(queued, address, token)
+        self.waits[queued.lane].add(time.time() - queued.queued_at)
+        if queued.command in self.limits:
+            self.limits[queued.command].started()
+        worker = self.workers[address]
+        worker.leases.add(queued.id)
+        worker.dispatched += 1
+        self.send(address, str(queued.id), queued.job, slot, token)
+        if self.record_runs:
+            JobRun.objects.record_dispatched(queued.id, address, token)
+
+    def end_lease(self, job_id):
+        lease = self.leases.pop(job_id)
+        if lease.queued.command in self.limits:
+            self.limits[lease.queued.command].finished()
+        return lease
+
+    def stats(self):
+        '''A snapshot of the queue and the workers, for STATS.'''
+        now = time.time()
+        lanes = {}
+        for lane in LANES:
+            jobs = self.lanes[lane]
+            lanes[lane] = {'depth': len(jobs), 'oldest_wait': now - min(
+                queued.queued_at for queued in jobs) if jobs else None}
+        workers = []
+        for address, worker in sorted(self.workers.items()):
+            free = list(self.idle_workers).count(address) + sum(
+                    list(slots).count(address)
+                    for slots in self.reserved.values())
+            jobs = []
+            for job_id in sorted(worker.leases):
+                lease = self.leases[job_id]
+                jobs.append({'id': job_id, 'command': lease.queued.command,
+                    'project_id': lease.queued.project_id,
+                    'running_for': now - lease.started})
+            workers.append({'address': address.decode('utf-8', 'replace'),
+                'free': free, 'jobs': jobs,
+                'last_seen': now - worker.last_seen,
+                'dispatched': worker.dispatched, 'done': worker.done,
+                'lost': worker.lost})
+        return {'lanes': lanes, 'delayed': len(self.delayed),
+                'workers': workers, 'buckets': list(BUCKETS),
+                'limits': dict((command, {'running': limit.running,
+                    'max_concurrent': limit.max_concurrent})
+                    for command, limit in self.limits.items()),
+                'queue_wait': dict((lane, ring.summary())
+                    for lane, ring in self.waits.items()),
+                'run_time': dict((command, ring.summary())
+                    for command, ring in self.run_times.items())}
+
+    def send(self, address, *frames):
+        self.socket.send_multipart([address, ''] + list(frames))
@@ -0,0 +1,51 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import bisect
+
+from job_queue.models import percentile
+
+# Upper bounds in seconds of the histogram buckets; the last bucket holds
+# everything longer
+BUCKETS = (1, 5, 15, 60, 5 * 60, 15 * 60, 60 * 60)
+
+class RingBuffer(object):
+    '''The most recent size samples of a duration, kept in one fixed block
+    of memory however long the server runs.'''
+    def __init__(self, size=1024):
+        self.size = size
+        self.samples = array.array('d', [0.0]) * size
+        self.count = 0
+
+    def add(self, value):
+        self.samples[self.count % self.size] = value
+        self.count += 1
+
+    def values(self):
+        return self.samples[:min(self.count, self.size)]
+
+    def histogram(self, buckets=BUCKETS):
+        '''How many samples fall in each bucket.'''
+        counts = [0] * (len(buckets) + 1)
+        for value in self.values():
+            counts[bisect.bisect_left(buckets, value)] += 1
+        return counts
+
+    def summary(self):
+        values = sorted(self.values())
+        return {'samples': len(values), 'histogram': self.histogram(),
+                'percentiles': [percentile(values, f) for f in (.5, .9, .99)]}
@@ -0,0 +1,1862 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import time
+import datetime
+import tempfile
+import subprocess
+import threading
+import multiprocessing
+
+import zmq
+
+from django.conf import settings
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+
+from project.models import Project, PipProject
+from job_queue import executor
+from job_queue.models import JobRun, Schedule
+from job_queue import jobs
+from job_queue.client import JobClient, JobRejected
+from job_queue.jobs import LANES
+from job_queue.server import JobServer, CommandLimit
+from job_queue.journal import Journal
+from job_queue.pipeline import Pipeline, validate
+from job_queue.cron import CronRule
+from job_queue.scheduler import Scheduler
+from job_queue.stats import RingBuffer
+from job_queue.wheelhouse import parse_requirements
+from job_queue.mirrors import mirror_path, FETCH_STAMP
+from job_queue import environments
+from job_queue.worker import ProjectLocks, JobProcessor, run_job
+from notifications.models import Notification
+
+class MockSocket(object):
+    '''Records everything the server sends instead of talking to 0MQ.'''
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, frames):
+        self.sent.append(frames)
+
+    def sent_to(self, address):
+        '''Everything sent to an address, leaving out the lease tokens of
+        dispatched jobs since they differ on every run.'''
+        return [frames[2:5] if len(frames) == 6 else frames[2:]
+                for frames in self.sent if frames[0] == address]
+
+    def leases_sent_to(self, address):
+        return [frames[5] for frames in self.sent
+                if frames[0] == address and len(frames) == 6]
+
+def queued_jobs(server):
+    return [queued for lane in LANES for queued in server.lanes[lane]]
+
+def request(server, address, *frames):
+    server.handle([address, ''] + list(frames))
+    server.commit()
+    server.dispatch()
+
+class JobServerDispatchTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+
+    def test_queued_job_is_acked(self):
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        assert self.socket.sent_to('client') == [['ACK']]
+
+    def test_bad_requests_are_answered_with_errors(self):
+        for frames in (['CANCEL', 'one'], ['CANCEL'], ['BATCH', 'abc', '{'],
+                ['BATCH', 'abc', '[1]']):
+            request(self.server, 'client', *frames)
+            reply = self.socket.sent_to('client').pop()
+            assert reply[0] == 'ERROR'
+        # Workers aren't answered, and the server carries on
+        request(self.server, 'worker', 'READY', 'no-such-lane')
+        request(self.server, 'worker', 'DONE', 'one')
+        assert self.socket.sent_to('worker') == []
+        request(self.server, 'worker', 'READY')
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        assert self.socket.sent_to('worker') == [['1', '{"command": "BUILDOUT"}', '']]
+
+    def test_jobs_with_bad_project_ids_are_refused(self):
+        for job in ('{"command": "TEST", "project_id": "abc"}',
+                '{"command": "TEST", "project_id": [1]}'):
+            request(self.server, 'client', job)
+            assert self.socket.sent_to('client').pop()[0] == 'ERROR'
+            request(self.server, 'client', 'BATCH', 'abc', json.dumps(
+                ['{"command": "BUILDOUT"}', job]))
+            assert self.socket.sent_to('client').pop()[0] == 'ERROR'
+        assert queued_jobs(self.server) == []
+        # Nothing was journalled either
+        request(self.server, 'client', '{"command": "TEST", "project_id": "2"}')
+        assert [(q.id, q.project_id) for q in queued_jobs(self.server)] == [
+                (1, 2)]
+
+    def test_job_pushed_to_waiting_worker(self):
+        request(self.server, 'worker', 'READY')
+        assert self.socket.sent == []
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        assert self.socket.sent_to('worker') == [['1', '{"command": "BUILDOUT"}', '']]
+
+    def test_job_waits_for_a_worker(self):
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        request(self.server, 'worker', 'READY')
+        assert self.socket.sent_to('worker') == [['1', '{"command": "BUILDOUT"}', '']]
+
+    def test_jobs_spread_across_workers(self):
+        request(self.server, 'worker1', 'READY')
+        request(self.server, 'worker2', 'READY')
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        request(self.server, 'client', '{"command": "TEST"}')
+        assert self.socket.sent_to('worker1') == [['1', '{"command": "BUILDOUT"}', '']]
+        assert self.socket.sent_to('worker2') == [['2', '{"command": "TEST"}', '']]
+
+    def test_polling_worker_gets_empty(self):
+        request(self.server, 'worker', 'GET')
+        assert self.socket.sent_to('worker') == [['EMPTY']]
+
+    def test_ack_waits_for_commit(self):
+        self.server.handle(['client', '', '{"command": "BUILDOUT"}'])
+        assert self.socket.sent == []
+        self.server.commit()
+        assert self.socket.sent_to('client') == [['ACK']]
+
+class JobLaneTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+
+    def test_interactive_jobs_go_first(self):
+        request(self.server, 'client', '{"command": "BUILDOUT", "project_id": 1}')
+        request(self.server, 'client', '{"command": "EDIT", "project_id": 1}')
+        request(self.server, 'worker', 'READY')
+        assert self.socket.sent_to('worker') == [
+                ['2', '{"command": "EDIT", "project_id": 1}', '']]
+
+    def test_reserved_slot_only_takes_its_lane(self):
+        request(self.server, 'worker', 'READY', 'interactive')
+        request(self.server, 'client', '{"command": "BUILDOUT", "project_id": 1}')
+        assert self.socket.sent_to('worker') == []
+        request(self.server, 'client', '{"command": "EDIT", "project_id": 1}')
+        assert self.socket.sent_to('worker') == [
+                ['2', '{"command": "EDIT", "project_id": 1}', 'interactive']]
+
+    def test_interactive_jobs_prefer_reserved_slot(self):
+        request(self.server, 'worker1', 'READY')
+        request(self.server, 'worker2', 'READY', 'interactive')
+        request(self.server, 'client', '{"command": "STARTAPP", "project_id": 1}')
+        request(self.server, 'client', '{"command": "BUILDOUT", "project_id": 1}')
+        assert self.socket.sent_to('worker1') == [
+                ['2', '{"command": "BUILDOUT", "project_id": 1}', '']]
+
+class JobCoalescingTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+
+    def test_duplicate_waiting_job_is_merged(self):
+        request(self.server, 'client1', '{"command": "TEST", "project_id": 1}')
+        request(self.server, 'client2', '{"project_id": 1, "command": "TEST"}')
+        assert self.socket.sent_to('client2') == [['ACK']]
+        assert len(queued_jobs(self.server)) == 1
+        assert queued_jobs(self.server)[0].requests == 2
+
+    def test_different_projects_are_not_merged(self):
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        request(self.server, 'client', '{"command": "TEST", "project_id": 2}')
+        assert len(queued_jobs(self.server)) == 2
+
+    def test_running_job_is_not_merged(self):
+        request(self.server, 'worker', 'READY')
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        assert len(queued_jobs(self.server)) == 1
+        assert queued_jobs(self.server)[0].id == 2
+
+class JobLeaseTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+        request(self.server, 'worker1', 'READY')
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        request(self.server, 'client', '{"command": "TEST"}')
+
+    def go_quiet(self, address):
+        self.server.workers[address].last_seen -= self.server.lease_timeout
+
+    def test_quiet_worker_loses_its_job(self):
+        self.go_quiet('worker1')
+        self.server.expire(time.time())
+        assert [q.id for q in queued_jobs(self.server)] == [1, 2]
+        request(self.server, 'worker2', 'READY')
+        assert self.socket.sent_to('worker2') == [
+                ['1', '{"command": "BUILDOUT"}', '']]
+
+    def test_lost_job_is_merged_with_new_requests(self):
+        self.go_quiet('worker1')
+        self.server.expire(time.time())
+        request(self.server, 'client', '{"command": "BUILDOUT"}')
+        assert [q.id for q in queued_jobs(self.server)] == [1, 2]
+
+    def test_heartbeat_keeps_lease(self):
+        self.server.workers['worker1'].last_seen -= 10
+        request(self.server, 'worker1', 'HEARTBEAT', '0', '0')
+        self.server.expire(time.time())
+        assert [q.id for q in queued_jobs(self.server)] == [2]
+
+    def test_quiet_worker_slots_are_forgotten(self):
+        socket = MockSocket()
+        server = JobServer(socket)
+        request(server, 'worker1', 'READY')
+        server.workers['worker1'].last_seen -= server.lease_timeout
+        server.expire(time.time())
+        request(server, 'worker2', 'READY')
+        request(server, 'client', '{"command": "TEST"}')
+        assert socket.sent_to('worker1') == []
+        assert socket.sent_to('worker2') == [['1', '{"command": "TEST"}', '']]
+
+    def test_stale_done_is_ignored(self):
+        stale = self.socket.leases_sent_to('worker1')[0]
+        self.go_quiet('worker1')
+        self.server.expire(time.time())
+        request(self.server, 'worker2', 'READY')
+        request(self.server, 'worker1', 'DONE', '1', 'success', stale)
+        assert 1 in self.server.leases
+        assert self.server.leases[1].address == 'worker2'
+        fresh = self.socket.leases_sent_to('worker2')[0]
+        request(self.server, 'worker2', 'DONE', '1', 'success', fresh)
+        assert 1 not in self.server.leases
+        assert self.server.workers['worker2'].done == 1
+
+    def test_returning_worker_offers_its_free_slots(self):
+        self.go_quiet('worker1')
+        self.server.expire(time.time())
+        request(self.server, 'worker1', 'HEARTBEAT', '1', '0')
+        assert self.socket.sent_to('worker1')[-1] == [
+                '1', '{"command": "BUILDOUT"}', '']
+        # Only the first heartbeat is checked against the slots we know of
+        request(self.server, 'worker1', 'HEARTBEAT', '1', '0')
+        assert len(self.socket.sent_to('worker1')) == 2
+
+class CommandLimitTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+        for worker in ('worker1', 'worker2', 'worker3', 'worker4'):
+            request(self.server, worker, 'READY')
+
+    def sent_commands(self):
+        return sorted(json.loads(frames[3])['command']
+                for frames in self.socket.sent if len(frames) == 6)
+
+    def test_concurrent_runs_are_capped(self):
+        for project_id in (1, 2, 3):
+            request(self.server, 'client',
+                    '{"command": "BUILDOUT", "project_id": %d}' % project_id)
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        # The third buildout waits, but the test behind it still runs
+        assert self.sent_commands() == ["BUILDOUT", "BUILDOUT", "TEST"]
+        request(self.server, 'worker1', 'DONE', '1', 'success')
+        assert self.sent_commands() == ["BUILDOUT", "BUILDOUT", "BUILDOUT",
+                "TEST"]
+
+    def test_lost_lease_frees_its_run(self):
+        for project_id in (1, 2, 3):
+            request(self.server, 'client',
+                    '{"command": "BUILDOUT", "project_id": %d}' % project_id)
+        self.server.workers['worker1'].last_seen -= 60
+        self.server.expire(time.time())
+        self.server.dispatch()
+        assert self.server.limits["BUILDOUT"].running == 2
+        assert self.sent_commands() == ["BUILDOUT"] * 3
+
+    def test_rate_limit(self):
+        limit = CommandLimit(None, (1, 60), time.time())
+        self.server.limits["TEST"] = limit
+        for project_id in (1, 2):
+            request(self.server, 'client',
+                    '{"command": "TEST", "project_id": %d}' % project_id)
+        request(self.server, 'client', '{"command": "SYNCDB", "project_id": 1}')
+        assert self.sent_commands() == ["SYNCDB", "TEST"]
+        assert 50 < self.server.throttled_until - time.time() <= 60
+        limit.updated -= 60
+        self.server.dispatch()
+        assert self.sent_commands() == ["SYNCDB", "TEST", "TEST"]
+
+class StatsTests(TestCase):
+    def test_ring_buffer_keeps_recent_samples(self):
+        ring = RingBuffer(size=3)
+        for value in (100, 0.5, 2, 3):
+            ring.add(value)
+        assert sorted(ring.values()) == [0.5, 2, 3]
+        assert ring.histogram((1, 5)) == [1, 2, 0]
+        assert ring.summary()['percentiles'] == [2, 3, 3]
+
+    def test_stats_request(self):
+        socket = MockSocket()
+        server = JobServer(socket)
+        request(server, 'worker', 'READY')
+        for project_id in (1, 2):
+            request(server, 'client',
+                    '{"command": "TEST", "project_id": %d}' % project_id)
+        request(server, 'worker', 'DONE', '1', 'success')
+        request(server, 'worker', 'READY')
+        request(server, 'client', 'STATS')
+        stats = json.loads(socket.sent_to('client')[-1][0])
+        assert stats['lanes']['bulk']['depth'] == 0
+        assert stats['lanes']['normal'] == {'depth': 0, 'oldest_wait': None}
+        worker, = stats['workers']
+        assert worker['address'] == 'worker'
+        assert worker['free'] == 0
+        assert [(job['id'], job['command']) for job in worker['jobs']] == [
+                (2, "TEST")]
+        assert stats['queue_wait']['bulk']['samples'] == 2
+        assert stats['run_time']['TEST']['samples'] == 1
+        assert stats['limits']['BUILDOUT'] == {'running': 0,
+                'max_concurrent': 2}
+
+    def test_dashboard(self):
+        response = self.client.get(reverse("queue_dashboard"))
+        assert reverse("queue_stats") in response.content
+
+class JobRoutingTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+        self.here = Project.objects.create(name="here",
+                base_directory="/srv/here/crane", project_type="buildout")
+        self.there = Project.objects.create(name="there",
+                base_directory="/srv/there/crane", project_type="buildout")
+
+    def job(self, project):
+        return '{"command": "BUILDOUT", "project_id": %d}' % project.id
+
+    def test_jobs_go_to_workers_that_can_see_them(self):
+        request(self.server, 'here', 'HEARTBEAT', '0', '0', '["/srv/here"]')
+        request(self.server, 'there', 'HEARTBEAT', '0', '0', '["/srv/there/"]')
+        request(self.server, 'here', 'READY')
+        request(self.server, 'there', 'READY')
+        request(self.server, 'client', self.job(self.there))
+        request(self.server, 'client', self.job(self.here))
+        assert self.socket.sent_to('there') == [['1', self.job(self.there), '']]
+        assert self.socket.sent_to('here') == [['2', self.job(self.here), '']]
+
+    def test_unreachable_job_is_passed_over(self):
+        request(self.server, 'here', 'HEARTBEAT', '0', '0', '["/srv/here"]')
+        request(self.server, 'client', self.job(self.there))
+        request(self.server, 'client', self.job(self.here))
+        request(self.server, 'here', 'READY')
+        assert self.socket.sent_to('here') == [['2', self.job(self.here), '']]
+        assert [q.id for q in queued_jobs(self.server)] == [1]
+        request(self.server, 'anywhere', 'READY')
+        assert self.socket.sent_to('anywhere') == [['1', self.job(self.there), '']]
+
+    def test_prefix_is_not_enough(self):
+        request(self.server, 'here', 'HEARTBEAT', '0', '0', '["/srv/her"]')
+        request(self.server, 'here', 'READY')
+        request(self.server, 'client', self.job(self.here))
+        assert self.socket.sent_to('here') == []
+
+def stub_job_processor(address, name, roots, results):
+    '''A job processor standing in for another host, which reports the jobs
+    it is sent instead of running them.'''
+    context = zmq.Context()
+    socket = context.socket(zmq.XREQ)
+    socket.setsockopt(zmq.IDENTITY, name)
+    socket.connect(address)
+    def run_job(job_id, job, lease=""):
+        time.sleep(0.01)
+        results.put((name, job['project_id']))
+        return "success"
+    JobProcessor(context, socket, workers=2, reserved=0, roots=roots,
+            run_job=run_job).run()
+
+class MultiHostTests(TestCase):
+    '''Runs job processors for pretend hosts in their own processes against
+    a real job server socket.'''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = "ipc://%s" % os.path.join(self.directory, "jobs")
+        self.results = multiprocessing.Queue()
+        self.hosts = {'build1': ["/srv/build1"], 'build2': ["/srv/build2"]}
+        # Fork before this process creates any 0MQ context
+        self.processes = [multiprocessing.Process(target=stub_job_processor,
+            args=(self.address, name, roots, self.results))
+            for name, roots in sorted(self.hosts.items())]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.XREP)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(self.address)
+        self.server = JobServer(self.socket)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def tearDown(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.socket.close()
+        self.context.term()
+        shutil.rmtree(self.directory)
+
+    def serve_until(self, done, timeout=10):
+        deadline = time.time() + timeout
+        while not done() and time.time() < deadline:
+            self.server.serve_once(self.poller, 0.05)
+        assert done()
+
+    def test_jobs_are_routed_by_directory(self):
+        self.serve_until(lambda: len(self.server.idle_workers) == 4)
+        projects = [Project.objects.create(name="p%d" % i,
+            base_directory="/srv/build%d/p%d" % (i % 2 + 1, i),
+            project_type="buildout") for i in range(10)]
+        for project in projects:
+            self.server.queue_job('{"command": "TEST", "project_id": %d}' % (
+                project.id))
+        ran = []
+        def collect():
+            while not self.results.empty():
+                ran.append(self.results.get())
+            return len(ran) == len(projects)
+        self.serve_until(collect)
+        for host, project_id in ran:
+            project = Project.objects.get(id=project_id)
+            assert project.base_directory.startswith(self.hosts[host][0])
+        assert set(host for host, project_id in ran) == set(self.hosts)
+        self.serve_until(lambda: not self.server.leases)
+
+class JobCancelTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+
+    def test_waiting_job_is_dropped(self):
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        request(self.server, 'client', 'CANCEL', '1')
+        assert self.socket.sent_to('client') == [['ACK'], ['ACK']]
+        assert queued_jobs(self.server) == []
+        assert self.server.waiting == {}
+        request(self.server, 'worker', 'READY')
+        assert self.socket.sent_to('worker') == []
+
+    def test_running_job_is_cancelled_by_its_worker(self):
+        request(self.server, 'worker', 'READY')
+        request(self.server, 'client', '{"command": "TEST", "project_id": 1}')
+        request(self.server, 'client', 'CANCEL', '1')
+        assert self.socket.sent_to('worker')[-1] == ['CANCEL', '1']
+        request(self.server, 'worker', 'DONE', '1', 'cancelled')
+        assert self.server.leases == {}
+
+def step(name, command, after=(), on_failure="stop"):
+    return {'name': name, 'job': '{"command": "%s"}' % command,
+            'after': list(after), 'on_failure': on_failure}
+
+class PipelineTests(TestCase):
+    def test_steps_are_ordered_by_dependency(self):
+        steps = validate({'steps': [step("test", "TEST", ["build"]),
+            step("build", "BUILDOUT", ["pull"]), step("pull", "GITPULL")]})
+        assert [s['name'] for s in steps] == ["pull", "build", "test"]
+
+    def test_bad_pipelines_are_refused(self):
+        self.assertRaises(ValueError, validate, {'steps': []})
+        self.assertRaises(ValueError, validate,
+                {'steps': [step("test", "TEST", ["build"])]})
+        self.assertRaises(ValueError, validate, {'steps': [
+            step("a", "TEST", ["b"]), step("b", "TEST", ["a"])]})
+
+    def test_failure_stops_dependents(self):
+        pipeline = Pipeline(1, {'steps': [step("pull", "GITPULL"),
+            step("build", "BUILDOUT", ["pull"]),
+            step("test", "TEST", ["build"])]})
+        assert [s.name for s in pipeline.ready()] == ["pull"]
+        pipeline.by_name["pull"].job_id = 1
+        pipeline.finish("pull", "error")
+        assert pipeline.ready() == []
+        assert pipeline.by_name["test"].status == "skipped"
+        assert pipeline.finished()
+
+    def test_continue_policy_runs_dependents(self):
+        pipeline = Pipeline(1, {'steps': [
+            step("pull", "GITPULL", on_failure="continue"),
+            step("test", "TEST", ["pull"])]})
+        pipeline.by_name["pull"].job_id = 1
+        pipeline.finish("pull", "error")
+        assert [s.name for s in pipeline.ready()] == ["test"]
+
+class JobPipelineTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket)
+        self.spec = json.dumps({'steps': [step("pull", "GITPULL"),
+            step("build", "BUILDOUT", ["pull"]),
+            step("docs", "SYNCDB", ["pull"]),
+            step("test", "TEST", ["build", "docs"])]})
+
+    def commands(self, address):
+        return [json.loads(frames[1])['command']
+                for frames in self.socket.sent_to(address) if len(frames) > 1]
+
+    def test_branches_run_in_parallel(self):
+        for worker in ('worker1', 'worker2'):
+            request(self.server, worker, 'READY')
+        request(self.server, 'client', 'PIPELINE', self.spec)
+        assert self.socket.sent_to('client') == [['ACK']]
+        assert self.commands('worker1') == ["GITPULL"]
+        request(self.server, 'worker1', 'DONE', '2', 'success')
+        request(self.server, 'worker1', 'READY')
+        assert self.commands('worker1') == ["GITPULL", "BUILDOUT"]
+        assert self.commands('worker2') == ["SYNCDB"]
+        request(self.server, 'worker2', 'DONE', '4', 'success')
+        request(self.server, 'worker2', 'READY')
+        assert self.commands('worker2') == ["SYNCDB"]
+        request(self.server, 'worker1', 'DONE', '3', 'success')
+        assert self.commands('worker2') == ["SYNCDB", "TEST"]
+        request(self.server, 'worker2', 'DONE', '5', 'success')
+        assert self.server.pipelines == {}
+
+    def test_failure_stops_pipeline(self):
+        request(self.server, 'worker', 'READY')
+        request(self.server, 'client', 'PIPELINE', self.spec)
+        request(self.server, 'worker', 'DONE', '2', 'error')
+        request(self.server, 'worker', 'READY')
+        assert self.commands('worker') == ["GITPULL"]
+        assert queued_jobs(self.server) == []
+        assert self.server.pipelines == {}
+
+    def test_bad_pipeline_is_answered_with_an_error(self):
+        for spec in ('{"steps": []}', '{', json.dumps({'steps': [
+                {'name': "test", 'job': '{"project_id": "abc"}'}]})):
+            request(self.server, 'client', 'PIPELINE', spec)
+            assert self.socket.sent_to('client').pop()[0] == 'ERROR'
+        assert self.server.pipelines == {}
+        assert queued_jobs(self.server) == []
+
+class JournalTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'jobs.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reopen(self, journal):
+        journal.close()
+        journal = Journal(self.filename)
+        return journal, journal.replay()
+
+    def test_unfinished_jobs_are_replayed_in_order(self):
+        journal = Journal(self.filename)
+        journal.replay()
+        first = journal.put('{"command": "BUILDOUT"}')
+        second = journal.put('{"command": "TEST"}')
+        third = journal.put('{"command": "GITPULL"}')
+        journal.done(second)
+        journal, jobs = self.reopen(journal)
+        assert jobs == [(first, '{"command": "BUILDOUT"}'),
+                (third, '{"command": "GITPULL"}')]
+
+    def test_ids_keep_increasing_after_compaction(self):
+        journal = Journal(self.filename)
+        journal.replay()
+        journal.done(journal.put('{"command": "BUILDOUT"}'))
+        journal, jobs = self.reopen(journal)
+        assert jobs == []
+        assert journal.put('{"command": "TEST"}') == 2
+
+    def test_torn_write_is_ignored(self):
+        journal = Journal(self.filename)
+        journal.replay()
+        job_id = journal.put('{"command": "BUILDOUT"}')
+        journal.close()
+        with open(self.filename, "a") as journal_file:
+            journal_file.write('{"op": "put", "id": 2, "jo')
+        journal = Journal(self.filename)
+        assert journal.replay() == [(job_id, '{"command": "BUILDOUT"}')]
+
+    def test_pipeline_resumes_after_restart(self):
+        journal = Journal(self.filename)
+        server = JobServer(MockSocket(), journal)
+        request(server, 'client', 'PIPELINE', json.dumps({'steps': [
+            step("pull", "GITPULL"), step("test", "TEST", ["pull"])]}))
+        request(server, 'worker', 'READY')
+        journal.close()
+        journal = Journal(self.filename)
+        socket = MockSocket()
+        server = JobServer(socket, journal)
+        # The pull never said it was done, so it runs again
+        assert [queued.id for queued in queued_jobs(server)] == [2]
+        request(server, 'worker', 'READY')
+        request(server, 'worker', 'DONE', '2', 'success')
+        request(server, 'worker', 'READY')
+        assert [json.loads(frames[1])['command']
+                for frames in socket.sent_to('worker')] == ["GITPULL", "TEST"]
+        journal.close()
+
+    def test_delayed_job_stays_delayed_after_restart(self):
+        journal = Journal(self.filename)
+        server = JobServer(MockSocket(), journal)
+        server.queue_job('{"command": "TEST"}', delay=60)
+        server.commit()
+        journal.close()
+        server = JobServer(MockSocket(), Journal(self.filename))
+        assert queued_jobs(server) == []
+        assert [entry[1] for entry in server.delayed] == [1]
+        server.release(time.time() + 120)
+        assert [queued.id for queued in queued_jobs(server)] == [1]
+        server.journal.close()
+
+    def test_server_requeues_replayed_jobs(self):
+        journal = Journal(self.filename)
+        journal.replay()
+        journal.put('{"command": "BUILDOUT"}')
+        journal.close()
+        socket = MockSocket()
+        server = JobServer(socket, Journal(self.filename))
+        request(server, 'worker', 'READY')
+        assert socket.sent_to('worker') == [['1', '{"command": "BUILDOUT"}', '']]
+
+    def test_server_drops_bad_replayed_jobs(self):
+        journal = Journal(self.filename)
+        journal.replay()
+        journal.put('{"command": "TEST", "project_id": "abc"}')
+        journal.put('{"command": "TEST", "project_id": [1]}')
+        journal.put('{"command": "BUILDOUT"}')
+        journal.close()
+        socket = MockSocket()
+        server = JobServer(socket, Journal(self.filename))
+        server.commit()
+        assert [q.id for q in queued_jobs(server)] == [3]
+        server.journal.close()
+        assert Journal(self.filename).replay() == [
+                (3, '{"command": "BUILDOUT"}')]
+
+class ProjectLocksTests(TestCase):
+    def test_different_projects_run_together(self):
+        locks = ProjectLocks()
+        assert locks.acquire('1', 'buildout 1')
+        assert locks.acquire('2', 'buildout 2')
+
+    def test_same_project_runs_in_order(self):
+        locks = ProjectLocks()
+        assert locks.acquire('1', 'buildout')
+        assert not locks.acquire('1', 'test')
+        assert not locks.acquire('1', 'pull')
+        assert locks.release('1') == 'test'
+        assert locks.release('1') == 'pull'
+        assert locks.release('1') is None
+        assert locks.acquire('1', 'buildout again')
+
+    def test_waiting_job_can_be_discarded(self):
+        locks = ProjectLocks()
+        assert locks.acquire('1', 'buildout')
+        assert not locks.acquire('1', 'test')
+        assert not locks.acquire('1', 'pull')
+        assert locks.discard('1', lambda job: job == 'test') == 'test'
+        assert locks.discard('1', lambda job: job == 'test') is None
+        assert locks.release('1') == 'pull'
+
+    def test_jobs_without_project_never_wait(self):
+        locks = ProjectLocks()
+        assert locks.acquire(None, 'one')
+        assert locks.acquire(None, 'two')
+        assert locks.release(None) is None
+
+class JobProcessorTests(TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.socket = MockSocket()
+        self.processor = JobProcessor(self.context, self.socket,
+                run_job=self.run_job)
+        self.processor.ready("")
+
+    def tearDown(self):
+        # The pool thread's socket is never closed, so the context is left
+        # for the garbage collector rather than terminated
+        self.processor.finished.close()
+
+    def run_job(self, job_id, job, lease=""):
+        raise KeyError(job['command'])
+
+    def test_bad_job_is_handed_back(self):
+        self.processor.receive(["", "1", "[1", "", "token"])
+        assert self.socket.sent[-2:] == [["", "DONE", "1", "error", "token"],
+                ["", "READY"]]
+        assert self.processor.free[""] == 1
+        assert self.processor.jobs == {}
+
+    def test_waiting_job_gives_its_slot_back(self):
+        self.processor.ready("")
+        self.processor.receive(["", "1", '{"command": "TEST", "project_id": 3}',
+            "", "a"])
+        self.processor.receive(["", "2", '{"command": "TEST", "project_id": 3}',
+            "", "b"])
+        # The second job waits for the first, so its slot is offered again
+        assert self.socket.sent[-1] == ["", "READY"]
+        assert self.processor.free[""] == 1
+        assert self.processor.runnable.get_nowait()[0] == "1"
+        self.processor.complete(["1", "3", "", "success", "a"])
+        # and it runs in the slot the first one leaves
+        assert self.socket.sent[-1] == ["", "DONE", "1", "success", "a"]
+        assert self.processor.free[""] == 1
+        assert self.processor.runnable.get_nowait() == ("2",
+                {"command": "TEST", "project_id": 3}, "", "b")
+
+    def test_job_that_blows_up_still_finishes(self):
+        thread = threading.Thread(target=self.processor.work)
+        thread.setDaemon(True)
+        thread.start()
+        self.processor.receive(["", "1",
+            '{"command": "NOPE", "project_id": 3}', "", "token"])
+        assert self.processor.finished.poll(5000)
+        self.processor.complete(self.processor.finished.recv_multipart())
+        assert self.socket.sent[-2:] == [["", "DONE", "1", "error", "token"],
+                ["", "READY"]]
+        assert self.processor.locks.waiting == {}
+
+class OutputBufferTests(TestCase):
+    def test_short_output_is_kept(self):
+        output = executor.OutputBuffer(head_size=10, tail_size=10)
+        output.write("hello ")
+        output.write("world")
+        assert output.getvalue() == "hello world"
+
+    def test_middle_of_long_output_is_skipped(self):
+        output = executor.OutputBuffer(head_size=4, tail_size=4)
+        for chunk in ["abc", "defgh", "ijk", "lmnop"]:
+            output.write(chunk)
+        assert output.getvalue() == (
+                "abcd\n\n[... 8 bytes of output skipped ...]\n\nmnop")
+
+class JobOutputTests(TestCase):
+    def setUp(self):
+        self.old_directory = settings.JOB_OUTPUT_DIRECTORY
+        settings.JOB_OUTPUT_DIRECTORY = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(settings.JOB_OUTPUT_DIRECTORY)
+        settings.JOB_OUTPUT_DIRECTORY = self.old_directory
+
+    def test_command_output_is_logged(self):
+        executor.start_job('7', 3)
+        returncode, output = executor.run_command("echo one; echo two; exit 2")
+        assert returncode == 2
+        assert output == "one\ntwo\n"
+        assert executor.latest_job(3) == 7
+        assert executor.read_output(3, 7, 0) == {'job': 7,
+                'output': "one\ntwo\n", 'offset': 8, 'running': True}
+        executor.finish_job()
+        assert executor.read_output(3, 7, 4) == {'job': 7,
+                'output': "two\n", 'offset': 8, 'running': False}
+
+    def test_tail_view_follows_newest_job(self):
+        project = Project.objects.create(name="crane",
+                base_directory="/tmp/crane", project_type="buildout")
+        executor.start_job('1', project.id)
+        executor.run_command("echo first")
+        executor.finish_job()
+        url = reverse("job_output", args=[project.id])
+        data = json.loads(self.client.get(url).content)
+        assert data == {'job': 1, 'output': "first\n", 'offset': 6,
+                'running': False}
+        data = json.loads(self.client.get(url, {'job': 1, 'offset': 6}).content)
+        assert data['output'] == ""
+        # A bad offset starts again from the tail
+        for params in ({'job': 1}, {'job': 1, 'offset': 'x'}):
+            data = json.loads(self.client.get(url, params).content)
+            assert data['output'] == "first\n"
+        executor.start_job('2', project.id)
+        executor.run_command("echo second")
+        data = json.loads(self.client.get(url, {'job': 1, 'offset': 6}).content)
+        assert data == {'job': 2, 'output': "second\n", 'offset': 7,
+                'running': True}
+        executor.finish_job()
+
+    def test_commands_run_side_by_side(self):
+        executor.start_job('8', 3)
+        start = time.time()
+        results = executor.run_commands(["sleep 0.6; echo one; exit 1",
+            "echo two", "sleep 0.3; echo three; exit 2"])
+        assert time.time() - start < 1.2
+        assert results == [(1, "one\n"), (0, "two\n"), (2, "three\n")]
+        # The first failure in the order given, not the first to happen
+        assert executor.finish_job() == (1, 14)
+
+    def test_recoverable_failures_dont_fail_the_job(self):
+        executor.start_job('9', 3)
+        assert executor.run_command("echo one; exit 1",
+                recoverable=True) == (1, "one\n")
+        executor.run_command("echo two")
+        assert executor.finish_job() == (0, 8)
+
+    def test_parallel_limit(self):
+        start = time.time()
+        assert executor.run_commands(["sleep 0.3; echo %d" % i
+            for i in range(4)], parallel=2) == [(0, "%d\n" % i)
+                for i in range(4)]
+        assert 0.6 <= time.time() - start < 1.2
+
+    def test_cancel_kills_every_command(self):
+        executor.start_job('9', 3)
+        threading.Timer(0.3, executor.cancel_job, ['9']).start()
+        start = time.time()
+        self.assertRaises(executor.JobCancelled, executor.run_commands,
+                ["sleep 30", "sleep 30", "echo done"], parallel=2)
+        executor.finish_job()
+        assert time.time() - start < 5
+
+    def test_no_log_without_a_job(self):
+        assert executor.run_command("echo hi") == (0, "hi\n")
+        assert executor.latest_job(3) is None
+
+class JobTimeoutTests(TestCase):
+    def setUp(self):
+        self.old_directory = settings.JOB_OUTPUT_DIRECTORY
+        settings.JOB_OUTPUT_DIRECTORY = tempfile.mkdtemp()
+        self.project = Project.objects.create(name="crane",
+                base_directory="/tmp/crane", project_type="buildout")
+
+    def tearDown(self):
+        shutil.rmtree(settings.JOB_OUTPUT_DIRECTORY)
+        settings.JOB_OUTPUT_DIRECTORY = self.old_directory
+        jobs.command_map.pop("SLEEP", None)
+
+    def test_timeout_kills_process_group(self):
+        executor.start_job('1', self.project.id, timeout=0.5)
+        start = time.time()
+        try:
+            # The backgrounded sleep keeps the output open unless the whole
+            # group is killed
+            executor.run_command("sleep 30 & sleep 30")
+        except executor.JobTimedOut:
+            pass
+        else:
+            self.fail("JobTimedOut not raised")
+        finally:
+            executor.finish_job()
+        assert time.time() - start < 5
+
+    def test_cancel_from_another_thread(self):
+        executor.start_job('2', self.project.id)
+        threading.Timer(0.3, executor.cancel_job, ['2']).start()
+        self.assertRaises(executor.JobCancelled, executor.run_command,
+                "sleep 30")
+        executor.finish_job()
+
+    def test_cancelled_before_starting(self):
+        executor.cancel_job('3')
+        executor.start_job('3', self.project.id)
+        self.assertRaises(executor.JobCancelled, executor.run_command,
+                "echo never")
+        executor.finish_job()
+        assert executor.cancelled == set()
+
+    def test_timed_out_job_is_recorded(self):
+        jobs.command("SLEEP", timeout=0.5)(
+                lambda project_id: executor.run_command("sleep 30"))
+        JobRun.objects.record_queued('4', '{}', "SLEEP", self.project.id)
+        assert run_job('4', {'command': "SLEEP",
+            'project_id': self.project.id}) == "timeout"
+        assert JobRun.objects.get(job_id=4).status == "timeout"
+        notification = Notification.objects.get(project=self.project)
+        assert notification.summary == "SLEEP command timed out"
+
+    def test_unknown_command_is_an_error(self):
+        assert run_job('5', {'command': "NOPE",
+            'project_id': self.project.id}) == "error"
+        notification = Notification.objects.get(project=self.project)
+        assert notification.summary == "NOPE command failed to run"
+
+class CommandReactorTests(TestCase):
+    def setUp(self):
+        self.old_directory = settings.JOB_OUTPUT_DIRECTORY
+        settings.JOB_OUTPUT_DIRECTORY = tempfile.mkdtemp()
+        executor.reactor = executor.CommandReactor()
+        executor.reactor.start()
+
+    def tearDown(self):
+        executor.reactor = None
+        shutil.rmtree(settings.JOB_OUTPUT_DIRECTORY)
+        settings.JOB_OUTPUT_DIRECTORY = self.old_directory
+
+    def run_job(self, job_id, command, results):
+        executor.start_job(job_id, 1)
+        try:
+            results[job_id] = executor.run_command(command)
+        except executor.JobInterrupted, e:
+            results[job_id] = e.status
+        finally:
+            executor.finish_job()
+
+    def test_commands_run_side_by_side(self):
+        results = {}
+        threads = [threading.Thread(target=self.run_job, args=(str(job_id),
+            "sleep 0.5; echo %d" % job_id, results))
+            for job_id in range(10)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - start < 3
+        assert results == dict((str(job_id), (0, "%d\n" % job_id))
+                for job_id in range(10))
+        assert executor.reactor.commands == {}
+        assert executor.read_output(1, 3)['output'] == "3\n"
+
+    def test_one_job_runs_commands_side_by_side(self):
+        executor.start_job('2', 1)
+        assert executor.run_commands(["sleep 0.3; echo two", "echo three"]
+                ) == [(0, "two\n"), (0, "three\n")]
+        executor.finish_job()
+        assert executor.reactor.commands == {}
+
+    def test_cancel(self):
+        results = {}
+        thread = threading.Thread(target=self.run_job,
+                args=('1', "sleep 30", results))
+        thread.start()
+        time.sleep(0.3)
+        executor.cancel_job('1')
+        thread.join(5)
+        assert results == {'1': "cancelled"}
+
+class WritePoolTests(TestCase):
+    def test_calls_are_made_on_the_pool(self):
+        pool = executor.WritePool(1)
+        caller = threading.currentThread()
+        assert pool.call(lambda x: threading.currentThread() is not caller
+                and x * 2, 21) == 42
+        self.assertRaises(ZeroDivisionError, pool.call, lambda: 1 / 0)
+
+class JobRunTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="crane",
+                base_directory="/tmp/crane", project_type="buildout")
+
+    def test_server_records_queue_and_dispatch(self):
+        socket = MockSocket()
+        server = JobServer(socket, record_runs=True)
+        job = '{"command": "TEST", "project_id": %d}' % self.project.id
+        request(server, 'client', job)
+        run = JobRun.objects.get(job_id=1)
+        assert run.status == "queued"
+        assert run.command == "TEST"
+        assert run.project == self.project
+        request(server, 'worker', 'READY')
+        run = JobRun.objects.get(job_id=1)
+        assert run.status == "dispatched"
+        assert run.worker == "worker"
+        assert run.dispatched_at
+
+    def test_lost_lease_cannot_change_run(self):
+        JobRun.objects.create(job_id=1, job="{}", lease="b.2",
+                queued_at=datetime.datetime.now())
+        JobRun.objects.record_finished(1, "success", 0, 0, "a.1")
+        assert JobRun.objects.get(job_id=1).status == "queued"
+        JobRun.objects.record_finished(1, "success", 0, 0, "b.2")
+        assert JobRun.objects.get(job_id=1).status == "success"
+
+    def test_job_ids_continue_from_history(self):
+        JobRun.objects.create(job_id=41, job="{}",
+                queued_at=datetime.datetime.now())
+        server = JobServer(MockSocket(), record_runs=True)
+        request(server, 'client', '{"command": "TEST"}')
+        assert JobRun.objects.filter(job_id=42).count() == 1
+
+    def test_timing_percentiles(self):
+        start = datetime.datetime(2010, 8, 14)
+        for i in range(10):
+            JobRun.objects.create(job_id=i, job="{}", command="TEST",
+                    project=self.project, status="success", queued_at=start,
+                    started_at=start + datetime.timedelta(seconds=i),
+                    finished_at=start + datetime.timedelta(seconds=10 * i))
+        timings = JobRun.objects.timings(self.project)
+        assert timings == [{'command': "TEST", 'runs': 10,
+            'queue_wait': [5, 9, 9], 'run_time': [45, 81, 81]}]
+
+    def test_history_view(self):
+        JobRun.objects.create(job_id=1, job="{}", command="BUILDOUT",
+                project=self.project, queued_at=datetime.datetime.now())
+        response = self.client.get(reverse("job_history",
+            args=[self.project.id]))
+        assert response.status_code == 200
+        assert "BUILDOUT" in response.content
+
+class BatchTests(TestCase):
+    def setUp(self):
+        self.socket = MockSocket()
+        self.server = JobServer(self.socket, record_runs=True)
+        self.projects = [Project.objects.create(name="crane%d" % i,
+                base_directory="/tmp/crane%d" % i, project_type="buildout")
+                for i in range(3)]
+
+    def batch(self, command):
+        return json.dumps(['{"command": "%s", "project_id": %d}' % (
+            command, project.id) for project in self.projects])
+
+    def test_batch_is_acked_once(self):
+        request(self.server, 'client', 'BATCH', 'abc', self.batch('TEST'))
+        assert self.socket.sent_to('client') == [['ACK']]
+        assert len(queued_jobs(self.server)) == 3
+
+    def test_batch_fans_out_across_workers(self):
+        for worker in ('worker1', 'worker2'):
+            request(self.server, worker, 'READY')
+        request(self.server, 'client', 'BATCH', 'abc', self.batch('TEST'))
+        assert [frames[0] for frames in self.socket.sent_to('worker1')] == ['1']
+        assert [frames[0] for frames in self.socket.sent_to('worker2')] == ['2']
+        assert len(queued_jobs(self.server)) == 1
+
+    def test_batch_progress(self):
+        request(self.server, 'client', 'BATCH', 'abc', self.batch('TEST'))
+        request(self.server, 'worker', 'READY')
+        JobRun.objects.record_started(1)
+        JobRun.objects.record_finished(1, "error", 1, 0)
+        progress = JobRun.objects.batch_progress('abc')
+        assert progress['total'] == 3
+        assert progress['queued'] == 2
+        assert progress['finished'] == 1
+        assert progress['error'] == 1
+        response = self.client.get(reverse("batch_progress", args=['abc']))
+        assert json.loads(response.content)['queued'] == 2
+
+    def test_merged_jobs_count_toward_the_batch(self):
+        request(self.server, 'client', '{"command": "TEST", "project_id": %d}'
+                % self.projects[0].id)
+        request(self.server, 'client', 'BATCH', 'abc', self.batch('TEST'))
+        assert len(queued_jobs(self.server)) == 3
+        request(self.server, 'worker', 'READY')
+        JobRun.objects.record_finished(1, "success", 0, 0)
+        progress = JobRun.objects.batch_progress('abc')
+        assert progress['total'] == 3
+        assert progress['finished'] == 1
+
+    def test_bulk_form_on_project_list(self):
+        response = self.client.get(reverse("list_projects"))
+        assert response.status_code == 200
+        assert 'action="%s"' % reverse("bulk_command") in response.content
+
+class AckServer(threading.Thread):
+    '''Stands in for the job server, acknowledging a number of jobs (or
+    answering them with some other reply, or rejecting the jobs in
+    rejects).'''
+    def __init__(self, address, count, reply=("ACK",), rejects=()):
+        super(AckServer, self).__init__()
+        self.reply = list(reply)
+        self.rejects = rejects
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(address)
+        self.count = count
+        self.received = []
+
+    def run(self):
+        for i in range(self.count):
+            frames = self.socket.recv_multipart()
+            self.received.append(frames)
+            if frames[0] in self.rejects:
+                self.socket.send_multipart(["ERROR", "Bad job"])
+            else:
+                self.socket.send_multipart(self.reply)
+        self.socket.close()
+
+class JobClientTests(TestCase):
+    address = 'tcp://127.0.0.1:5565'
+
+    def setUp(self):
+        self.spool_directory = tempfile.mkdtemp()
+        self.client = JobClient(self.address, timeout=0.2,
+                spool_directory=self.spool_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_directory)
+
+    def test_job_is_spooled_when_server_is_down(self):
+        assert self.client.send_job('{"command": "TEST"}') is False
+        assert len(self.client.spooled()) == 1
+
+    def test_spooled_jobs_forwarded_in_order(self):
+        self.client.send_job('{"command": "BUILDOUT"}')
+        self.client.send_job('{"command": "TEST"}')
+        server = AckServer(self.address, 3)
+        server.start()
+        assert self.client.send_job('{"command": "GITPULL"}') is True
+        server.join()
+        assert server.received == [['{"command": "GITPULL"}'],
+                ['{"command": "BUILDOUT"}'], ['{"command": "TEST"}']]
+        assert self.client.spooled() == []
+
+    def test_rejected_spooled_job_is_dropped(self):
+        for job in ('{"command": "BUILDOUT"}', '{', '{"command": "TEST"}'):
+            self.client.send_job(job)
+        server = AckServer(self.address, 4, rejects=['{'])
+        server.start()
+        # The job just sent went through, whatever became of the spool
+        assert self.client.send_job('{"command": "GITPULL"}') is True
+        server.join()
+        assert server.received == [['{"command": "GITPULL"}'],
+                ['{"command": "BUILDOUT"}'], ['{'], ['{"command": "TEST"}']]
+        assert self.client.spooled() == []
+
+    def test_spooled_jobs_are_retried_in_the_background(self):
+        self.client.retry_interval = 0.1
+        assert self.client.send_job('{"command": "TEST"}') is False
+        server = AckServer(self.address, 1)
+        server.start()
+        server.join()
+        assert server.received == [['{"command": "TEST"}']]
+        for i in range(20):
+            if not self.client.spooled():
+                break
+            time.sleep(0.05)
+        assert self.client.spooled() == []
+
+    def test_outbox_survives_errors(self):
+        client = JobClient(self.address, timeout=0.2)
+        client.retry_interval = 0.1
+        # Without a spool directory the job is lost, but not the thread
+        client.send_job('{"command": "BUILDOUT"}', wait=False)
+        time.sleep(0.5)
+        server = AckServer(self.address, 1)
+        server.start()
+        client.send_job('{"command": "TEST"}', wait=False)
+        server.join()
+        assert server.received == [['{"command": "TEST"}']]
+
+    def test_rejected_job_raises(self):
+        server = AckServer(self.address, 1, reply=("ERROR", "Bad job"))
+        server.start()
+        try:
+            self.client.send_job('{')
+        except JobRejected, e:
+            assert str(e) == "Bad job"
+        else:
+            assert False, "The rejected job wasn't reported"
+        server.join()
+        assert self.client.spooled() == []
+
+    def test_fire_and_forget(self):
+        server = AckServer(self.address, 1)
+        server.start()
+        assert self.client.send_job('{"command": "TEST"}', wait=False) is None
+        server.join()
+        assert server.received == [['{"command": "TEST"}']]
+
+    def test_batch_is_spooled_and_forwarded(self):
+        assert self.client.send_batch('abc', ['{"command": "TEST"}']) is False
+        server = AckServer(self.address, 1)
+        server.start()
+        self.client.forward_spool()
+        server.join()
+        assert server.received == [['BATCH', 'abc', '["{\\"command\\": \\"TEST\\"}"]']]
+
+    def test_queue_batch_skips_projects_command_does_not_fit(self):
+        crane = Project.objects.create(name="crane",
+                base_directory="/tmp/crane", project_type="buildout")
+        Project.objects.create(name="hoist", base_directory="/tmp/hoist",
+                project_type="pip")
+        server = AckServer(self.address, 1)
+        server.start()
+        old_client, jobs.client = jobs.client, self.client
+        try:
+            batch, project_ids, sent = jobs.queue_batch("BUILDOUT",
+                    Project.objects.all())
+        finally:
+            jobs.client = old_client
+        server.join()
+        assert sent is True
+        assert project_ids == [crane.id]
+        assert server.received[0][:2] == ['BATCH', batch]
+        assert [json.loads(job) for job in json.loads(server.received[0][2])
+                ] == [{'command': "BUILDOUT", 'project_id': crane.id}]
+
+class TestFingerprintTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs = os.path.join(self.directory, 'runs')
+        self.base = os.path.join(self.directory, 'crane')
+        os.makedirs(os.path.join(self.base, 'bin'))
+        with open(os.path.join(self.base, 'buildout.cfg'), 'w') as cfg:
+            cfg.write("[buildout]\nparts = test\n\n"
+                    "[test]\nrecipe = zc.recipe.testrunner\n")
+        test_script = os.path.join(self.base, 'bin', 'test')
+        with open(test_script, 'w') as script:
+            script.write("#!/bin/sh\necho ran >> %s\n" % self.runs)
+        os.chmod(test_script, 0755)
+        self.project = Project.objects.create(name="crane",
+                base_directory=self.base, project_type="buildout")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def git(self, command):
+        subprocess.check_call("git -c user.name=crane "
+                "-c user.email=crane@localhost " + command, shell=True,
+                cwd=self.base, stdout=subprocess.PIPE)
+
+    def run_tests(self, **kwargs):
+        jobs.test_buildout(self.project.id, **kwargs)
+        if not os.path.exists(self.runs):
+            return 0
+        with open(self.runs) as runs:
+            return len(runs.readlines())
+
+    def test_unchanged_project_is_not_tested_again(self):
+        self.git("init -q")
+        self.git("add .")
+        self.git("commit -q -m crane")
+        assert self.run_tests() == 1
+        project = Project.objects.get(id=self.project.id)
+        assert project.test_status
+        assert len(project.test_fingerprint) == 40
+        assert self.run_tests() == 1
+        notification = Notification.objects.filter(project=project)[0]
+        assert notification.summary == "Testing 'crane' success (unchanged)"
+        assert json.loads(notification.rerun_job)['force']
+        assert Project.objects.get(id=self.project.id).test_status
+        assert self.run_tests(force=True) == 2
+        with open(os.path.join(self.base, 'buildout.cfg'), 'a') as cfg:
+            cfg.write("eggs = crane\n")
+        assert self.run_tests() == 3
+        open(os.path.join(self.base, 'untracked.py'), 'w').close()
+        assert self.run_tests() == 4
+        assert self.run_tests() == 4
+
+    def test_cancelled_job_stops_hashing(self):
+        self.git("init -q")
+        executor.start_job('3', self.project.id)
+        executor.cancel_job('3')
+        try:
+            self.assertRaises(executor.JobCancelled, jobs.test_fingerprint,
+                    self.project, ['bin/test'])
+        finally:
+            executor.finish_job()
+
+    def test_quiet_command_is_timed_out(self):
+        pid_file = os.path.join(self.directory, 'pid')
+        executor.start_job('4', self.project.id, timeout=0.3)
+        started = time.time()
+        try:
+            self.assertRaises(executor.JobTimedOut, jobs.hash_output,
+                    hashlib.sha1(), "sleep 30 & echo $! > %s; wait" % pid_file,
+                    self.base)
+        finally:
+            executor.finish_job()
+        assert time.time() - started < 5
+        # The whole process group was killed, not just the shell
+        with open(pid_file) as f:
+            pid = int(f.read())
+        for i in range(40):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+        else:
+            assert False, "The command's children are still running"
+
+    def test_projects_outside_git_are_always_tested(self):
+        assert jobs.test_fingerprint(self.project, ['bin/test']) is None
+        assert self.run_tests() == 1
+        assert self.run_tests() == 2
+
+class BuildoutFingerprintTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs = os.path.join(self.directory, 'runs')
+        self.base = os.path.join(self.directory, 'crane')
+        os.makedirs(os.path.join(self.base, 'bin'))
+        os.makedirs(os.path.join(self.base, 'src', 'crane'))
+        self.write('buildout.cfg', "[buildout]\nextends = versions.cfg\n"
+                "develop = src/crane\nparts =\n")
+        self.write('versions.cfg', "[versions]\ndjango = 1.2.1\n")
+        self.write('src/crane/setup.py', "setup(name='crane')\n")
+        self.write('bin/buildout', "#!/bin/sh\necho ran >> %s\n" % self.runs)
+        os.chmod(os.path.join(self.base, 'bin', 'buildout'), 0755)
+        self.project = Project.objects.create(name="crane",
+                base_directory=self.base, project_type="buildout")
+        self.old_cache = settings.BUILDOUT_CACHE_DIRECTORY
+        settings.BUILDOUT_CACHE_DIRECTORY = os.path.join(self.directory,
+                'cache')
+
+    def tearDown(self):
+        settings.BUILDOUT_CACHE_DIRECTORY = self.old_cache
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        with open(os.path.join(self.base, name), 'w') as config:
+            config.write(content)
+
+    def run_buildout(self, **kwargs):
+        jobs.buildout(self.project.id, **kwargs)
+        if not os.path.exists(self.runs):
+            return 0
+        with open(self.runs) as runs:
+            return len(runs.readlines())
+
+    def test_unchanged_buildout_is_skipped(self):
+        assert self.run_buildout() == 1
+        assert self.run_buildout() == 1
+        notification = Notification.objects.filter(project=self.project)[0]
+        assert notification.summary == "Buildout 'crane' no changes"
+        assert self.run_buildout(force=True) == 2
+        self.write('versions.cfg', "[versions]\ndjango = 1.2.3\n")
+        assert self.run_buildout() == 3
+        self.write('src/crane/setup.py', "setup(name='crane', version='2')\n")
+        assert self.run_buildout() == 4
+        assert self.run_buildout() == 4
+
+    def test_buildout_uses_shared_cache(self):
+        # "Installs" an egg in the eggs directory it is given
+        self.write('bin/buildout', "#!/bin/sh\necho \"$@\" >> %s\n"
+                "eggs=${1#*=}\nmkdir $eggs/new.egg\ntouch $eggs/new.egg/done\n"
+                "[ -f $eggs/old.egg/done ] || exit 1\n" % self.runs)
+        cache = os.path.join(self.directory, 'cache')
+        os.makedirs(os.path.join(cache, 'eggs', 'old.egg'))
+        open(os.path.join(cache, 'eggs', 'old.egg', 'done'), 'w').close()
+        staging = os.path.join(cache, 'staging', str(self.project.id))
+        self.run_buildout()
+        with open(self.runs) as runs:
+            assert runs.read().split() == [
+                    "buildout:eggs-directory=%s" % staging,
+                    "buildout:download-cache=%s" % os.path.join(cache,
+                        'downloads')]
+        # What buildout added is moved into the cache once it's done
+        assert os.path.isfile(os.path.join(cache, 'eggs', 'new.egg', 'done'))
+        assert sorted(os.listdir(staging)) == ['new.egg', 'old.egg']
+        for name in ('new.egg', 'old.egg'):
+            assert os.readlink(os.path.join(staging, name)) == os.path.join(
+                    cache, 'eggs', name)
+
+    def test_failed_buildout_adds_nothing_to_the_cache(self):
+        self.write('bin/buildout', "#!/bin/sh\neggs=${1#*=}\n"
+                "mkdir $eggs/half.egg\nexit 1\n")
+        self.run_buildout()
+        cache = os.path.join(self.directory, 'cache')
+        assert os.listdir(os.path.join(cache, 'eggs')) == []
+        assert os.listdir(os.path.join(cache, 'staging',
+            str(self.project.id))) == []
+
+    def test_failed_buildout_runs_again(self):
+        self.write('bin/buildout', "#!/bin/sh\necho ran >> %s\nexit 1\n"
+                % self.runs)
+        assert self.run_buildout() == 1
+        assert Project.objects.get(id=self.project.id
+                ).buildout_fingerprint == ""
+        assert self.run_buildout() == 2
+
+# Stands in for pip: logs how it is run, "installs" and "uninstalls"
+# requirements by listing them in the environment, replacing the list as pip
+# replaces files, and "builds" a wheel for whatever it is asked to, as long as
+# it may use the index and it isn't broken
+FAKE_PIP = """#!/bin/sh
+echo "$@" >> %s
+installed="$VIRTUAL_ENV/installed"
+case $1 in
+install)
+    shift
+    while [ $# -gt 0 ]; do
+        case $1 in -r) cat "$2"; shift;; -*) ;; *) echo "$1";; esac
+        shift
+    done | sort -u - "$installed" > "$installed.new"
+    mv "$installed.new" "$installed"
+    exit 0;;
+uninstall)
+    shift 2
+    for name; do
+        grep -viE "^$name([=<>]|$)" "$installed" > "$installed.new"
+        mv "$installed.new" "$installed"
+    done
+    exit 0;;
+freeze)
+    cat "$installed"
+    exit 0;;
+esac
+[ "$1" = wheel ] || exit 0
+for arg; do
+    case $arg in --no-index) exit 1;; --wheel-dir=*) dir=${arg#*=};; esac
+    requirement=$arg
+done
+case $requirement in broken*) exit 1;; esac
+touch "$dir/$(echo $requirement | sed s/==/-/)-py2-none-any.whl"
+"""
+
+class WheelhouseTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs = os.path.join(self.directory, 'runs')
+        os.makedirs(os.path.join(self.directory, 'bin'))
+        pip = os.path.join(self.directory, 'bin', 'pip')
+        with open(pip, 'w') as script:
+            script.write(FAKE_PIP % self.runs)
+        os.chmod(pip, 0755)
+        self.old_settings = (settings.PIP_WHEELHOUSE_DIRECTORY,
+                settings.JOB_OUTPUT_DIRECTORY)
+        settings.PIP_WHEELHOUSE_DIRECTORY = os.path.join(self.directory,
+                'wheelhouse')
+        settings.JOB_OUTPUT_DIRECTORY = os.path.join(self.directory, 'output')
+
+    def tearDown(self):
+        (settings.PIP_WHEELHOUSE_DIRECTORY,
+                settings.JOB_OUTPUT_DIRECTORY) = self.old_settings
+        shutil.rmtree(self.directory)
+
+    def make_project(self, name, requirements):
+        base = os.path.join(self.directory, name)
+        venv = os.path.join(base, 'venv')
+        os.makedirs(os.path.join(venv, 'bin'))
+        with open(os.path.join(venv, 'bin', 'activate'), 'w') as f:
+            f.write("export VIRTUAL_ENV=%s PATH=%s:$PATH\n" % (venv,
+                os.path.join(self.directory, 'bin')))
+        open(os.path.join(venv, 'installed'), 'w').close()
+        project = Project.objects.create(name=name, base_directory=base,
+                project_type="pip")
+        PipProject.objects.create(project=project)
+        self.write_requirements(project, requirements)
+        return project
+
+    def write_requirements(self, project, requirements):
+        with open(project.requirements_filename(), 'w') as f:
+            f.write(requirements)
+
+    def installed(self, project):
+        with open(os.path.join(project.base_directory, 'venv',
+            'installed')) as installed:
+            return installed.read().split()
+
+    def pip_install(self, name, requirements=None, **kwargs):
+        if requirements is None:
+            project = Project.objects.get(name=name)
+        else:
+            project = self.make_project(name, requirements)
+        if os.path.exists(self.runs):
+            os.remove(self.runs)
+        jobs.pip_install(project.id, **kwargs)
+        assert Notification.objects.filter(project=project)[0].status == \
+                "success"
+        if not os.path.exists(self.runs):
+            return []
+        with open(self.runs) as runs:
+            return sorted(line.split()[0] + (" offline" if "--no-index" in
+                line else "") for line in runs)
+
+    def test_parse_requirements(self):
+        assert parse_requirements("# The crane\nDjango==1.2.1\n\n"
+                "South>=0.7  # migrations\n-e git+git://crane#egg=crane\n"
+                "-r more.txt\n") == (["Django==1.2.1", "South>=0.7"],
+                        ["-e git+git://crane#egg=crane", "-r more.txt"])
+
+    def test_wheels_are_built_once_and_shared(self):
+        assert self.pip_install("crane", "Django==1.2.1\nSouth\n") == [
+                "freeze", "install offline", "wheel", "wheel",
+                "wheel offline", "wheel offline"]
+        assert sorted(os.listdir(settings.PIP_WHEELHOUSE_DIRECTORY)) == [
+                "Django-1.2.1-py2-none-any.whl", "South-py2-none-any.whl"]
+        assert self.pip_install("hoist", "django==1.2.1\n") == [
+                "freeze", "install offline"]
+
+    def test_unbuildable_requirements_use_the_index(self):
+        assert self.pip_install("crane",
+                "Django==1.2.1\n-e git+git://crane#egg=crane\n") == [
+                        "install", "wheel", "wheel offline"]
+        # There's no telling what changed in the checkout
+        assert self.pip_install("crane") == ["install"]
+
+    def test_failed_builds_are_installed_from_the_index(self):
+        project = self.make_project("crane", "broken==1.0\n")
+        executor.start_job('1', project.id)
+        assert self.pip_install("crane") == ["freeze", "install", "wheel",
+                "wheel offline"]
+        assert executor.finish_job()[0] == 0
+
+    def test_only_changed_requirements_are_installed(self):
+        assert self.pip_install("crane", "Django==1.2.1\nSouth\nsimplejson\n"
+                ) == ["freeze", "install offline"] + ["wheel"] * 3 + [
+                        "wheel offline"] * 3
+        assert self.pip_install("crane") == []
+        project = Project.objects.get(name="crane")
+        notification = Notification.objects.filter(project=project)[0]
+        assert notification.summary == "pip install 'crane' no changes"
+
+        self.write_requirements(project, "Django==1.2.3\nsimplejson\n")
+        assert self.pip_install("crane") == ["freeze", "install offline",
+                "uninstall", "wheel", "wheel offline"]
+        assert self.installed(project) == ["Django==1.2.1", "Django==1.2.3",
+                "simplejson"]
+        assert self.pip_install("crane") == []
+        assert self.pip_install("crane", force=True) == ["freeze",
+                "install offline", "wheel", "wheel offline"]
+
+FAKE_VIRTUALENV = """#!/bin/sh
+echo virtualenv >> %s
+for env; do :; done
+mkdir -p "$env/bin"
+touch "$env/installed"
+echo "export VIRTUAL_ENV=$env PATH=%s:\\$PATH" > "$env/bin/activate"
+ln -s "$env/installed" "$env/bin/installed"
+"""
+
+class EnvironmentTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs = os.path.join(self.directory, 'runs')
+        bin = os.path.join(self.directory, 'bin')
+        os.makedirs(bin)
+        for name, script in (('pip', FAKE_PIP % self.runs),
+                ('virtualenv', FAKE_VIRTUALENV % (self.runs, bin))):
+            with open(os.path.join(bin, name), 'w') as f:
+                f.write(script)
+            os.chmod(os.path.join(bin, name), 0755)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = "%s:%s" % (bin, self.old_path)
+        self.old_settings = (settings.PIP_WHEELHOUSE_DIRECTORY,
+                settings.VIRTUALENV_TEMPLATE_DIRECTORY)
+        settings.PIP_WHEELHOUSE_DIRECTORY = os.path.join(self.directory,
+                'wheelhouse')
+        settings.VIRTUALENV_TEMPLATE_DIRECTORY = os.path.join(self.directory,
+                'templates')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        (settings.PIP_WHEELHOUSE_DIRECTORY,
+                settings.VIRTUALENV_TEMPLATE_DIRECTORY) = self.old_settings
+        shutil.rmtree(self.directory)
+
+    def virtualenv(self, name, requirements):
+        base = os.path.join(self.directory, name)
+        os.makedirs(base)
+        with open(os.path.join(base, 'requirements.txt'), 'w') as f:
+            f.write(requirements)
+        project = Project.objects.create(name=name, base_directory=base,
+                project_type="pip")
+        PipProject.objects.create(project=project)
+        if os.path.exists(self.runs):
+            os.remove(self.runs)
+        jobs.virtualenv(project.id)
+        assert Notification.objects.filter(project=project)[0].status == \
+                "success"
+        with open(self.runs) as runs:
+            return [line.split()[0] for line in runs]
+
+    def read(self, *path):
+        with open(os.path.join(self.directory, *path)) as f:
+            return f.read()
+
+    def environment(self, name, filename):
+        return self.read(name, 'venv', filename)
+
+    def templates(self):
+        '''What is installed in each template, which should be what it says
+        is installed in it.'''
+        installed = []
+        for name in os.listdir(os.path.join(self.directory, 'templates')):
+            if name.startswith("."):
+                continue
+            assert self.read("templates", name, "installed") == self.read(
+                    'templates', name, '.requirements')
+            installed.append(self.read('templates', name, 'installed'))
+        return sorted(installed)
+
+    def test_environments_are_copied_from_templates(self):
+        assert self.virtualenv("crane", "Django==1.2.1\n") == [
+                "virtualenv", "wheel", "wheel", "install", "freeze"]
+        assert self.templates() == ["", "Django==1.2.1\n"]
+        venv = os.path.join(self.directory, "crane", "venv")
+        assert self.environment("crane", "bin/activate").startswith(
+                "export VIRTUAL_ENV=%s " % venv)
+        assert os.readlink(os.path.join(venv, "bin", "installed")) == \
+                os.path.join(venv, "installed")
+        assert self.environment("crane", "installed") == "Django==1.2.1\n"
+
+        # Only what the closest template is missing gets installed, and
+        # installing in the copy leaves the template alone
+        assert self.virtualenv("hoist", "Django==1.2.1\nSouth\n") == [
+                "wheel", "wheel", "install", "freeze"]
+        assert self.templates() == ["", "Django==1.2.1\n",
+                "Django==1.2.1\nSouth\n"]
+        assert self.environment("hoist", "installed") == \
+                "Django==1.2.1\nSouth\n"
+        assert self.virtualenv("jib", "South\nDjango==1.2.1\n") == [
+                "freeze"]
+        assert self.environment("jib", "installed") == \
+                "Django==1.2.1\nSouth\n"
+        assert len(self.templates()) == 3
+
+    def test_templates_being_copied_are_not_pruned(self):
+        self.virtualenv("crane", "Django==1.2.1\n")
+        self.virtualenv("hoist", "South\n")
+        directory = os.path.join(self.directory, 'templates')
+        used = environments.best_template(None, ["South"])
+        os.utime(used, (0, 0))
+        settings.VIRTUALENV_TEMPLATES, old_templates = (1,
+                settings.VIRTUALENV_TEMPLATES)
+        try:
+            with environments.template_lock(used):
+                environments.prune_templates()
+            assert self.templates() == ["", "South\n"]
+            environments.prune_templates()
+            assert self.templates() == [""]
+        finally:
+            settings.VIRTUALENV_TEMPLATES = old_templates
+        # Pruned templates take their locks with them
+        bare = environments.best_template(None, [])
+        assert [name for name in os.listdir(directory)
+                if name.endswith(".lock")] == [
+                        ".%s.lock" % os.path.basename(bare)]
+
+class FileLockTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_waits_for_the_lock(self):
+        events = []
+        def hold():
+            with executor.file_lock(self.filename):
+                events.append("first")
+                started.set()
+                release.wait()
+            events.append("released")
+        started, release = threading.Event(), threading.Event()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        started.wait()
+        waits = []
+        def check():
+            waits.append(1)
+            release.set()
+        with executor.file_lock(self.filename, check, poll_interval=0.05):
+            events.append("second")
+        thread.join()
+        assert events == ["first", "released", "second"]
+        assert waits
+
+class GitMirrorTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.origin = os.path.join(self.directory, 'origin.git')
+        self.work = os.path.join(self.directory, 'work')
+        self.git('init', '-q', '--bare', self.origin)
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/master', cwd=self.origin)
+        self.git('init', '-q', self.work)
+        self.commit("first")
+        self.old_settings = (settings.GIT_MIRROR_DIRECTORY,
+                settings.JOB_OUTPUT_DIRECTORY)
+        settings.GIT_MIRROR_DIRECTORY = os.path.join(self.directory,
+                'mirrors')
+        settings.JOB_OUTPUT_DIRECTORY = os.path.join(self.directory, 'output')
+
+    def tearDown(self):
+        (settings.GIT_MIRROR_DIRECTORY,
+                settings.JOB_OUTPUT_DIRECTORY) = self.old_settings
+        shutil.rmtree(self.directory)
+
+    def git(self, *args, **kwargs):
+        process = subprocess.Popen(('git', '-c', 'user.name=crane', '-c',
+            'user.email=crane@example.com') + args, stdout=subprocess.PIPE,
+            cwd=kwargs.get('cwd', self.directory))
+        output = process.communicate()[0]
+        assert process.returncode == 0
+        return output.strip()
+
+    def commit(self, message):
+        '''Commit a change to origin, as someone else would.'''
+        with open(os.path.join(self.work, 'README'), 'w') as readme:
+            readme.write(message)
+        self.git('add', 'README', cwd=self.work)
+        self.git('commit', '-q', '-m', message, cwd=self.work)
+        self.git('push', '-q', self.origin, 'HEAD:refs/heads/master',
+                cwd=self.work)
+
+    def checkout(self, name):
+        return os.path.join(self.directory, name)
+
+    def readme(self, name):
+        with open(os.path.join(self.checkout(name), 'README')) as readme:
+            return readme.read()
+
+    def run_job(self, function, name):
+        project, created = Project.objects.get_or_create(name=name,
+                base_directory=self.checkout(name), git_repo=self.origin)
+        function(project.id)
+        assert Notification.objects.filter(project=project)[0].status == \
+                "success"
+
+    def age_mirror(self):
+        stamp = os.path.join(mirror_path(self.origin), FETCH_STAMP)
+        os.utime(stamp, (0, 0))
+
+    def test_clones_borrow_from_the_mirror(self):
+        self.run_job(jobs.clone_repo, "crane")
+        mirror = mirror_path(self.origin)
+        assert os.path.isdir(mirror)
+        assert self.readme("crane") == "first"
+        with open(os.path.join(self.checkout("crane"), '.git', 'objects',
+            'info', 'alternates')) as alternates:
+            assert alternates.read().strip() == os.path.join(mirror,
+                    'objects')
+        assert self.git('config', 'remote.origin.url',
+                cwd=self.checkout("crane")) == self.origin
+
+    def test_broken_mirror_falls_back_to_the_remote(self):
+        # Not a repository, so fetching into it fails
+        os.makedirs(mirror_path(self.origin))
+        executor.start_job('1', None)
+        self.run_job(jobs.clone_repo, "crane")
+        assert executor.finish_job()[0] == 0
+        assert self.readme("crane") == "first"
+        assert not os.path.exists(os.path.join(self.checkout("crane"),
+            '.git', 'objects', 'info', 'alternates'))
+
+    def test_pulls_fetch_once_per_mirror(self):
+        self.run_job(jobs.clone_repo, "crane")
+        self.run_job(jobs.clone_repo, "hoist")
+        self.commit("second")
+        self.age_mirror()
+        self.run_job(jobs.pull_repo, "crane")
+        assert self.readme("crane") == "second"
+        # The mirror was just fetched, so hoist is pulled from it as it is
+        self.commit("third")
+        self.run_job(jobs.pull_repo, "hoist")
+        assert self.readme("hoist") == "second"
+        self.age_mirror()
+        self.run_job(jobs.pull_repo, "hoist")
+        assert self.readme("hoist") == "third"
+        assert self.readme("crane") == "second"
+
+class UpdatePipelineTests(TestCase):
+    def test_update_pulls_installs_and_tests(self):
+        project = Project(id=1, project_type="pip", git_repo="git://crane")
+        steps = jobs.update_steps(project)
+        assert [json.loads(s['job'])['command'] for s in steps] == [
+                "GITPULL", "PIPINSTALL", "TEST"]
+        assert [s['name'] for s in validate({'steps': steps})] == [
+                "pull", "install", "test"]
+
+class CronRuleTests(TestCase):
+    def test_next_after(self):
+        when = datetime.datetime(2010, 8, 14, 23, 50, 10)
+        assert CronRule("@nightly").next_after(when) == datetime.datetime(
+                2010, 8, 15, 0, 0)
+        assert CronRule("*/15 * * * *").next_after(when) == \
+                datetime.datetime(2010, 8, 15, 0, 0)
+        # The 14th is a Saturday, so the next weekday is Monday
+        assert CronRule("30 2 * * 1-5").next_after(when) == \
+                datetime.datetime(2010, 8, 16, 2, 30)
+        assert CronRule("0 0 29 2 *").next_after(when) == \
+                datetime.datetime(2012, 2, 29, 0, 0)
+
+    def test_bad_rules(self):
+        for rule in ("* * *", "61 * * * *", "x * * * *"):
+            self.assertRaises(ValueError, CronRule, rule)
+        self.assertRaises(ValueError, CronRule("0 0 30 2 *").next_after,
+                datetime.datetime(2010, 1, 1))
+
+class ScheduleTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="crane",
+                base_directory="/tmp/crane", project_type="buildout")
+        self.schedule = Schedule.objects.create(project=self.project,
+                command="TEST", rule="@nightly", jitter=60)
+        self.due = self.schedule.next_run + datetime.timedelta(seconds=5)
+
+    def test_due_schedule_fires_once(self):
+        jobs = Scheduler().due_jobs(self.due)
+        assert len(jobs) == 1
+        delay, job = jobs[0]
+        assert 0 <= delay <= 60
+        assert json.loads(job) == {"command": "TEST",
+                "project_id": self.project.id}
+        # Another server, or this one after a restart, finds it claimed
+        assert Scheduler().due_jobs(self.due) == []
+        schedule = Schedule.objects.get(id=self.schedule.id)
+        assert schedule.last_run == self.due
+        assert schedule.next_run == self.schedule.next_run + \
+                datetime.timedelta(days=1)
+
+    def test_schedule_is_not_fired_early_or_when_disabled(self):
+        assert Scheduler().due_jobs(self.schedule.next_run -
+                datetime.timedelta(seconds=1)) == []
+        Schedule.objects.update(enabled=False)
+        assert Scheduler().due_jobs(self.due) == []
+
+    def test_group_schedule(self):
+        Project.objects.create(name="pip", base_directory="/tmp/pip",
+                project_type="pip")
+        Schedule.objects.create(projects="all", command="BUILDOUT",
+                rule="@nightly")
+        commands = [json.loads(job)['command']
+                for delay, job in Scheduler().due_jobs(self.due)]
+        # Buildout only makes sense for the buildout project
+        assert sorted(commands) == ["BUILDOUT", "TEST"]
+
+    def test_server_holds_scheduled_jobs_back(self):
+        socket = MockSocket()
+        server = JobServer(socket, scheduler=Scheduler())
+        request(server, 'worker', 'READY')
+        server.run_schedules(time.mktime(self.due.timetuple()))
+        assert queued_jobs(server) == []
+        not_before = server.delayed[0][0]
+        server.release(not_before - 1)
+        server.dispatch()
+        assert socket.sent_to('worker') == []
+        server.release(not_before)
+        server.dispatch()
+        assert [frames[0] for frames in socket.sent_to('worker')] == ['1']
+
+    def test_delayed_job_can_be_cancelled(self):
+        server = JobServer(MockSocket())
+        job_id = server.queue_job('{"command": "TEST", "project_id": 1}',
+                delay=60)
+        request(server, 'client', 'CANCEL', str(job_id))
+        assert server.delayed == []
+        server.release(time.time() + 120)
+        assert queued_jobs(server) == []
+
+    def test_edit_schedule(self):
+        response = self.client.post(reverse("edit_schedule",
+            args=[self.schedule.id]), {'command': "GITPULL",
+                'rule': "0 * * * *", 'jitter': 0, 'enabled': "on"})
+        assert response.status_code == 302
+        schedule = Schedule.objects.get(id=self.schedule.id)
+        assert schedule.command == "GITPULL"
+        assert schedule.next_run.minute == 0
+        assert schedule.next_run < self.schedule.next_run
+        response = self.client.post(reverse("add_schedule",
+            args=[self.project.id]), {'command': "TEST",
+                'rule': "61 * * * *", 'jitter': 0})
+        assert response.status_code == 200
+        assert Schedule.objects.count() == 1
+
+    def test_schedules_on_project_page(self):
+        response = self.client.get(self.project.get_absolute_url())
+        assert reverse("edit_schedule", args=[self.schedule.id]) in \
+                response.content
+        response = self.client.get(reverse("list_schedules"))
+        assert response.status_code == 200
@@ -27,5 +27,18 @@ urlpatterns = patterns('job_queue.views',
         url('^(?P<project_id>\d+)/edit_buildout/$', 'edit_buildout', name="edit_buildout"),
         url('^(?P<project_id>\d+)/virtualenv/$', 'schedule_virtualenv', name="schedule_virtualenv"),
         url('^(?P<project_id>\d+)/pip_install/$', 'schedule_pip_install', name="schedule_pip_install"),
+        url('^(?P<project_id>\d+)/update/$', 'schedule_update', name="schedule_update"),
+        url('^(?P<project_id>\d+)/output/$', 'job_output', name="job_output"),
+        url('^(?P<project_id>\d+)/history/$', 'job_history', name="job_history"),
+        url('^$', 'queue_dashboard', name="queue_dashboard"),
+        url('^stats/$', 'stats', name="queue_stats"),
+        url('^bulk/$', 'bulk_command', name="bulk_command"),
+        url('^batch/(?P<batch>[0-9a-f]+)/$', 'batch_progress', name="batch_progress"),
+        url('^cancel/(?P<job_id>\d+)/$', 'cancel', name="cancel_job"),
+        url('^schedules/$', 'list_schedules', name="list_schedules"),
+        url('^schedules/add/$', 'add_schedule', name="add_group_schedule"),
+        url('^(?P<project_id>\d+)/schedules/add/$', 'add_schedule', name="add_schedule"),
+        url('^schedules/(?P<schedule_id>\d+)/$', 'edit_schedule', name="edit_schedule"),
+        url('^schedules/(?P<schedule_id>\d+)/delete/$', 'delete_schedule', name="delete_schedule"),
         url('^rerun_job/(?P<notification_id>\d+)/$', 'rerun_job', name="rerun_job")
         )
@@ -1,11 +1,23 @@
+import json
+
 from django.shortcuts import get_object_or_404, redirect, render_to_response
 from django.http import HttpResponse, HttpResponseServerError
+from django.http import HttpResponseBadRequest
 from django.template import RequestContext
+from django.core.urlresolvers import reverse
+from django.views.generic.create_update import delete_object
 from project.models import Project
-from job_queue.jobs import queue_job, send_job
-from job_queue.forms import StartAppForm
+from job_queue.jobs import queue_job, send_job, queue_batch, cancel_job
+from job_queue.jobs import queue_pipeline, update_steps, queue_stats
+from job_queue.client import JobServerUnavailable
+from job_queue.forms import StartAppForm, BulkJobForm
+from job_queue.forms import ScheduleForm, GroupScheduleForm
+from job_queue.executor import latest_job, read_output
+from job_queue.models import JobRun, Schedule
 from notifications.models import Notification
 
+SPOOLED_MESSAGE = "Job server is unavailable; the job will be queued when it is back"
+
 def schedule_buildout(request, project_id):
     return schedule_project_command(request, project_id, "BUILDOUT",
             "Successfully queued buildout")
@@ -15,6 +27,11 @@ def schedule_bootstrap(request, project_id):
             "Successfully queued bootstrap")
 
 def schedule_test(request, project_id):
+    '''Queue the project's tests; with force in the query they are run even
+    if nothing has changed since they last passed.'''
+    if request.GET.get('force'):
+        return schedule_project_command(request, project_id, "TEST",
+                "Successfully queued test", force=True)
     return schedule_project_command(request, project_id, "TEST",
             "Successfully queued test")
 
@@ -30,6 +47,16 @@ def schedule_migrate(request, project_id):
     return schedule_project_command(request, project_id, "MIGRATE",
             "Successfully queued south migrate")
 
+def schedule_update(request, project_id):
+    '''Pull, install and test the project as one pipeline.'''
+    project = get_object_or_404(Project, id=project_id)
+    try:
+        if queue_pipeline(update_steps(project)):
+            return HttpResponse("Successfully queued update")
+        return HttpResponse(SPOOLED_MESSAGE)
+    except Exception as e:
+        return HttpResponseServerError("Error: " + str(e))
+
 def startapp(request, project_id):
     # I feel like this belongs elsewhere
     project = get_object_or_404(Project, id=project_id)
@@ -56,14 +83,125 @@ def rerun_job(request, notification_id):
     notification = get_object_or_404(Notification, id=notification_id)
     print notification.rerun_job
     if notification.rerun_job:
-        send_job(str(notification.rerun_job))
-        return HttpResponse("Queued")
+        if send_job(str(notification.rerun_job)):
+            return HttpResponse("Queued")
+        return HttpResponse(SPOOLED_MESSAGE)
     return HttpResponse("No rerun specified")
 
-def schedule_project_command(request, project_id, command, success_message):
+def cancel(request, job_id):
+    '''Drop a queued job, or kill the commands of a running one.'''
+    try:
+        if cancel_job(job_id):
+            return HttpResponse("Cancelling job %s" % job_id)
+        return HttpResponse(SPOOLED_MESSAGE)
+    except Exception as e:
+        return HttpResponseServerError("Error: " + str(e))
+
+def job_output(request, project_id):
+    '''Return the output the project's newest job has logged since the
+    given offset, so the project page can tail it while it runs.'''
+    project = get_object_or_404(Project, id=project_id)
+    job_id = latest_job(project.id)
+    offset = None
+    if job_id is not None and request.GET.get('job') == str(job_id):
+        try:
+            offset = int(request.GET['offset'])
+        except (KeyError, ValueError):
+            # Start again from the tail
+            pass
+    output = None
+    if job_id is not None:
+        output = read_output(project.id, job_id, offset)
+    if output:
+        output['output'] = output['output'].decode('utf-8', 'replace')
+    return HttpResponse(json.dumps(output), content_type="application/json")
+
+def job_history(request, project_id):
+    project = get_object_or_404(Project, id=project_id)
+    return render_to_response("job_queue/history.html", RequestContext(
+        request, {'project': project,
+            'runs': JobRun.objects.filter(project=project)[:50],
+            'timings': JobRun.objects.timings(project)}))
+
+def bulk_command(request):
+    '''Queue a command on every project in a group, as a single batch.'''
+    form = BulkJobForm(request.POST or None)
+    if not form.is_valid():
+        return HttpResponseBadRequest("Choose a command and projects")
+    command = form.cleaned_data['command']
+    try:
+        batch, project_ids, sent = queue_batch(command,
+                Project.objects.filtered(form.cleaned_data['projects']))
+    except Exception as e:
+        return HttpResponseServerError("Error: " + str(e))
+    if sent:
+        message = "Queued %s on %d projects" % (command, len(project_ids))
+    else:
+        message = SPOOLED_MESSAGE
+    return HttpResponse(json.dumps({'batch': batch, 'jobs': len(project_ids),
+        'message': message}), content_type="application/json")
+
+def batch_progress(request, batch):
+    '''How far a batch of jobs has got, counted by status.'''
+    return HttpResponse(json.dumps(JobRun.objects.batch_progress(batch)),
+            content_type="application/json")
+
+def queue_dashboard(request):
+    return render_to_response("job_queue/dashboard.html", RequestContext(
+        request))
+
+def stats(request):
+    '''The job server's view of the queue, which the dashboard polls. It
+    comes straight from the server's memory, so polling it is cheap.'''
+    try:
+        data = queue_stats()
+    except JobServerUnavailable as e:
+        data = {'error': str(e)}
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+def list_schedules(request):
+    return render_to_response("job_queue/schedule_list.html", RequestContext(
+        request, {'schedules': Schedule.objects.select_related('project'),
+            'form': GroupScheduleForm()}))
+
+def add_schedule(request, project_id=None):
+    '''Add a schedule for one project or, without a project, for a group of
+    projects.'''
+    if project_id is None:
+        project = None
+        form = GroupScheduleForm(request.POST or None)
+    else:
+        project = get_object_or_404(Project, id=project_id)
+        form = ScheduleForm(request.POST or None,
+                instance=Schedule(project=project))
+    if form.is_valid():
+        form.save()
+        return redirect(project or reverse("list_schedules"))
+    return render_to_response("job_queue/schedule_form.html", RequestContext(
+        request, {'form': form, 'project': project}))
+
+def edit_schedule(request, schedule_id):
+    schedule = get_object_or_404(Schedule, id=schedule_id)
+    if schedule.project_id:
+        form = ScheduleForm(request.POST or None, instance=schedule)
+    else:
+        form = GroupScheduleForm(request.POST or None, instance=schedule)
+    if form.is_valid():
+        form.save()
+        return redirect(schedule.project or reverse("list_schedules"))
+    return render_to_response("job_queue/schedule_form.html", RequestContext(
+        request, {'form': form, 'project': schedule.project}))
+
+def delete_schedule(request, schedule_id):
+    return delete_object(request, model=Schedule, object_id=schedule_id,
+            post_delete_redirect=reverse("list_schedules"))
+
+def schedule_project_command(request, project_id, command, success_message,
+        **kwargs):
     project = get_object_or_404(Project, id=project_id)
     try:
-        queue_job(command, project_id=project.id)
-        return HttpResponse(success_message)
+        if queue_job(command, project_id=project.id, **kwargs):
+            return HttpResponse(success_message)
+        return HttpResponse(SPOOLED_MESSAGE)
     except Exception as e:
         return HttpResponseServerError("Error: " + str(e))
@@ -0,0 +1,146 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import errno
+import pipes
+import shutil
+import fnmatch
+import tempfile
+
+from django.conf import settings
+
+from job_queue.executor import run_commands
+
+# Requirement lines pip has to deal with while it installs, such as options,
+# editable checkouts and other requirement files, rather than wheels that can
+# be built ahead of time
+UNBUILDABLE = re.compile(r"^(-|\w+\+|\w+://)")
+
+# A requirement pinned to a single version, which the wheelhouse either has
+# the wheel for or not
+PINNED = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([^\s;,]+)$")
+
+def wheelhouse_directory():
+    return os.path.abspath(settings.PIP_WHEELHOUSE_DIRECTORY)
+
+def make_wheelhouse():
+    directory = wheelhouse_directory()
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        # Another job got there first
+        if e.errno != errno.EEXIST:
+            raise
+    return directory
+
+def parse_requirements(text):
+    '''Split the contents of a requirements file into the requirements that
+    can be built into wheels, and the lines pip has to handle itself.'''
+    requirements, others = [], []
+    for line in text.splitlines():
+        line = re.sub(r"(^|\s)#.*", "", line).strip()
+        if not line:
+            continue
+        if UNBUILDABLE.match(line):
+            others.append(line)
+        else:
+            requirements.append(line)
+    return requirements, others
+
+def requirement_name(requirement):
+    '''The project a requirement or a line of pip freeze is for, spelled
+    the way pip compares names.'''
+    return re.split(r"[\s<>=!~;\[]", requirement, 1)[0].lower().replace(
+            "_", "-")
+
+def wheel_part(name):
+    '''How a project name or version is written in a wheel's filename.'''
+    return re.sub(r"[^\w.]+", "_", name).lower()
+
+def has_wheel(requirement):
+    '''Whether the wheelhouse has the wheel for a requirement. Only pinned
+    requirements can be answered without asking pip.'''
+    match = PINNED.match(requirement)
+    if not match:
+        return False
+    pattern = "%s-%s-*.whl" % tuple(wheel_part(part)
+            for part in match.groups())
+    return any(fnmatch.fnmatch(filename.lower(), pattern)
+            for filename in os.listdir(wheelhouse_directory()))
+
+def build_command(requirement, activate, build_directory):
+    '''Put the wheels for a requirement and what it depends on in
+    build_directory, taking them from the wheelhouse when it can and only
+    going to the package index when it has to.'''
+    wheel = "pip wheel --wheel-dir=%s --find-links=%s %%s%s" % (
+            pipes.quote(build_directory), pipes.quote(wheelhouse_directory()),
+            pipes.quote(requirement))
+    return ". %s ; %s || %s" % (activate, wheel % "--no-index ",
+            wheel % "")
+
+def collect(build_directory):
+    '''Move the wheels a build made into the wheelhouse. Each one is renamed
+    into place whole, so installs running alongside never see part of one.'''
+    directory = wheelhouse_directory()
+    for filename in os.listdir(build_directory):
+        if filename.endswith(".whl"):
+            os.rename(os.path.join(build_directory, filename),
+                    os.path.join(directory, filename))
+
+def build_wheels(requirements, activate, cwd=None):
+    '''Build the wheels the wheelhouse is missing for requirements,
+    PIP_WHEEL_PARALLELISM of them at once, with the pip that activate puts
+    first on the path. Returns whether they all built and their output.
+    Failed builds don't fail the job, since whatever didn't build can still
+    be installed from the package index.'''
+    directory = make_wheelhouse()
+    missing = [requirement for requirement in requirements
+            if not has_wheel(requirement)]
+    if not missing:
+        return True, ""
+    build_directory = tempfile.mkdtemp(prefix=".build-", dir=directory)
+    try:
+        results = run_commands([build_command(requirement, activate,
+            build_directory) for requirement in missing], cwd=cwd,
+            parallel=settings.PIP_WHEEL_PARALLELISM, recoverable=True)
+        collect(build_directory)
+    finally:
+        shutil.rmtree(build_directory, ignore_errors=True)
+    return (all(result and not result[0] for result in results),
+            "".join(result[1] for result in results if result))
+
+def install_options(offline):
+    options = "--find-links=%s" % pipes.quote(wheelhouse_directory())
+    if offline:
+        options = "--no-index " + options
+    return options
+
+def install_command(activate, offline=True, requirements="requirements.txt"):
+    '''Install a requirements file from the wheelhouse, without the package
+    index unless something in it couldn't be built ahead of time.'''
+    return ". %s ; pip install %s -r %s" % (activate, install_options(offline),
+            pipes.quote(requirements))
+
+def install_packages_command(activate, requirements, offline=True):
+    '''Install some requirements from the wheelhouse; see install_command.'''
+    return ". %s ; pip install %s %s" % (activate, install_options(offline),
+            " ".join(pipes.quote(requirement) for requirement in requirements))
+
+def uninstall_command(activate, names):
+    return ". %s ; pip uninstall -y %s" % (activate,
+            " ".join(pipes.quote(name) for name in names))
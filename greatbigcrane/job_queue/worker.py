@@ -0,0 +1,295 @@
+"""
+Copyright 2010 Jason Chu, Dusty Phillips, and Phil Schalm
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import time
+import Queue
+import threading
+from collections import deque
+
+import zmq
+from django.db import connections
+
+from job_queue import executor
+from job_queue.jobs import command_map, LANES
+from job_queue.models import JobRun
+from notifications.models import Notification
+
+def run_job(job_id, job, lease=""):
+    '''Run a job from the queue, recording a notification if it blows up,
+    times out or is cancelled. Returns how the job ended.
+
+    The job's run is only recorded while lease is the one the job server
+    gave it. The database connections the job opened on this thread are
+    closed once it is over.'''
+    job = dict(job)
+    command_name = job.pop('command', None)
+    # unicode strings as keyword arguments != cool for Python 2.6.1
+    job = dict((str(k), v) for k,v in job.iteritems())
+    command = command_map.get(command_name)
+    executor.write(JobRun.objects.record_started, job_id, lease)
+    executor.start_job(job_id, job.get('project_id'),
+            getattr(command, 'timeout', None))
+    status = "success"
+    try:
+        print repr(job)
+        if command is None:
+            raise KeyError("No such command: %s" % command_name)
+        executor.check_job()
+        command(**job)
+    except executor.JobInterrupted, e:
+        status = e.status
+        notify_interrupted(command_name, job, e)
+    except Exception, e:
+        status = "error"
+        executor.write(Notification.objects.create, status="error",
+                summary="%s command failed to run" %(command_name),
+                project_id=job.get('project_id', None),
+                message = "%s failed on these arguments: \n%s\n\n"
+                "The exception was %s" % (
+                    command_name, job, str(e)))
+    finally:
+        exit_code, output_size = executor.finish_job()
+    if exit_code and status == "success":
+        status = "error"
+    executor.write(JobRun.objects.record_finished, job_id, status, exit_code,
+            output_size, lease)
+    for connection in connections.all():
+        connection.close()
+    return status
+
+def notify_interrupted(command_name, job, e):
+    summary = "%s command %s" % (command_name,
+            "timed out" if e.status == "timeout" else "was cancelled")
+    executor.write(Notification.objects.create, status="error",
+            summary=summary,
+            project_id=job.get('project_id', None),
+            message="%s on these arguments: \n%s\n\n%s" % (summary, job, e))
+
+def cancel_waiting_job(job_id, job, lease=""):
+    '''Record a job that was cancelled before it got to run.'''
+    job = dict(job)
+    command_name = job.pop('command')
+    executor.write(JobRun.objects.record_finished, job_id, "cancelled", None, 0,
+            lease)
+    notify_interrupted(command_name, job,
+            executor.JobCancelled("Job %s was cancelled" % job_id))
+
+class ProjectLocks(object):
+    '''Makes jobs for the same project run one at a time, in the order
+    they arrived, while jobs for different projects run side by side.
+
+    Only the processor's main thread touches this, so it needs no locking
+    of its own.'''
+    def __init__(self):
+        # Every busy project has an entry, holding the jobs waiting for it
+        self.waiting = {}
+
+    def acquire(self, project_id, job):
+        '''Return True if the job can start now. Otherwise it is held until
+        the jobs ahead of it on the project have been released.'''
+        if project_id is None:
+            return True
+        if project_id in self.waiting:
+            self.waiting[project_id].append(job)
+            return False
+        self.waiting[project_id] = deque()
+        return True
+
+    def release(self, project_id):
+        '''Mark the running job for a project finished and return the next
+        job that may start for it, if any.'''
+        if project_id is None:
+            return None
+        waiting = self.waiting[project_id]
+        if waiting:
+            return waiting.popleft()
+        del self.waiting[project_id]
+        return None
+
+    def discard(self, project_id, match):
+        '''Take a waiting job out of the queue for a project. Returns the
+        job, or None if no waiting job matched.'''
+        for job in self.waiting.get(project_id, ()):
+            if match(job):
+                self.waiting[project_id].remove(job)
+                return job
+        return None
+
+def project_key(job):
+    project_id = job.get('project_id')
+    if project_id is None:
+        return None
+    return str(project_id)
+
+class JobProcessor(object):
+    '''Runs jobs pushed by the job server on a pool of threads.
+
+    The server gets one READY per thread, so it never sends us more jobs
+    than we can start. The reserved threads are only offered to the
+    highest priority lane, so an interactive command never has to wait for
+    a buildout to finish. 0MQ sockets can't be shared between threads, so
+    only the main thread talks to the server; pool threads hand finished
+    jobs back over an inproc socket.
+
+    A job that has to wait for another job on its project gives its slot
+    back straight away, so jobs for other projects can use it, and takes
+    over the slot of the job it waited for once that finishes. A job
+    cancelled while it waits is dropped straight away; a running one has
+    its commands killed, which frees its thread.
+
+    A HEARTBEAT with the number of free slots of each kind is sent every
+    heartbeat_interval seconds, so the server knows we're alive even while
+    every thread is busy with a long buildout. It also lists the roots this
+    host can see projects under, so the server only sends us jobs we can
+    run; with no roots we take anything.
+
+    With multiplex, the commands of every thread are watched by a single
+    executor.CommandReactor and notifications and job runs are written
+    through a small executor.WritePool, so a processor can run dozens of
+    jobs at once cheaply: each job thread just sleeps while its command
+    runs.
+
+    run_job is what runs each job, and can be swapped out for testing.'''
+
+    heartbeat_interval = 5
+
+    def __init__(self, context, socket, workers=1, reserved=1, roots=None,
+            run_job=run_job, multiplex=False, database_threads=2):
+        self.context = context
+        self.socket = socket
+        self.workers = workers
+        self.reserved = reserved
+        self.roots = roots or []
+        self.run_job = run_job
+        self.multiplex = multiplex
+        self.database_threads = database_threads
+        self.locks = ProjectLocks()
+        # Jobs received and not yet finished, by id
+        self.jobs = {}
+        # Slots offered to the server with READY and not yet filled
+        self.free = {"": 0, LANES[0]: 0}
+        self.runnable = Queue.Queue()
+        self.finished_address = "inproc://finished-%s" % id(self)
+        self.finished = context.socket(zmq.PULL)
+        self.finished.bind(self.finished_address)
+
+    def run(self):
+        if self.multiplex:
+            executor.reactor = executor.CommandReactor()
+            executor.reactor.start()
+            executor.writes = executor.WritePool(self.database_threads)
+        # Tell the server what we can see before offering any slots
+        self.heartbeat()
+        last_heartbeat = time.time()
+        slots = [""] * self.workers + [LANES[0]] * self.reserved
+        for slot in slots:
+            thread = threading.Thread(target=self.work)
+            thread.setDaemon(True)
+            thread.start()
+            self.ready(slot)
+
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.finished, zmq.POLLIN)
+        while True:
+            for socket, event in poller.poll(self.heartbeat_interval * 1000):
+                if socket is self.socket:
+                    self.receive(self.socket.recv_multipart())
+                else:
+                    self.complete(self.finished.recv_multipart())
+            if time.time() - last_heartbeat >= self.heartbeat_interval:
+                self.heartbeat()
+                last_heartbeat = time.time()
+
+    def heartbeat(self):
+        self.socket.send_multipart(["", "HEARTBEAT", str(self.free[""]),
+            str(self.free[LANES[0]]), json.dumps(self.roots)])
+
+    def ready(self, slot):
+        self.free[slot] += 1
+        if slot:
+            self.socket.send_multipart(["", "READY", slot])
+        else:
+            self.socket.send_multipart(["", "READY"])
+
+    def receive(self, message):
+        if message[1] == "CANCEL":
+            self.cancel(message[2])
+            return
+        job_id, slot = message[1], message[3]
+        lease = message[4] if len(message) > 4 else ""
+        self.free[slot] -= 1
+        try:
+            job = json.loads(message[2])
+            if not isinstance(job, dict):
+                raise ValueError("A job is a JSON object")
+        except ValueError, e:
+            print "Refusing bad job %s: %s" % (job_id, e)
+            executor.write(JobRun.objects.record_finished, job_id, "error",
+                    None, 0, lease)
+            self.socket.send_multipart(["", "DONE", job_id, "error", lease])
+            self.ready(slot)
+            return
+        self.jobs[job_id] = (job_id, job, slot, lease)
+        if self.locks.acquire(project_key(job), self.jobs[job_id]):
+            self.runnable.put(self.jobs[job_id])
+        else:
+            self.ready(slot)
+
+    def cancel(self, job_id):
+        if job_id not in self.jobs:
+            return
+        job_id, job, slot, lease = self.jobs[job_id]
+        waiting = self.locks.discard(project_key(job),
+                lambda waiting: waiting[0] == job_id)
+        if waiting:
+            cancel_waiting_job(job_id, job, lease)
+            del self.jobs[job_id]
+            # Its slot was given back when it started waiting
+            self.socket.send_multipart(["", "DONE", job_id, "cancelled",
+                lease])
+        else:
+            executor.cancel_job(job_id)
+
+    def work(self):
+        finished = self.context.socket(zmq.PUSH)
+        finished.connect(self.finished_address)
+        while True:
+            job_id, job, slot, lease = self.runnable.get()
+            # Whatever happens, the job has to be handed back, or its
+            # slot and its project would stay taken for good
+            status = "error"
+            try:
+                status = self.run_job(job_id, job, lease)
+            except Exception, e:
+                print "Job %s failed to run: %r" % (job_id, e)
+            finished.send_multipart([job_id, project_key(job) or "", slot,
+                status, lease])
+
+    def complete(self, message):
+        job_id, project_id, slot, status, lease = message
+        self.jobs.pop(job_id, None)
+        executor.forget_job(job_id)
+        next_job = self.locks.release(project_id or None)
+        self.socket.send_multipart(["", "DONE", job_id, status, lease])
+        if next_job:
+            # The next job for the project runs in the slot this one leaves
+            next_id, next_job, next_slot, next_lease = next_job
+            self.jobs[next_id] = (next_id, next_job, slot, next_lease)
+            self.runnable.put(self.jobs[next_id])
+        else:
+            self.ready(slot)
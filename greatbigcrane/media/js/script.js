@@ -169,6 +169,7 @@ jQuery(function($){
   
   $('.projects .buildout, .projects .tests').live('click',queue_button('closest', 'li'));
   $('.ajax').live('click',queue_button('closest', 'div.project > section'));
+  $('.update-project').live('click',queue_button('closest', 'div.project'));
   $('.confirm').live('click',function(e){
     e.preventDefault();
     if ( confirm("Are you sure you want to do this?") ) {
@@ -195,6 +196,118 @@ jQuery(function($){
       },update_notifications);
   }
   
+  // Tail the output of the project's newest job, polling quickly while it
+  // is running
+  $('.job-output').each(function(){
+    var $el = $(this), $code = $el.find('code');
+    var job = '', offset = '';
+    function poll() {
+      $.getJSON($el.attr('rel'), {job: job, offset: offset}, function(data) {
+        if ( data ) {
+          if ( data.job != job ) {
+            $code.text('');
+            job = data.job;
+          }
+          $code.append(document.createTextNode(data.output));
+          $code.scrollTop($code.attr('scrollHeight'));
+          offset = data.offset;
+          $el.show().find('.status').text(data.running ? '(running)' : '');
+          $el.find('.cancel-job').attr('href', '/jobs/cancel/' + data.job + '/')
+            .toggle(data.running);
+        }
+        setTimeout(poll, data && data.running ? 1000 : 5000);
+      });
+    }
+    poll();
+  });
+
+  // Queue a command on a group of projects and show how far the batch has
+  // got until all of its jobs have finished
+  $('form.bulk-jobs').submit(function(ev){
+    ev.preventDefault();
+    var $batches = $(this).find('.batches');
+    $.post($(this).attr('action'), $(this).serialize(), function(data) {
+      var $li = $('<li/>').text(data.message).prependTo($batches);
+      if ( !data.jobs ) { return; }
+      var $progress = $('<span class="progress"/>').appendTo($li);
+      function poll() {
+        $.getJSON('/jobs/batch/' + data.batch + '/', function(progress) {
+          var failed = progress.error + progress.timeout;
+          $progress.text(': ' + progress.finished + '/' + data.jobs +
+            ' finished, ' + progress.running + ' running' +
+            (failed ? ', ' + failed + ' failed' : ''));
+          $li.toggleClass('error', failed > 0);
+          if ( progress.finished < data.jobs ) {
+            setTimeout(poll, 2000);
+          }
+        });
+      }
+      poll();
+    }, 'json');
+  });
+
+  // Show what the job server has queued and running, from a small JSON
+  // snapshot of its memory
+  $('.queue-dashboard').each(function(){
+    var $el = $(this);
+    function seconds(value) {
+      if ( value === null ) { return ''; }
+      return value < 60 ? value.toFixed(1) + 's' : Math.round(value / 60) + 'm';
+    }
+    function row(cells) {
+      var $tr = $('<tr/>');
+      $.each(cells, function(i, cell){ $('<td/>').text(cell).appendTo($tr); });
+      return $tr;
+    }
+    function histogram($table, buckets, summaries) {
+      var $head = $('<tr><th></th><th>Samples</th><th>50% / 90% / 99%</th></tr>');
+      $.each(buckets, function(i, bucket){
+        $('<th/>').text('< ' + seconds(bucket)).appendTo($head);
+      });
+      $('<th/>').text('longer').appendTo($head);
+      $table.find('thead').empty().append($head);
+      var $body = $table.find('tbody').empty();
+      $.each(summaries, function(name, summary){
+        $body.append(row([name, summary.samples,
+          $.map(summary.percentiles, seconds).join(' / ')]
+          .concat(summary.histogram)));
+      });
+    }
+    function poll() {
+      $.getJSON($el.attr('rel'), function(data) {
+        $el.find('.error').text(data.error || '').toggle(!!data.error);
+        if ( !data.error ) {
+          var $lanes = $el.find('.lanes tbody').empty();
+          $.each(data.lanes, function(lane, info){
+            $lanes.append(row([lane, info.depth, seconds(info.oldest_wait)]));
+          });
+          $lanes.append(row(['delayed', data.delayed, '']));
+          var $workers = $el.find('.workers tbody').empty();
+          $.each(data.workers, function(i, worker){
+            $workers.append(row([worker.address, worker.free,
+              $.map(worker.jobs, function(job){
+                return job.command + ' #' + job.id + ' (' + seconds(job.running_for) + ')';
+              }).join(', '),
+              seconds(worker.last_seen) + ' ago', worker.done + ' / ' + worker.lost]));
+          });
+          histogram($el.find('.queue-wait'), data.buckets, data.queue_wait);
+          histogram($el.find('.run-time'), data.buckets, data.run_time);
+        }
+        setTimeout(poll, 3000);
+      });
+    }
+    poll();
+  });
+
+  $('a.cancel-job').live('click', function(ev){
+    ev.preventDefault();
+    var $link = $(this);
+    $.post($link.attr('href'), {}, function(data) {
+      $('<span class="notice"/>').text(data).insertAfter($link.hide())
+        .delay(2000).fadeOut(function(){$(this).remove()});
+    });
+  });
+
   $("#recipe_form").submit(function() {
     if ($("#available_recipes").val() == "") {
       alert("Must select a recipe");
@@ -20,9 +20,24 @@ from django.db import models
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from buildout_manage.parser import buildout_parse
+from buildout_manage.cache import extend_defaults
 
 make_choice = lambda x: ([(p,p) for p in x])
 
+# Groups of projects that actions can be run on all at once
+PROJECT_FILTERS = ["all", "favourites", "buildout", "pip"]
+
+class ProjectManager(models.Manager):
+    def filtered(self, project_filter):
+        '''Return the projects in one of the PROJECT_FILTERS groups.'''
+        if project_filter == "favourites":
+            return self.filter(favourite=True)
+        elif project_filter in ("buildout", "pip"):
+            return self.filter(project_type=project_filter)
+        elif project_filter == "all":
+            return self.all()
+        raise ValueError("Unknown project filter %s" % project_filter)
+
 class Project(models.Model):
     name = models.CharField(max_length=32)
     base_directory = models.CharField(max_length=512, unique=True)
@@ -34,8 +49,18 @@ class Project(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
     test_status = models.BooleanField(default=False)
+    # Fingerprint of the code and configuration the tests last passed on;
+    # see job_queue.jobs.test_fingerprint
+    test_fingerprint = models.CharField(max_length=40, blank=True,
+            editable=False)
+    # Likewise for the last successful buildout; see
+    # job_queue.jobs.buildout_fingerprint
+    buildout_fingerprint = models.CharField(max_length=40, blank=True,
+            editable=False)
     favourite = models.BooleanField(default=False)
 
+    objects = ProjectManager()
+
     def get_absolute_url(self):
         return reverse("view_project", args=[self.id])
 
@@ -98,6 +123,9 @@ class Project(models.Model):
         for source, dest in skeleton:
             if not os.path.isfile(dest):
                 copyfile(source, dest)
+                if dest.endswith(".cfg"):
+                    # Use the shared egg and download cache
+                    extend_defaults(dest)
 
     def prep_pip_project(self):
         if not os.path.isdir(self.base_directory):
@@ -117,6 +145,10 @@ class PipProject(models.Model):
     test_command = models.CharField(max_length=128,
             blank=True,
             help_text="Command to run tests. Eg: py.test, nose, ./run_tests.py")
+    # The requirements the last successful install installed, and the
+    # packages pip resolved them to
+    installed_requirements = models.TextField(blank=True, editable=False)
+    installed_packages = models.TextField(blank=True, editable=False)
 
     @property
     def requirements(self):
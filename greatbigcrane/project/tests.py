@@ -82,3 +82,19 @@ class ProjectGithubUrlTests(TestCase):
         p = Project(name="great big crane", 
                 git_repo="git://github.com/pnomolos/Django-Dash-2010")
         assert p.github_url() == "http://github.com/pnomolos/Django-Dash-2010"
+
+class ProjectFilterTests(TestCase):
+    def setUp(self):
+        Project.objects.create(name="crane", base_directory="/tmp/crane",
+                project_type="buildout", favourite=True)
+        Project.objects.create(name="hoist", base_directory="/tmp/hoist",
+                project_type="pip")
+
+    def names(self, project_filter):
+        return sorted(p.name for p in Project.objects.filtered(project_filter))
+
+    def test_filters(self):
+        assert self.names("all") == ["crane", "hoist"]
+        assert self.names("favourites") == ["crane"]
+        assert self.names("buildout") == ["crane"]
+        assert self.names("pip") == ["hoist"]
@@ -28,7 +28,8 @@ from django.template.loader import render_to_string
 from django.http import HttpResponse
 from django.forms.util import ErrorList
 
-from job_queue.jobs import queue_job
+from job_queue.jobs import queue_job, queue_pipeline, clone_steps
+from job_queue.forms import BulkJobForm
 from project.models import Project, PipProject
 from project.forms import AddProjectForm, EditProjectForm, PipProjectForm
 from preferences.models import Preference
@@ -54,7 +55,7 @@ def list_projects(request):
     return object_list(request, projects,
             template_name="project/project_list.html",
             template_object_name="project",
-            extra_context={'orderby': orderby})
+            extra_context={'orderby': orderby, 'bulk_form': BulkJobForm()})
 
 def view_project(request, project_id):
     return object_detail(request, Project.objects.all(), object_id=project_id,
@@ -74,7 +75,7 @@ def add_project(request):
                 if target_dir and not os.path.isdir(target_dir):
                     os.makedirs(target_dir)
                 instance = form.save()
-                queue_job("GITCLONE", project_id=instance.id)
+                queue_pipeline(clone_steps(instance))
             else:
                 instance = form.save()
                 instance.prep_project()
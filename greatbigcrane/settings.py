@@ -30,6 +30,49 @@ DATABASE_PASSWORD = ''         # Not used with sqlite3.
 DATABASE_HOST = ''             # Set to empty string for localhost. Not used with sqlite3.
 DATABASE_PORT = ''             # Set to empty string for default. Not used with sqlite3.
 
+# Address the job server listens on, and the address the web app and job
+# processors connect to it at. Bind to tcp://*:5555 to accept job processors
+# on other hosts.
+JOB_SERVER_BIND = 'tcp://127.0.0.1:5555'
+JOB_SERVER_ADDRESS = 'tcp://127.0.0.1:5555'
+
+# File the job server records queued jobs in, so they survive a restart.
+# Set to '' to keep the queue in memory only.
+JOB_QUEUE_JOURNAL = os.path.join(PROJECT_HOME, 'job_queue.journal')
+
+# Seconds the web app waits for the job server to acknowledge a job before
+# spooling it to disk, and where spooled jobs wait for the server to return
+JOB_CLIENT_TIMEOUT = 2
+JOB_SPOOL_DIRECTORY = os.path.join(PROJECT_HOME, 'job_spool')
+
+# Directory the output of running and recent jobs is logged to
+JOB_OUTPUT_DIRECTORY = os.path.join(PROJECT_HOME, 'job_output')
+
+# Where buildouts share the eggs and downloads they fetch, so each one is
+# only fetched once
+BUILDOUT_CACHE_DIRECTORY = os.path.join(PROJECT_HOME, 'buildout_cache')
+
+# Where pip projects share the wheels they install, and how many missing wheels
+# a PIPINSTALL job builds at once
+PIP_WHEELHOUSE_DIRECTORY = os.path.join(PROJECT_HOME, 'wheelhouse')
+PIP_WHEEL_PARALLELISM = 4
+
+# Where virtualenvs with common sets of requirements are kept for new pip
+# projects' environments to be copied from, how many of them to keep, and the
+# interpreter they use (None for the one virtualenv runs with)
+VIRTUALENV_TEMPLATE_DIRECTORY = os.path.join(PROJECT_HOME, 'venv_templates')
+VIRTUALENV_TEMPLATES = 8
+VIRTUALENV_PYTHON = None
+
+# Where bare mirrors of the projects' git repositories are kept, so clones and
+# pulls fetch each repository from its remote once however many checkouts of
+# it there are, and how many seconds a mirror stays fresh after a fetch
+GIT_MIRROR_DIRECTORY = os.path.join(PROJECT_HOME, 'git_mirrors')
+GIT_MIRROR_MAX_AGE = 60
+
+# How many of a project's test suites a TEST job runs at once
+TEST_PARALLELISM = 4
+
 TIME_ZONE = 'America/Chicago'
 
 LANGUAGE_CODE = 'en-us'